@@ -1,6 +1,8 @@
 # src/db/mongo.py
-from pymongo import MongoClient
+from pymongo import MongoClient, ReplaceOne
 import os
+import re
+import hashlib
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -14,3 +16,18 @@ db = client['ai_innovation']
 
 def get_collection(name):
     return db[name]
+
+
+def content_id(*parts) -> str:
+    """Deterministic _id from normalized content, so re-running a node upserts instead of duplicating."""
+    norm = "\x1f".join(re.sub(r"\s+", " ", str(p or "")).strip().lower() for p in parts)
+    return hashlib.blake2b(norm.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def bulk_upsert(name, docs):
+    """Upsert docs by _id in one unordered bulk_write round-trip. Returns the number of docs written."""
+    if not docs:
+        return 0
+    ops = [ReplaceOne({"_id": d["_id"]}, d, upsert=True) for d in docs]
+    get_collection(name).bulk_write(ops, ordered=False)
+    return len(ops)
@@ -1,110 +1,509 @@
 # src/gemini_client.py
 import os
 import json
-import re
+import threading
+from typing import Optional
 from dotenv import load_dotenv
 load_dotenv()
 
+from src.llm_cache import llm_cache, make_key, LLM_CACHE_ENABLED
+from src.llm_governor import governor, is_rate_limit_error, LLMQueueTimeout, LLM_MAX_CONCURRENCY
+from src.singleflight import SingleFlight
+
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-pro")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
 
+# keep-alive pool defaults to the governor's in-flight cap so admitted calls never queue for a connection
+GEMINI_POOL_SIZE = int(os.getenv("GEMINI_POOL_SIZE", str(LLM_MAX_CONCURRENCY)))
+GEMINI_TIMEOUT_MS = int(os.getenv("GEMINI_TIMEOUT_MS", "600000"))
+
+# Process-wide client. Building a genai.Client per prompt costs client setup plus a
+# fresh TLS handshake, so we create one lazily and share it (and its keep-alive pool).
+_client = None
+_client_lock = threading.Lock()
+
+
+def _build_http_options(types):
+    """HttpOptions with a keep-alive httpx pool sized by GEMINI_POOL_SIZE.
+    Older google-genai releases don't accept client_args, so degrade to defaults."""
+    try:
+        import httpx
+        limits = httpx.Limits(
+            max_connections=GEMINI_POOL_SIZE,
+            max_keepalive_connections=GEMINI_POOL_SIZE,
+            keepalive_expiry=60.0,
+        )
+        return types.HttpOptions(
+            timeout=GEMINI_TIMEOUT_MS,
+            client_args={"limits": limits},
+            async_client_args={"limits": limits},
+        )
+    except Exception:
+        try:
+            return types.HttpOptions(timeout=GEMINI_TIMEOUT_MS)
+        except Exception:
+            return None
+
+
+def get_client():
+    """Return the shared genai.Client, creating it on first use (thread-safe)."""
+    global _client
+    if _client is not None:
+        return _client
+    with _client_lock:
+        if _client is None:
+            from google import genai
+            from google.genai import types
+            if not GEMINI_API_KEY:
+                raise RuntimeError("GEMINI_API_KEY not set in environment")
+            http_options = _build_http_options(types)
+            if http_options is not None:
+                _client = genai.Client(api_key=GEMINI_API_KEY, http_options=http_options)
+            else:
+                _client = genai.Client(api_key=GEMINI_API_KEY)
+    return _client
+
+
+def reset_client():
+    """Drop the shared client (e.g. after rotating GEMINI_API_KEY); the next call rebuilds it."""
+    global _client
+    with _client_lock:
+        old, _client = _client, None
+    if old is not None:
+        try:
+            old.close()
+        except Exception:
+            pass
+
+
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "4"))
+
+
+def _call_failed(e: Exception):
+    # Provide explicit guidance so callers can debug quickly
+    return RuntimeError(
+        "Gemini call failed. Ensure google-genai is installed and GEMINI_API_KEY is set. "
+        f"Original error: {e}"
+    )
+
+
+def _schema_rejected(e: Exception) -> bool:
+    """True if a call failed with HTTP 400 / INVALID_ARGUMENT, per the SDK error's code or status
+    (wrapped errors are unwrapped via __cause__), e.g. a model that doesn't take response_schema."""
+    err = e.__cause__ or e
+    code = getattr(err, "code", None) or getattr(err, "status_code", None)
+    return code == 400 or getattr(err, "status", None) == "INVALID_ARGUMENT"
+
+
+def _response_text(resp) -> str:
+    # try common fields
+    if hasattr(resp, "text"):
+        return getattr(resp, "text")
+    # fallback: stringify
+    return str(resp)
+
+
 # Basic wrapper for calling Gemini via google-genai SDK if available.
 # If google-genai isn't installed or not configured, this will raise an informative error.
+# Every call goes through the shared governor: it waits for a rate/concurrency slot and,
+# on 429/quota errors, backs the whole process off and retries instead of failing.
 
-def raw_model_call(prompt: str) -> str:
+def raw_model_call(prompt: str, config: Optional[dict] = None) -> str:
     """Return raw text from the model. Raise RuntimeError with helpful message if call fails."""
-    try:
-        from google import genai
-        if not GEMINI_API_KEY:
-            raise RuntimeError("GEMINI_API_KEY not set in environment")
-        genai.api_key = GEMINI_API_KEY
-        client = genai.Client()
-        resp = client.models.generate_content(model=GEMINI_MODEL, contents=prompt)
-        # try common fields
-        if hasattr(resp, "text"):
-            return getattr(resp, "text")
-        # fallback: stringify
-        return str(resp)
-    except Exception as e:
-        # Provide explicit guidance so callers can debug quickly
-        raise RuntimeError(
-            "Gemini call failed. Ensure google-genai is installed and GEMINI_API_KEY is set. "
-            f"Original error: {e}"
-        )
+    for attempt in range(GEMINI_MAX_RETRIES + 1):
+        try:
+            client = get_client()
+            with governor.slot():
+                if config:
+                    resp = client.models.generate_content(model=GEMINI_MODEL, contents=prompt, config=config)
+                else:
+                    resp = client.models.generate_content(model=GEMINI_MODEL, contents=prompt)
+            governor.on_success()
+            return _response_text(resp)
+        except LLMQueueTimeout:
+            raise
+        except Exception as e:
+            if is_rate_limit_error(e) and attempt < GEMINI_MAX_RETRIES:
+                governor.on_throttle()
+                continue
+            raise _call_failed(e) from e
+
+
+async def araw_model_call(prompt: str, config: Optional[dict] = None) -> str:
+    """Async counterpart of raw_model_call using the shared client's aio surface."""
+    for attempt in range(GEMINI_MAX_RETRIES + 1):
+        try:
+            client = get_client()
+            async with governor.aslot():
+                if config:
+                    resp = await client.aio.models.generate_content(model=GEMINI_MODEL, contents=prompt, config=config)
+                else:
+                    resp = await client.aio.models.generate_content(model=GEMINI_MODEL, contents=prompt)
+            governor.on_success()
+            return _response_text(resp)
+        except LLMQueueTimeout:
+            raise
+        except Exception as e:
+            if is_rate_limit_error(e) and attempt < GEMINI_MAX_RETRIES:
+                governor.on_throttle()
+                continue
+            raise _call_failed(e) from e
+
+
+def generate_text_stream(prompt: str, use_cache: bool = True, config: Optional[dict] = None):
+    """Yield text chunks as Gemini produces them (SDK streaming API).
+    A cache hit is yielded as a single chunk; a completed stream is written to the cache.
+    429s before the first chunk are retried through the governor like raw_model_call."""
+    key = make_key("text", GEMINI_MODEL, prompt, config)
+    if use_cache and LLM_CACHE_ENABLED:
+        cached = llm_cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+    parts = []
+    for attempt in range(GEMINI_MAX_RETRIES + 1):
+        try:
+            client = get_client()
+            with governor.slot() as admit:
+                kwargs = {"model": GEMINI_MODEL, "contents": prompt}
+                if config:
+                    kwargs["config"] = config
+                for chunk in client.models.generate_content_stream(**kwargs):
+                    # the request is admitted; don't hold the slot while the caller consumes chunks
+                    admit()
+                    text = getattr(chunk, "text", None)
+                    if text:
+                        parts.append(text)
+                        yield text
+            governor.on_success()
+            break
+        except LLMQueueTimeout:
+            raise
+        except Exception as e:
+            if not parts and is_rate_limit_error(e) and attempt < GEMINI_MAX_RETRIES:
+                governor.on_throttle()
+                continue
+            raise _call_failed(e) from e
+
+    full = "".join(parts)
+    if use_cache and LLM_CACHE_ENABLED and full:
+        llm_cache.set(key, full)
 
 
 # Helpers for extracting JSON from model responses
-_json_re = re.compile(r"(\[\s*\{.*?\}\s*\])", re.DOTALL)
-_obj_re = re.compile(r"(\{.*\})", re.DOTALL)
-
-
-def _extract_json_with_regex(text: str):
-    # try array first
-    m = _json_re.search(text)
-    if m:
-        return m.group(1)
-    m = _obj_re.search(text)
-    if m:
-        return m.group(1)
-    return None
+_OPENERS = {"[": "]", "{": "}"}
+
+
+def _iter_balanced_spans(text: str):
+    """Yield (start, end) of every top-level [...] / {...} span, scanning left to right.
+    Brackets inside JSON strings (including escaped quotes) are ignored. When a span can't
+    close — a stray "{" in prose, a mismatched closer, or a prose quote inside an open bracket
+    swallowing the rest — scanning restarts just after its opener, so later JSON is still found."""
+    pos = 0
+    while pos < len(text):
+        stack = []
+        in_str = False
+        escaped = False
+        start = -1
+        for i in range(pos, len(text)):
+            ch = text[i]
+            if in_str:
+                if escaped:
+                    escaped = False
+                elif ch == "\\":
+                    escaped = True
+                elif ch == '"':
+                    in_str = False
+                continue
+            if ch == '"' and stack:
+                in_str = True
+            elif ch in _OPENERS:
+                if not stack:
+                    start = i
+                stack.append(_OPENERS[ch])
+            elif stack and ch == stack[-1]:
+                stack.pop()
+                if not stack:
+                    yield start, i + 1
+            elif stack and ch in ("]", "}"):
+                # mismatched closer: prose like "[see {note]" — abandon this span
+                break
+        if not stack:
+            return
+        pos = start + 1
+
+
+def _extract_json_balanced(text: str):
+    """Return the largest parseable top-level JSON array/object in text, or None.
+    Replaces the old greedy regexes, which over-matched across multiple objects."""
+    if not text:
+        return None
+    best = None
+    best_len = 0
+    for a, b in _iter_balanced_spans(text):
+        if b - a <= best_len:
+            continue
+        try:
+            best = json.loads(text[a:b])
+            best_len = b - a
+        except Exception:
+            continue
+    return best
+
+
+# Coalesce identical in-flight prompts (sync and async callers share the same flights)
+_text_flights = SingleFlight("gemini_text")
+_json_flights = SingleFlight("gemini_json")
+
+
+# How often each parsing path resolves a generate_json call
+_json_stats = {"calls": 0, "schema_calls": 0, "direct": 0, "extracted": 0,
+               "cleanup_fired": 0, "cleanup_succeeded": 0, "failed": 0}
+_json_stats_lock = threading.Lock()
+
+
+def _count(name: str):
+    with _json_stats_lock:
+        _json_stats[name] += 1
+
+
+def json_parse_stats() -> dict:
+    """Counters for generate_json; cleanup_fired shows how often the second model call still runs."""
+    with _json_stats_lock:
+        return dict(_json_stats)
+
 
+def _json_config(schema: Optional[dict]) -> dict:
+    # response_mime_type alone already makes Gemini emit bare JSON; the schema pins the shape
+    config = {"response_mime_type": "application/json"}
+    if schema:
+        config["response_schema"] = schema
+    return config
 
-def generate_text(prompt: str) -> str:
-    return raw_model_call(prompt)
 
+def generate_text(prompt: str, use_cache: bool = True, config: Optional[dict] = None) -> str:
+    """Return model text for prompt. Identical prompts are served from the LLM cache (or
+    joined onto an identical in-flight call) unless use_cache=False. config is passed
+    through as the SDK's GenerateContentConfig."""
+    if not use_cache:
+        return raw_model_call(prompt, config=config)
+    key = make_key("text", GEMINI_MODEL, prompt, config)
+    if LLM_CACHE_ENABLED:
+        cached = llm_cache.get(key)
+        if cached is not None:
+            return cached
 
-def generate_json(prompt: str, debug=False, cleanup_attempt=True):
+    def _call():
+        raw = raw_model_call(prompt, config=config)
+        if LLM_CACHE_ENABLED and raw:
+            llm_cache.set(key, raw)
+        return raw
+
+    # identical prompts already in flight share one upstream call
+    return _text_flights.do(key, _call)
+
+
+def generate_json(prompt: str, debug=False, cleanup_attempt=True, use_cache: bool = True,
+                  schema: Optional[dict] = None, structured: bool = True):
     """Return (parsed, raw_text) or (None, raw_text) if parsing fails.
-    Attempts direct JSON, then regex extraction, then a cleanup pass asking the model to return only JSON.
+    With structured=True the request asks Gemini for application/json (constrained by
+    `schema` when given), so the direct parse normally succeeds. Otherwise falls back to
+    balanced-bracket extraction, then a cleanup pass asking the model to return only JSON.
+    Successfully parsed results are cached, so a hit skips extraction and cleanup entirely;
+    failed parses are never cached so a retry gets a fresh completion.
     """
-    raw = generate_text(prompt)
+    config = _json_config(schema) if structured else None
+    if not use_cache:
+        return _generate_json_uncached(prompt, debug=debug, cleanup_attempt=cleanup_attempt, config=config)
+    key = make_key("json", GEMINI_MODEL, prompt, config)
+    if LLM_CACHE_ENABLED:
+        cached = llm_cache.get(key)
+        if cached is not None:
+            return cached["parsed"], cached["raw"]
+
+    def _call():
+        parsed, raw = _generate_json_uncached(prompt, debug=debug, cleanup_attempt=cleanup_attempt, config=config)
+        if LLM_CACHE_ENABLED and parsed is not None:
+            llm_cache.set(key, {"parsed": parsed, "raw": raw})
+        return parsed, raw
+
+    return _json_flights.do(key, _call)
+
+
+def _generate_json_uncached(prompt: str, debug=False, cleanup_attempt=True, config: Optional[dict] = None):
+    _count("calls")
+    if config:
+        _count("schema_calls")
+    try:
+        raw = generate_text(prompt, use_cache=False, config=config)
+    except RuntimeError as e:
+        if not config or not _schema_rejected(e):
+            raise
+        # older models / SDKs may reject response_schema; retry as plain text
+        if debug:
+            print("[DEBUG] structured call rejected, retrying without schema")
+        raw = generate_text(prompt, use_cache=False)
     if debug:
         print("[DEBUG] Gemini raw (first call):", raw[:1200])
+    return _parse_json_response(raw, debug=debug, cleanup_attempt=cleanup_attempt,
+                                cleanup_call=lambda p: generate_text(p, use_cache=False))
+
+
+def _cleanup_prompt(raw: str) -> str:
+    return (
+        "The text below may contain commentary and JSON. Extract and return ONLY the JSON array or object present. "
+        "If there is no JSON, return an empty array []\n\n"
+        "ORIGINAL TEXT:\n----START----\n"
+        f"{raw}\n"
+        "----END----\n\nReturn only JSON."
+    )
 
-    # try direct parse
+
+def _parse_local(raw: str):
+    """Direct json.loads, then balanced extraction. Returns (parsed, path) or (None, None)."""
     try:
-        parsed = json.loads(raw)
-        return parsed, raw
+        return json.loads(raw), "direct"
     except Exception:
         pass
+    candidate = _extract_json_balanced(raw)
+    if candidate is not None:
+        return candidate, "extracted"
+    return None, None
 
-    # regex extraction
-    candidate = _extract_json_with_regex(raw)
-    if candidate:
-        try:
-            parsed = json.loads(candidate)
-            return parsed, raw
-        except Exception:
-            if debug:
-                print("[DEBUG] regex found JSON-like content but json.loads failed")
 
+def parse_json_text(raw: str):
+    """Parse JSON out of already-received model text (no cleanup call). Returns None if none found."""
+    parsed, _ = _parse_local(raw or "")
+    return parsed
+
+
+# The parsing steps below are shared by the sync and async paths; only the cleanup call differs.
+def _parse_first(raw: str, debug=False):
+    """(parsed, raw) if the first response parses locally, else None."""
+    parsed, path = _parse_local(raw)
+    if path:
+        _count(path)
+        return parsed, raw
+    if debug:
+        print("[DEBUG] no parseable JSON found in first response")
+    return None
+
+
+def _parse_cleanup(raw2: str, debug=False):
+    """(parsed, raw2) if the cleanup response parses locally, else None."""
+    if debug:
+        print("[DEBUG] Gemini raw (cleanup call):", raw2[:1200])
+    parsed2, path2 = _parse_local(raw2)
+    if path2:
+        _count("cleanup_succeeded")
+        return parsed2, raw2
+    return None
+
+
+def _parse_failed(raw: str):
+    _count("failed")
+    return None, raw
+
+
+def _parse_json_response(raw: str, debug=False, cleanup_attempt=True, cleanup_call=None):
+    result = _parse_first(raw, debug)
     # cleanup attempt — ask model to return only JSON
-    if cleanup_attempt:
-        cleanup_prompt = (
-            "The text below may contain commentary and JSON. Extract and return ONLY the JSON array or object present. "
-            "If there is no JSON, return an empty array []\n\n"
-            "ORIGINAL TEXT:\n----START----\n"
-            f"{raw}\n"
-            "----END----\n\nReturn only JSON."
-        )
+    if result is None and cleanup_attempt and cleanup_call is not None:
+        _count("cleanup_fired")
         try:
-            raw2 = generate_text(cleanup_prompt)
-            if debug:
-                print("[DEBUG] Gemini raw (cleanup call):", raw2[:1200])
-            try:
-                parsed2 = json.loads(raw2)
-                return parsed2, raw2
-            except Exception:
-                candidate2 = _extract_json_with_regex(raw2)
-                if candidate2:
-                    try:
-                        parsed2 = json.loads(candidate2)
-                        return parsed2, raw2
-                    except Exception:
-                        pass
+            result = _parse_cleanup(cleanup_call(_cleanup_prompt(raw)), debug)
         except Exception as e:
             # If cleanup call fails, return best-effort raw
             if debug:
                 print("[DEBUG] cleanup call failed:", e)
-    return None, raw
\ No newline at end of file
+    return result or _parse_failed(raw)
+
+
+async def _aparse_json_response(raw: str, debug=False, cleanup_attempt=True, acleanup_call=None):
+    """_parse_json_response with an awaitable cleanup call."""
+    result = _parse_first(raw, debug)
+    if result is None and cleanup_attempt and acleanup_call is not None:
+        _count("cleanup_fired")
+        try:
+            result = _parse_cleanup(await acleanup_call(_cleanup_prompt(raw)), debug)
+        except Exception as e:
+            if debug:
+                print("[DEBUG] cleanup call failed:", e)
+    return result or _parse_failed(raw)
+
+
+# ---------------------------------------------------------
+# Async API — same caching, parsing and fallback semantics as the sync functions
+# ---------------------------------------------------------
+async def agenerate_text(prompt: str, use_cache: bool = True, config: Optional[dict] = None) -> str:
+    if not use_cache:
+        return await araw_model_call(prompt, config=config)
+    key = make_key("text", GEMINI_MODEL, prompt, config)
+    if LLM_CACHE_ENABLED:
+        cached = llm_cache.get(key)
+        if cached is not None:
+            return cached
+
+    async def _call():
+        raw = await araw_model_call(prompt, config=config)
+        if LLM_CACHE_ENABLED and raw:
+            llm_cache.set(key, raw)
+        return raw
+
+    return await _text_flights.ado(key, _call)
+
+
+async def agenerate_json(prompt: str, debug=False, cleanup_attempt=True, use_cache: bool = True,
+                         schema: Optional[dict] = None, structured: bool = True):
+    """Async generate_json. Returns (parsed, raw_text) or (None, raw_text)."""
+    config = _json_config(schema) if structured else None
+    if not use_cache:
+        return await _agenerate_json_uncached(prompt, debug=debug, cleanup_attempt=cleanup_attempt, config=config)
+    key = make_key("json", GEMINI_MODEL, prompt, config)
+    if LLM_CACHE_ENABLED:
+        cached = llm_cache.get(key)
+        if cached is not None:
+            return cached["parsed"], cached["raw"]
+
+    async def _call():
+        parsed, raw = await _agenerate_json_uncached(prompt, debug=debug, cleanup_attempt=cleanup_attempt, config=config)
+        if LLM_CACHE_ENABLED and parsed is not None:
+            llm_cache.set(key, {"parsed": parsed, "raw": raw})
+        return parsed, raw
+
+    return await _json_flights.ado(key, _call)
+
+
+async def _agenerate_json_uncached(prompt: str, debug=False, cleanup_attempt=True, config: Optional[dict] = None):
+    _count("calls")
+    if config:
+        _count("schema_calls")
+    try:
+        raw = await agenerate_text(prompt, use_cache=False, config=config)
+    except RuntimeError as e:
+        if not config or not _schema_rejected(e):
+            raise
+        if debug:
+            print("[DEBUG] structured call rejected, retrying without schema")
+        raw = await agenerate_text(prompt, use_cache=False)
+    if debug:
+        print("[DEBUG] Gemini raw (first call):", raw[:1200])
+    return await _aparse_json_response(raw, debug=debug, cleanup_attempt=cleanup_attempt,
+                                       acleanup_call=lambda p: agenerate_text(p, use_cache=False))
+
+
+def cache_stats() -> dict:
+    """Hit/miss counters for the LLM response cache."""
+    return llm_cache.get_stats()
+
+
+def llm_stats() -> dict:
+    """Cache, JSON-parsing and rate-governor counters in one payload."""
+    return {
+        "cache": cache_stats(),
+        "json": json_parse_stats(),
+        "governor": governor.metrics(),
+        "coalescing": {"text": dict(_text_flights.stats), "json": dict(_json_flights.stats)},
+    }
@@ -0,0 +1,312 @@
+# src/jobs.py
+"""
+Background jobs for long workflow stages (session start, idea generation, action plans).
+- Jobs are queued and run as asyncio tasks on the API's event loop by JOB_WORKERS worker
+  tasks, which bounds how many stages run at once; blocking work inside a job uses asyncio.to_thread.
+- Each job records status (queued|running|succeeded|failed|cancelled), progress, result and error.
+- The manager's state belongs to the event loop: call its methods from async code (async
+  endpoints), using adescribe/acancel/alist where the shared store may be read.
+- Cancelling a queued job drops it; cancelling a running job cancels its task at the next await
+  (a worker thread already inside a blocking call finishes that call first).
+- With JOB_STORE=mongo (the default whenever sessions are in Mongo) job state is also written to
+  the `jobs` collection (expiring after JOB_TTL), so status, results and per-session job lists are
+  served by any API worker and survive a restart. A cancel that lands on another worker is
+  recorded there and picked up by the owning worker within JOB_CANCEL_POLL seconds.
+"""
+
+from typing import Any, Awaitable, Callable, Dict, Optional
+from collections import OrderedDict
+import os
+import time
+import uuid
+import asyncio
+import logging
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_STORE = os.getenv("JOB_STORE", os.getenv("SESSION_STORE", "mongo")).lower()   # memory | mongo
+JOB_TTL = float(os.getenv("JOB_TTL", str(24 * 3600)))
+JOB_MAX_RETAINED = int(os.getenv("JOB_MAX_RETAINED", "500"))
+JOB_CANCEL_POLL = float(os.getenv("JOB_CANCEL_POLL", "2"))
+WORKER_ID = uuid.uuid4().hex   # identifies this process as the owner of the jobs it runs
+_PERSIST_INTERVAL = 1.0   # seconds between progress writes to Mongo
+
+TERMINAL_STATES = ("succeeded", "failed", "cancelled")
+
+
+class Job:
+    def __init__(self, kind: str, fn: Callable[["Job"], Awaitable[Any]], session_id: Optional[str], manager: "JobManager"):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.session_id = session_id
+        self.fn = fn
+        self.status = "queued"
+        self.progress: Dict[str, Any] = {}
+        self.result = None
+        self.error = None
+        self.cancel_requested = False
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.task: Optional[asyncio.Task] = None
+        self._manager = manager
+
+    @property
+    def done(self) -> bool:
+        return self.status in TERMINAL_STATES
+
+    def report(self, **fields):
+        """Merge fields into the job's progress. Safe to call from worker threads."""
+        self.progress = {**self.progress, **fields, "updated_at": time.time()}
+        self._manager._progress_changed(self)
+
+    def to_dict(self, include_result: bool = False) -> Dict[str, Any]:
+        out = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "session_id": self.session_id,
+            "owner": WORKER_ID,
+            "status": self.status,
+            "progress": self.progress,
+            "error": self.error,
+            "cancel_requested": self.cancel_requested,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if include_result:
+            out["result"] = self.result
+        return out
+
+
+class JobManager:
+    def __init__(self, workers: int = JOB_WORKERS, store: str = JOB_STORE):
+        self.workers = max(1, workers)
+        self.store = store
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks = []
+        self._last_persist: Dict[str, float] = {}
+        self._mongo_col = None
+
+    # ---- workers ----
+    def _ensure_workers(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._worker_tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+        if self.store == "mongo":
+            self._worker_tasks.append(loop.create_task(self._cancel_watcher()))
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                if job.status == "queued":
+                    await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _cancel_watcher(self):
+        # cancels requested through another worker are only visible in Mongo
+        while True:
+            await asyncio.sleep(JOB_CANCEL_POLL)
+            ids = [j.id for j in self._jobs.values() if not j.done]
+            if not ids:
+                continue
+            try:
+                docs = await asyncio.to_thread(
+                    lambda: list(self._collection().find({"_id": {"$in": ids}, "cancel_requested": True}, {"_id": 1})))
+            except Exception as e:
+                logging.warning("job cancel poll failed: %s", e)
+                continue
+            for doc in docs:
+                self.cancel(doc["_id"])
+
+    async def _run(self, job: Job):
+        # the task exists before the job is reported running, so a cancel always has something to cancel
+        job.task = asyncio.create_task(job.fn(job))
+        job.status = "running"
+        job.started_at = time.time()
+        self._save(job)
+        try:
+            job.result = await job.task
+            job.status = "succeeded"
+        except asyncio.CancelledError:
+            if not job.task.cancelled():
+                raise
+            job.status = "cancelled"
+        except Exception as e:
+            logging.exception("Job %s (%s) failed", job.id, job.kind)
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            job.task = None
+            self._save(job)
+
+    # ---- public API ----
+    def submit(self, kind: str, fn: Callable[[Job], Awaitable[Any]], session_id: Optional[str] = None) -> Job:
+        """Queue fn(job) and return the job immediately. Call from the event loop (an async endpoint)."""
+        self._ensure_workers()
+        job = Job(kind, fn, session_id, self)
+        self._jobs[job.id] = job
+        self._evict()
+        self._queue.put_nowait(job)
+        self._save(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def describe(self, job_id: str, include_result: bool = False) -> Optional[Dict[str, Any]]:
+        """Job state as a dict; falls back to the persisted copy for jobs this process doesn't hold."""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict(include_result)
+        doc = self._load(job_id)
+        if doc is not None and not include_result:
+            doc.pop("result", None)
+        return doc
+
+    async def adescribe(self, job_id: str, include_result: bool = False) -> Optional[Dict[str, Any]]:
+        """describe() for the event loop: the shared-store fallback runs in a worker thread."""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict(include_result)
+        return await asyncio.to_thread(self.describe, job_id, include_result)
+
+    async def acancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """cancel() for the event loop: flagging a job owned by another worker runs in a worker thread."""
+        if job_id in self._jobs:
+            return self.cancel(job_id)
+        return await asyncio.to_thread(self._request_remote_cancel, job_id)
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Request cancellation; returns the job's state, or None if unknown. Jobs owned by another
+        worker are flagged in the store and cancelled by their owner."""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return self._request_remote_cancel(job_id)
+        if job.done:
+            return job.to_dict()
+        job.cancel_requested = True
+        if job.status == "queued":
+            job.status = "cancelled"
+            job.finished_at = time.time()
+            self._save(job)
+        elif job.task is not None:
+            job.task.cancel()
+        return job.to_dict()
+
+    def list(self, session_id: Optional[str] = None, include_remote: bool = True) -> list:
+        """Jobs held by this process, plus (for a session, with JOB_STORE=mongo) those run by other workers."""
+        local = self._list_local(session_id)
+        if self.store != "mongo" or session_id is None or not include_remote:
+            return local
+        return local + self._list_remote(session_id, {j["job_id"] for j in local})
+
+    async def alist(self, session_id: Optional[str] = None, include_remote: bool = True) -> list:
+        """list() for the event loop: the shared-store query runs in a worker thread."""
+        local = self._list_local(session_id)
+        if self.store != "mongo" or session_id is None or not include_remote:
+            return local
+        return local + await asyncio.to_thread(self._list_remote, session_id, {j["job_id"] for j in local})
+
+    def _list_local(self, session_id: Optional[str]) -> list:
+        return [j.to_dict() for j in list(self._jobs.values()) if session_id is None or j.session_id == session_id]
+
+    def _list_remote(self, session_id: str, exclude: set) -> list:
+        try:
+            remote = list(self._collection().find({"session_id": session_id}, {"_id": 0, "result": 0, "expires_at": 0}))
+        except Exception as e:
+            logging.warning("job list load failed for session %s: %s", session_id, e)
+            return []
+        return sorted((d for d in remote if d.get("job_id") not in exclude), key=lambda d: d.get("created_at") or 0)
+
+    def stats(self) -> Dict[str, Any]:
+        counts: Dict[str, int] = {}
+        for j in self._jobs.values():
+            counts[j.status] = counts.get(j.status, 0) + 1
+        return {"workers": self.workers, "store": self.store, "queued": self._queue.qsize() if self._queue else 0,
+                "by_status": counts}
+
+    # ---- retention ----
+    def _evict(self):
+        cutoff = time.time() - JOB_TTL
+        for job_id in [j.id for j in self._jobs.values() if j.done and j.finished_at < cutoff]:
+            self._jobs.pop(job_id, None)
+        finished = [j.id for j in self._jobs.values() if j.done]
+        while len(self._jobs) > JOB_MAX_RETAINED and finished:
+            self._jobs.pop(finished.pop(0), None)
+
+    # ---- persistence ----
+    def _collection(self):
+        if self._mongo_col is None:
+            from src.db.mongo import get_collection
+            col = get_collection("jobs")
+            try:
+                col.create_index("expires_at", expireAfterSeconds=0)
+                col.create_index("session_id")
+            except Exception as e:
+                logging.warning("jobs index creation failed: %s", e)
+            self._mongo_col = col
+        return self._mongo_col
+
+    def _write(self, doc: Dict[str, Any]):
+        from datetime import datetime, timedelta
+        fields = {k: v for k, v in doc.items() if k != "cancel_requested"}
+        try:
+            self._collection().update_one(
+                {"_id": doc["job_id"]},
+                # $max so a cancel requested through another worker is never overwritten with False
+                {"$set": {**fields, "expires_at": datetime.utcnow() + timedelta(seconds=JOB_TTL)},
+                 "$max": {"cancel_requested": bool(doc.get("cancel_requested"))}},
+                upsert=True,
+            )
+        except Exception as e:
+            logging.warning("job %s persist failed: %s", doc.get("job_id"), e)
+
+    def _request_remote_cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        if self.store != "mongo":
+            return None
+        try:
+            self._collection().update_one(
+                {"_id": job_id, "status": {"$nin": list(TERMINAL_STATES)}}, {"$set": {"cancel_requested": True}})
+        except Exception as e:
+            logging.warning("job %s cancel request failed: %s", job_id, e)
+        return self.describe(job_id)
+
+    def _save(self, job: Job):
+        if self.store != "mongo":
+            return
+        self._last_persist[job.id] = time.time()
+        if job.done:
+            self._last_persist.pop(job.id, None)
+        self._loop.run_in_executor(None, self._write, job.to_dict(include_result=True))
+
+    def _progress_changed(self, job: Job):
+        # throttled so chatty progress reporting doesn't turn into one Mongo write per token
+        if self.store != "mongo" or self._loop is None:
+            return
+        if time.time() - self._last_persist.get(job.id, 0) < _PERSIST_INTERVAL:
+            return
+        self._loop.call_soon_threadsafe(self._save, job)
+
+    def _load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        if self.store != "mongo":
+            return None
+        try:
+            doc = self._collection().find_one({"_id": job_id})
+        except Exception as e:
+            logging.warning("job %s load failed: %s", job_id, e)
+            return None
+        if doc:
+            doc.pop("_id", None)
+            doc.pop("expires_at", None)
+        return doc
+
+
+jobs = JobManager()
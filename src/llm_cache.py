@@ -0,0 +1,173 @@
+# src/llm_cache.py
+"""
+Content-addressed cache for LLM responses.
+- Keys are a hash of (model, prompt, generation params); xxhash when installed, blake2b otherwise.
+- In-memory LRU tier with TTL and a max entry count.
+- Optional second tier on local disk or in Mongo (LLM_CACHE_BACKEND=disk|mongo).
+"""
+
+from typing import Any, Dict, Optional
+from collections import OrderedDict
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+try:
+    import xxhash
+except Exception:
+    xxhash = None
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") not in ("0", "false", "False")
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "512"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(24 * 3600)))
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "memory").lower()   # memory | disk | mongo
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "./llm_cache")
+
+
+def make_key(kind: str, model: str, prompt: str, params: Optional[dict] = None) -> str:
+    """Stable content hash for a model call. `kind` separates text and parsed-JSON entries."""
+    payload = json.dumps(
+        {"kind": kind, "model": model, "prompt": prompt, "params": params or {}},
+        sort_keys=True, ensure_ascii=False, default=str,
+    ).encode("utf-8")
+    if xxhash is not None:
+        return xxhash.xxh3_128_hexdigest(payload)
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+class LLMCache:
+    def __init__(self, max_entries: int = LLM_CACHE_SIZE, ttl: float = LLM_CACHE_TTL, backend: str = LLM_CACHE_BACKEND):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.backend = backend
+        self._lru: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._mongo_col = None
+        self.stats = {"hits": 0, "misses": 0, "l2_hits": 0, "sets": 0, "evictions": 0}
+
+    # ---- memory tier ----
+    def _mem_get(self, key: str):
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._lru[key]
+                return None
+            self._lru.move_to_end(key)
+            return value
+
+    def _mem_set(self, key: str, value: Any):
+        with self._lock:
+            self._lru[key] = (time.time() + self.ttl, value)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    # ---- persistent tier ----
+    def _collection(self):
+        if self._mongo_col is None:
+            from src.db.mongo import get_collection
+            col = get_collection("llm_cache")
+            try:
+                # Mongo drops documents once expires_at has passed
+                col.create_index("expires_at", expireAfterSeconds=0)
+            except Exception as e:
+                logging.warning("llm_cache TTL index creation failed: %s", e)
+            self._mongo_col = col
+        return self._mongo_col
+
+    def _l2_get(self, key: str):
+        try:
+            if self.backend == "disk":
+                path = os.path.join(LLM_CACHE_DIR, f"{key}.json")
+                if not os.path.exists(path):
+                    return None
+                with open(path, "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+                if entry.get("expires_at", 0) < time.time():
+                    os.remove(path)
+                    return None
+                return entry.get("value")
+            if self.backend == "mongo":
+                from datetime import datetime
+                doc = self._collection().find_one({"_id": key})
+                if not doc or doc.get("expires_at") < datetime.utcnow():
+                    return None
+                return doc.get("value")
+        except Exception as e:
+            logging.warning("llm_cache %s read failed: %s", self.backend, e)
+        return None
+
+    def _l2_set(self, key: str, value: Any):
+        try:
+            if self.backend == "disk":
+                os.makedirs(LLM_CACHE_DIR, exist_ok=True)
+                path = os.path.join(LLM_CACHE_DIR, f"{key}.json")
+                tmp = f"{path}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump({"expires_at": time.time() + self.ttl, "value": value}, f, ensure_ascii=False)
+                os.replace(tmp, path)
+            elif self.backend == "mongo":
+                from datetime import datetime, timedelta
+                self._collection().replace_one(
+                    {"_id": key},
+                    {"_id": key, "value": value, "expires_at": datetime.utcnow() + timedelta(seconds=self.ttl)},
+                    upsert=True,
+                )
+        except Exception as e:
+            logging.warning("llm_cache %s write failed: %s", self.backend, e)
+
+    def _count(self, *names: str):
+        # get/set run concurrently from worker threads; += on a shared dict is not atomic
+        with self._lock:
+            for name in names:
+                self.stats[name] += 1
+
+    # ---- public API ----
+    def get(self, key: str):
+        """Return the cached value or None. Promotes persistent-tier hits into memory."""
+        value = self._mem_get(key)
+        if value is not None:
+            self._count("hits")
+            return value
+        if self.backend in ("disk", "mongo"):
+            value = self._l2_get(key)
+            if value is not None:
+                self._count("hits", "l2_hits")
+                self._mem_set(key, value)
+                return value
+        self._count("misses")
+        return None
+
+    def set(self, key: str, value: Any):
+        if value is None:
+            return
+        self._mem_set(key, value)
+        if self.backend in ("disk", "mongo"):
+            self._l2_set(key, value)
+        self._count("sets")
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size = len(self._lru)
+            stats = dict(self.stats)
+        total = stats["hits"] + stats["misses"]
+        return {
+            **stats,
+            "size": size,
+            "backend": self.backend,
+            "hit_rate": (stats["hits"] / total) if total else 0.0,
+        }
+
+
+llm_cache = LLMCache()
@@ -0,0 +1,208 @@
+# src/llm_governor.py
+"""
+Process-wide concurrency governor for Gemini calls.
+- Token bucket caps the rate at which requests start (LLM_RATE_PER_SEC, LLM_BURST; defaults
+  sized to the Gemini 2.5 Pro tier-1 quota of 150 requests/min).
+- A separate in-flight cap (LLM_MAX_CONCURRENCY) only bounds open connections; it is set well
+  above rate × typical latency so slow calls don't turn into the effective rate limit.
+  Streaming calls give their slot back once the first chunk arrives (admit()).
+- AIMD: on 429/quota errors the rate is halved and all callers pause for a cooldown;
+  successes creep the rate back up towards the configured ceiling.
+- Callers wait as long as it takes by default; with LLM_QUEUE_TIMEOUT > 0 they get
+  LLMQueueTimeout once that deadline passes.
+Works for both threads and asyncio tasks.
+"""
+
+from typing import Optional
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+import os
+import time
+import asyncio
+import logging
+import threading
+
+LLM_RATE_PER_SEC = float(os.getenv("LLM_RATE_PER_SEC", "2.5"))
+LLM_BURST = int(os.getenv("LLM_BURST", "10"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "64"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "0"))   # 0 = no deadline
+LLM_MIN_RATE = float(os.getenv("LLM_MIN_RATE", "0.1"))
+
+
+class LLMQueueTimeout(RuntimeError):
+    """Raised when a call could not get a slot before its deadline."""
+
+
+def is_rate_limit_error(e: Exception) -> bool:
+    code = getattr(e, "code", None) or getattr(e, "status_code", None)
+    if code == 429:
+        return True
+    msg = str(e)
+    return "429" in msg or "RESOURCE_EXHAUSTED" in msg or "quota" in msg.lower()
+
+
+class LLMGovernor:
+    def __init__(self, rate: float = LLM_RATE_PER_SEC, burst: int = LLM_BURST,
+                 max_concurrency: int = LLM_MAX_CONCURRENCY, min_rate: float = LLM_MIN_RATE):
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_concurrency = max(1, max_concurrency)
+        self._tokens = float(self.burst)
+        self._last_refill = time.monotonic()
+        self._in_flight = 0
+        self._waiting = 0
+        self._cooldown_until = 0.0
+        self._consecutive_throttles = 0
+        self._cond = threading.Condition()
+        self._waits = deque(maxlen=500)
+        self.counters = {"acquired": 0, "timeouts": 0, "throttled": 0}
+
+    # ---- internals (call with self._cond held) ----
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def _try_acquire(self) -> Optional[float]:
+        """0 if a slot was taken, else seconds to wait (None = wait for a release)."""
+        now = time.monotonic()
+        self._refill(now)
+        if now < self._cooldown_until:
+            return self._cooldown_until - now
+        if self._in_flight >= self.max_concurrency:
+            return None
+        if self._tokens < 1:
+            return (1 - self._tokens) / self.rate
+        self._tokens -= 1
+        self._in_flight += 1
+        return 0
+
+    def _record_wait(self, waited: float):
+        self._waits.append(waited)
+        self.counters["acquired"] += 1
+
+    def _timeout(self, waited: float):
+        self.counters["timeouts"] += 1
+        raise LLMQueueTimeout(f"LLM queue deadline exceeded after {waited:.1f}s "
+                              f"(in_flight={self._in_flight}, waiting={self._waiting})")
+
+    @staticmethod
+    def _deadline(start: float, timeout: Optional[float]) -> float:
+        timeout = LLM_QUEUE_TIMEOUT if timeout is None else timeout
+        return start + timeout if timeout and timeout > 0 else float("inf")
+
+    # ---- acquire / release ----
+    def acquire(self, timeout: Optional[float] = None):
+        start = time.monotonic()
+        deadline = self._deadline(start, timeout)
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    wait = self._try_acquire()
+                    if wait == 0:
+                        self._record_wait(time.monotonic() - start)
+                        return
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeout(time.monotonic() - start)
+                    self._cond.wait(min(remaining, wait if wait is not None else 1.0))
+            finally:
+                self._waiting -= 1
+
+    async def aacquire(self, timeout: Optional[float] = None):
+        start = time.monotonic()
+        deadline = self._deadline(start, timeout)
+        with self._cond:
+            self._waiting += 1
+        try:
+            while True:
+                with self._cond:
+                    wait = self._try_acquire()
+                    if wait == 0:
+                        self._record_wait(time.monotonic() - start)
+                        return
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeout(time.monotonic() - start)
+                await asyncio.sleep(min(remaining, wait if wait is not None else 0.05))
+        finally:
+            with self._cond:
+                self._waiting -= 1
+
+    def release(self):
+        with self._cond:
+            self._in_flight = max(0, self._in_flight - 1)
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self, timeout: Optional[float] = None):
+        """Hold a slot for the duration of the block; a streaming caller calls the yielded
+        admit() once its first chunk arrives to hand the slot back early."""
+        self.acquire(timeout)
+        held = [True]
+
+        def admit():
+            if held[0]:
+                held[0] = False
+                self.release()
+
+        try:
+            yield admit
+        finally:
+            admit()
+
+    @asynccontextmanager
+    async def aslot(self, timeout: Optional[float] = None):
+        await self.aacquire(timeout)
+        held = [True]
+
+        def admit():
+            if held[0]:
+                held[0] = False
+                self.release()
+
+        try:
+            yield admit
+        finally:
+            admit()
+
+    # ---- adaptive feedback ----
+    def on_success(self):
+        with self._cond:
+            self._consecutive_throttles = 0
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+    def on_throttle(self) -> float:
+        """Halve the rate and pause everyone; returns the cooldown applied in seconds."""
+        with self._cond:
+            self._consecutive_throttles += 1
+            self.counters["throttled"] += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, 0.0)
+            cooldown = min(30.0, 2 ** (self._consecutive_throttles - 1))
+            self._cooldown_until = max(self._cooldown_until, time.monotonic() + cooldown)
+            self._cond.notify_all()
+        logging.warning("Gemini rate limited; rate now %.2f req/s, cooling down %.1fs", self.rate, cooldown)
+        return cooldown
+
+    def metrics(self) -> dict:
+        with self._cond:
+            waits = sorted(self._waits)
+            return {
+                **self.counters,
+                "queue_depth": self._waiting,
+                "in_flight": self._in_flight,
+                "rate_per_sec": round(self.rate, 3),
+                "max_rate_per_sec": self.max_rate,
+                "max_concurrency": self.max_concurrency,
+                "cooldown_remaining": max(0.0, round(self._cooldown_until - time.monotonic(), 3)),
+                "wait_avg": (sum(waits) / len(waits)) if waits else 0.0,
+                "wait_p95": waits[int(len(waits) * 0.95) - 1] if len(waits) >= 20 else (waits[-1] if waits else 0.0),
+                "wait_max": waits[-1] if waits else 0.0,
+            }
+
+
+governor = LLMGovernor()
@@ -1,44 +1,52 @@
 # src/main.py
 import os
 import uuid
-import io
+import asyncio
 import logging
+from typing import Optional
 
 from fastapi.responses import StreamingResponse
 import time
 import json
 
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Body, Header
 from fastapi.responses import FileResponse, JSONResponse
 from dotenv import load_dotenv
 
-from src.workflow import app_graph
+from src.workflow import app_graph, thread_config, ahas_checkpoint
 from src.utils.csv_utils import (
-    validate_csv_file,
+    CSVValidationError,
+    iter_csv_chunks,
+    check_competency_chunk,
+    competency_records,
     generate_competency_csv,
     generate_idea_map_csv,
     generate_evaluation_template_csv
 )
 from src.nodes.score_validator import validate_evaluation_csv
-from src.nodes.idea_selector import score_and_select_top
-from src.nodes.action_plan_writer import generate_action_plans
+from src.nodes.idea_selector import score_and_select_top, resolve_weights
+from src.nodes.action_plan_writer import stream_action_plans
+from src.streaming.sse_utils import format_sse
+from src.streaming.progress_bus import progress_bus, summarize_value, TokenBuffer
+from pymongo import DeleteOne, ReplaceOne
 from src.db.mongo import get_collection
+from src.utils.competency_diff import CompetencyDiff, ROW_FIELDS, row_hash
+from src.nodes.semantic_reasoner import index_competencies_for_session
+from src.gemini_client import llm_stats
+from src.nodes.search_agent import search_stats, schedule_refresh
+from src import search_cache
+from src.jobs import jobs
+from src.session_store import sessions, SessionConflict
+from src.session_logs import install as install_session_logging, bind_session, GLOBAL_BUFFER
 
 # ---------------------------------------------------------
 # Initialize Logging for Streaming Log Capture
 # ---------------------------------------------------------
-log_stream = io.StringIO()
-
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("workflow")
 
-# Remove existing handlers so logs don't duplicate
-for h in logger.handlers:
-    logger.removeHandler(h)
-
-stream_handler = logging.StreamHandler(log_stream)
-stream_handler.setLevel(logging.INFO)
-logger.addHandler(stream_handler)
+# per-session ring buffers fed through a QueueHandler (see src/session_logs.py)
+log_buffers = install_session_logging()
 
 # ---------------------------------------------------------
 
@@ -49,60 +57,258 @@ app = FastAPI(title="AI Corporate Innovation Workflow Automation")
 ARTIFACTS_DIR = os.path.join(os.getcwd(), "artifacts")
 os.makedirs(ARTIFACTS_DIR, exist_ok=True)
 
-sessions = {}
+
+def _get_session(session_id: str) -> dict:
+    """Current copy of the session from the shared store, or 404."""
+    session = sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return session
+
+
+async def _aget_session(session_id: str) -> dict:
+    """_get_session for async endpoints; store reads run off the event loop."""
+    session = await sessions.aget(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return session
+
+
+@app.exception_handler(SessionConflict)
+async def session_conflict_handler(request, exc: SessionConflict):
+    # another request/worker updated the session first; the client can retry with fresh state
+    return JSONResponse(status_code=409, content={"error": str(exc)})
+
+
+@app.get("/metrics/sessions")
+def fetch_session_metrics():
+    """Session store cache hits/misses, writes and version conflicts."""
+    return sessions.get_stats()
+
+
+@app.middleware("http")
+async def bind_session_logs(request, call_next):
+    # tag every log line emitted while serving /sessions/{id}/... with that session
+    parts = request.url.path.strip("/").split("/")
+    if len(parts) >= 2 and parts[0] == "sessions":
+        bind_session(parts[1])
+    return await call_next(request)
+
 
 # ---------------------------------------------------------
 # Streaming Logs Endpoint  (for Streamlit SSE-style streaming)
 # ---------------------------------------------------------
 @app.get("/logs")
-def fetch_logs():
-    """Return accumulated workflow logs for SSE-style streaming."""
-    return {"logs": log_stream.getvalue()}
+def fetch_logs(after: int = 0, limit: int = 500):
+    """Recent workflow log lines across all sessions (bounded buffer); poll with ?after=<next>."""
+    page = log_buffers.read(GLOBAL_BUFFER, after, limit)
+    return {"logs": "".join(f"{l['message']}\n" for l in page["lines"]), **page}
+
+
+@app.get("/sessions/{session_id}/logs")
+def fetch_session_logs(session_id: str, after: int = 0, limit: int = 500):
+    """Log lines for one session with seq > after; pass the returned `next` as `after` on the next poll."""
+    return {"session_id": session_id, **log_buffers.read(session_id, after, limit)}
+
+
+@app.get("/metrics/llm")
+def fetch_llm_metrics():
+    """LLM cache hit/miss and JSON-parsing counters (incl. how often cleanup still fires)."""
+    return llm_stats()
+
+
+@app.get("/metrics/search")
+def fetch_search_metrics():
+    """Which source (tavily / gemini / placeholder) served each company search."""
+    return dict(search_stats)
+
+
+# ---------------------------------------------------------
+# Search cache management
+# ---------------------------------------------------------
+@app.delete("/search_cache/{company_name}")
+def invalidate_search_cache(company_name: str):
+    """Drop the cached search for a company so the next session searches live."""
+    removed = search_cache.invalidate(company_name)
+    logger.info(f"Search cache invalidated for '{company_name}' (existed={removed})")
+    return {"company": search_cache.normalize_company_name(company_name), "invalidated": removed}
+
+
+@app.post("/search_cache/prewarm")
+def prewarm_search_cache(payload: dict = Body(...)):
+    """Refresh the cached search for each company in the background: {"companies": [...]}."""
+    companies = payload.get("companies", [])
+    if not isinstance(companies, list):
+        raise HTTPException(status_code=400, detail="companies must be an array")
+    names = [c for c in companies if isinstance(c, str) and c.strip()]
+    for name in names:
+        schedule_refresh(name)
+    logger.info(f"Prewarming search cache for {len(names)} companies")
+    return {"queued": len(names), "companies": [search_cache.normalize_company_name(n) for n in names]}
+
+
+# ---------------------------------------------------------
+# Background jobs (long stages can run outside the request)
+# ---------------------------------------------------------
+def _job_accepted(job: dict, **extra):
+    return JSONResponse(status_code=202, content={
+        **extra,
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "status_endpoint": f"/jobs/{job['job_id']}",
+        "result_endpoint": f"/jobs/{job['job_id']}/result",
+    })
+
+
+def _submit_job(kind: str, session_id: str, fn):
+    """Queue fn(job) as a background job; its start and end are also published to the session's progress stream."""
+    async def _tracked(job):
+        bind_session(session_id)
+        progress_bus.publish(session_id, "job_start", {"job_id": job.id, "kind": kind})
+        status = "failed"
+        try:
+            result = await fn(job)
+            status = "succeeded"
+            return result
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        finally:
+            progress_bus.publish(session_id, "job_end", {"job_id": job.id, "kind": kind, "status": status})
+
+    return jobs.submit(kind, _tracked, session_id=session_id)
+
+
+async def _active_job(session_id: str, kind: str):
+    """The session's queued or running job of this kind (on any worker), so a repeated request joins it."""
+    for j in await jobs.alist(session_id):
+        if j["kind"] == kind and j["status"] in ("queued", "running"):
+            return j
+    return None
+
+
+async def _run_graph(input_state, session_id: str, interrupt_before: list, job=None, run: str = "graph") -> dict:
+    """
+    Run or resume the graph on the session's thread. Node start/finish/error events (with timings
+    and a preview of what each node wrote) go to the session's progress bus for the SSE stream;
+    each finished node is also reported to the job.
+    """
+    config = thread_config(session_id)
+    started = {}
+    progress_bus.begin_run(session_id, run)
+    try:
+        async for ev in app_graph.astream(input_state, config, interrupt_before=interrupt_before, stream_mode="debug"):
+            payload = ev.get("payload") or {}
+            node = payload.get("name")
+            if ev.get("type") == "task":
+                started[payload.get("id")] = time.perf_counter()
+                progress_bus.publish(session_id, "node_start", {"node": node, "step": ev.get("step")})
+            elif ev.get("type") == "task_result":
+                elapsed = round(time.perf_counter() - started.pop(payload.get("id"), time.perf_counter()), 3)
+                if payload.get("error"):
+                    progress_bus.publish(session_id, "node_error", {"node": node, "elapsed": elapsed, "error": str(payload["error"])})
+                    continue
+                result = {k: summarize_value(v) for k, v in (payload.get("result") or [])}
+                progress_bus.publish(session_id, "node_end", {"node": node, "elapsed": elapsed, "result": result})
+                if job is not None:
+                    job.report(stage=node, message=f"{node} finished")
+        snapshot = await app_graph.aget_state(config)
+    except BaseException as e:
+        progress_bus.end_run(session_id, run, "failed", error=str(e) or type(e).__name__)
+        raise
+    progress_bus.end_run(session_id, run, "paused" if snapshot.next else "complete", next=list(snapshot.next or ()))
+    return dict(snapshot.values or {})
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status and progress of a background job."""
+    job = await jobs.adescribe(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """The job's result once it has succeeded; 202 while it is still queued or running."""
+    job = await jobs.adescribe(job_id, include_result=True)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] == "succeeded":
+        return job["result"]
+    if job["status"] == "failed":
+        return JSONResponse(status_code=500, content={"error": job.get("error"), "job_id": job_id})
+    if job["status"] == "cancelled":
+        return JSONResponse(status_code=409, content={"error": "Job was cancelled", "job_id": job_id})
+    return JSONResponse(status_code=202, content={k: v for k, v in job.items() if k != "result"})
+
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    job = await jobs.acancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    logger.info(f"Cancel requested for job {job_id} ({job['kind']}, status={job['status']})")
+    return job
+
+
+@app.get("/sessions/{session_id}/jobs")
+async def list_session_jobs(session_id: str):
+    return {"jobs": await jobs.alist(session_id)}
+
+
+@app.get("/metrics/jobs")
+async def fetch_job_metrics():
+    return jobs.stats()
 
 
 # ---------------------------------------------------------
 # Start Session
 # ---------------------------------------------------------
+async def _start_session_stage(session_id: str, company_name: str, job=None) -> dict:
+    input_state = {"company_name": company_name, "session_id": session_id}
+
+    # Run graph until ask_gaps → pause before generate_ideas (checkpointed under thread_id=session_id)
+    logger.info("Invoking graph up to gap analysis…")
+    result_state = await _run_graph(input_state, session_id, ["generate_ideas"], job, run="start_session")
+    session = await sessions.aupdate(session_id, result_state)
+
+    logger.info(f"Extracted {len(session.get('extracted_competencies', []))} competencies")
+    logger.info(f"Generated {len(session.get('gap_questions', []))} gap questions")
+
+    return {
+        "session_id": session_id,
+        "discovered_competencies": session.get("extracted_competencies", []),
+        "gap_questions": session.get("gap_questions", [])
+    }
+
+
 @app.post("/sessions")
-def start_session(payload: dict):
+async def start_session(payload: dict, background: bool = False):
     """
     Start the workflow but STOP after gap analysis (human-in-the-loop).
-    Uses LangGraph invoke with interrupt_before to pause prior to idea generation.
+    Runs the graph asynchronously with interrupt_before to pause prior to idea generation.
+    With ?background=true the graph runs as a job and the response (202) carries the job id;
+    the usual response body is then available from /jobs/{job_id}/result.
     """
     try:
         session_id = str(uuid.uuid4())
+        bind_session(session_id)
         logger.info(f"=== Starting session {session_id} for company: {payload['company_name']} ===")
 
-        input_state = {"company_name": payload["company_name"], "session_id": session_id}
-
-        # Run graph until ask_gaps → pause before generate_ideas
-        try:
-            logger.info("Invoking graph up to gap analysis…")
-            result_state = app_graph.invoke(input_state, interrupt_before=["generate_ideas"])
-        except TypeError:
-            logger.info("LangGraph version fallback invoke()")
-            result_state = app_graph.invoke(input_state)
-
         # Store session minimal fields
-        sessions[session_id] = {"company_name": payload["company_name"], "session_id": session_id}
+        await sessions.acreate(session_id, {"company_name": payload["company_name"], "session_id": session_id})
 
-        if isinstance(result_state, dict):
-            sessions[session_id].update(result_state)
-        else:
-            try:
-                sessions[session_id].update(getattr(result_state, "state", {}) or getattr(result_state, "result", {}))
-            except Exception:
-                pass
-
-        logger.info(f"Extracted {len(sessions[session_id].get('extracted_competencies', []))} competencies")
-        logger.info(f"Generated {len(sessions[session_id].get('gap_questions', []))} gap questions")
+        if background:
+            job = _submit_job("start_session", session_id,
+                              lambda job: _start_session_stage(session_id, payload["company_name"], job))
+            return _job_accepted(job.to_dict(), session_id=session_id)
 
-        return {
-            "session_id": session_id,
-            "discovered_competencies": sessions[session_id].get("extracted_competencies", []),
-            "gap_questions": sessions[session_id].get("gap_questions", [])
-        }
+        return await _start_session_stage(session_id, payload["company_name"])
 
+    except (HTTPException, SessionConflict):
+        raise
     except Exception as e:
         logger.error(f"Error in start_session: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
@@ -112,20 +318,18 @@ def start_session(payload: dict):
 # Answer Gaps (human clarifications)
 # ---------------------------------------------------------
 @app.post("/sessions/{session_id}/answer_gaps")
-def answer_gaps(session_id: str, payload: dict):
+async def answer_gaps(session_id: str, payload: dict):
     try:
-        if session_id not in sessions:
-            raise HTTPException(status_code=404, detail="Session not found")
+        session = await _aget_session(session_id)
 
         logger.info(f"=== Processing clarifications for session {session_id} ===")
 
         # COMPLETE token — finalize CSV
         if payload.get("status", "").strip().upper() == "COMPLETE":
-            refined = sessions[session_id].get("extracted_competencies", [])
-            csv_path = generate_competency_csv(session_id, refined, ARTIFACTS_DIR)
+            refined = session.get("extracted_competencies", [])
+            csv_path = await asyncio.to_thread(generate_competency_csv, session_id, refined, ARTIFACTS_DIR)
 
-            sessions[session_id]["generated_csv"] = csv_path
-            sessions[session_id]["state"] = "competency_csv_ready"
+            await sessions.aupdate(session_id, {"generated_csv": csv_path, "state": "competency_csv_ready"})
 
             logger.info("User marked COMPLETE. Competencies finalized.")
             return {
@@ -140,37 +344,36 @@ def answer_gaps(session_id: str, payload: dict):
         if not isinstance(answers, list):
             raise HTTPException(status_code=400, detail="answers must be an array")
 
-        sessions[session_id]["answers"] = answers
+        session = await sessions.aupdate(session_id, {"answers": answers})
         logger.info(f"Received {len(answers)} clarification answers")
 
-        # Resume graph
-        try:
-            resumed = app_graph.invoke(
-                {**sessions[session_id], "session_id": session_id},
-                interrupt_before=["generate_ideas"]
-            )
-        except TypeError:
-            resumed = app_graph.invoke({**sessions[session_id], "session_id": session_id})
+        # Resume graph: with a checkpoint, record the answers as if written by `extract` so only
+        # ask_gaps re-runs; otherwise (e.g. checkpoint lost) fall back to a full run from START
+        if await ahas_checkpoint(session_id):
+            config = thread_config(session_id)
+            await app_graph.aupdate_state(config, {"answers": answers}, as_node="extract")
+            resumed = await _run_graph(None, session_id, ["generate_ideas"], run="answer_gaps")
+        else:
+            resumed = await _run_graph({**session, "session_id": session_id}, session_id,
+                                       ["generate_ideas"], run="answer_gaps")
 
-        if isinstance(resumed, dict):
-            sessions[session_id].update(resumed)
+        session = await sessions.aupdate(session_id, resumed)
 
-        gap_questions = sessions[session_id].get("gap_questions", [])
+        gap_questions = session.get("gap_questions", [])
 
         if gap_questions:
             logger.info(f"{len(gap_questions)} more gap questions remain")
             return {
                 "message": "More information required",
-                "discovered_competencies": sessions[session_id].get("extracted_competencies", []),
+                "discovered_competencies": session.get("extracted_competencies", []),
                 "gap_questions": gap_questions,
                 "loop": "continue"
             }
 
         # No more gaps -> finalize
-        refined = sessions[session_id].get("extracted_competencies", [])
-        csv_path = generate_competency_csv(session_id, refined, ARTIFACTS_DIR)
-        sessions[session_id]["generated_csv"] = csv_path
-        sessions[session_id]["state"] = "competency_csv_ready"
+        refined = session.get("extracted_competencies", [])
+        csv_path = await asyncio.to_thread(generate_competency_csv, session_id, refined, ARTIFACTS_DIR)
+        await sessions.aupdate(session_id, {"generated_csv": csv_path, "state": "competency_csv_ready"})
 
         logger.info("All gaps resolved. CSV finalized.")
         return {
@@ -180,6 +383,8 @@ def answer_gaps(session_id: str, payload: dict):
             "loop": "complete"
         }
 
+    except (HTTPException, SessionConflict):
+        raise   # 4xx responses / the 409 handler
     except Exception as e:
         logger.error(f"Error in answer_gaps: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
@@ -190,108 +395,144 @@ def answer_gaps(session_id: str, payload: dict):
 # ---------------------------------------------------------
 @app.get("/sessions/{session_id}/download_competencies")
 def download_competencies(session_id: str):
-    if session_id not in sessions:
-        raise HTTPException(status_code=404, detail="Session not found")
+    session = _get_session(session_id)
 
-    if "generated_csv" not in sessions[session_id]:
-        comps = sessions[session_id].get("extracted_competencies", [])
-        sessions[session_id]["generated_csv"] = generate_competency_csv(
+    if "generated_csv" not in session:
+        comps = session.get("extracted_competencies", [])
+        session = sessions.update(session_id, {"generated_csv": generate_competency_csv(
             session_id, comps, ARTIFACTS_DIR
-        )
+        )})
 
     return FileResponse(
-        sessions[session_id]["generated_csv"],
+        session["generated_csv"],
         media_type="text/csv",
-        filename=os.path.basename(sessions[session_id]["generated_csv"])
+        filename=os.path.basename(session["generated_csv"])
     )
 
 
 # ---------------------------------------------------------
 # Upload CSV
 # ---------------------------------------------------------
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1 << 20)))
+CSV_INSERT_BATCH = int(os.getenv("CSV_INSERT_BATCH", "1000"))
+
+
+def _ingest_competency_csv(session_id: str, path: str) -> dict:
+    """
+    Parse the CSV once in chunks, validate each chunk column-wise and diff it against the stored
+    competencies by content key. Once the whole file has validated, only inserted, changed and
+    removed rows are written, in CSV_INSERT_BATCH-sized bulk writes. Returns the change set.
+    """
+    col = get_collection("competencies")
+    existing = {d["_id"]: row_hash(d) for d in col.find({"session_id": session_id}, {f: 1 for f in ROW_FIELDS})}
+    diff = CompetencyDiff(session_id, existing)
+    rows = 0
+    for chunk in iter_csv_chunks(path):
+        check_competency_chunk(chunk, first_row=rows)
+        diff.add(competency_records(chunk, session_id))
+        rows += len(chunk)
+        progress_bus.publish(session_id, "upload_progress", {"rows": rows})
+        logger.info(f"Parsed {rows} competency rows…")
+    if not rows:
+        # an empty upload would diff every stored competency as deleted
+        raise CSVValidationError("CSV has no competency rows")
+
+    changes = diff.change_set()
+    ops = [ReplaceOne({"_id": d["_id"]}, d, upsert=True) for d in diff.upserts]
+    ops += [DeleteOne({"_id": k}) for k in changes["deleted"]]
+    for i in range(0, len(ops), CSV_INSERT_BATCH):
+        col.bulk_write(ops[i:i + CSV_INSERT_BATCH], ordered=False)
+        progress_bus.publish(session_id, "upload_progress", {"rows": rows, "written": min(i + CSV_INSERT_BATCH, len(ops))})
+    logger.info(f"Competency upload diff: {len(changes['inserted'])} inserted, {len(changes['updated'])} updated, "
+                f"{len(changes['deleted'])} deleted, {changes['unchanged']} unchanged")
+    return {**changes, "rows": rows}
+
+
 @app.post("/sessions/{session_id}/upload_csv")
 async def upload_csv(session_id: str, file: UploadFile = File(...)):
-    if session_id not in sessions:
-        raise HTTPException(status_code=404, detail="Session not found")
+    await _aget_session(session_id)
 
+    # spool to disk in fixed-size chunks instead of holding the whole upload in memory
     dest = os.path.join(ARTIFACTS_DIR, f"{session_id}_competencies_uploaded.csv")
     with open(dest, "wb") as f:
-        f.write(await file.read())
-
-    ok, msg = validate_csv_file(dest)
-    if not ok:
-        raise HTTPException(status_code=400, detail=msg)
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            f.write(chunk)
 
-    # Persist rows to Mongo
-    col = get_collection("competencies")
-    col.delete_many({"session_id": session_id})
-
-    import pandas as pd
-    df = pd.read_csv(dest)
-    docs = []
-    for _, r in df.iterrows():
-        docs.append({
-            "_id": str(uuid.uuid4()),
-            "session_id": session_id,
-            "category": r["Category"],
-            "competency": r["Competency"],
-            "description": r["Description"],
-            "technology_level": r["Technology Level"],
-            "source_url": r.get("Source URL", "")
-        })
-
-    if docs:
-        col.insert_many(docs)
-
-    sessions[session_id]["uploaded_csv"] = dest
-    sessions[session_id]["state"] = "competencies_validated"
-    logger.info("Uploaded and validated CSV")
-    return {"status": "uploaded_validated", "file": dest}
+    try:
+        changes = await asyncio.to_thread(_ingest_competency_csv, session_id, dest)
+    except CSVValidationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except (ValueError, OSError) as e:
+        raise HTTPException(status_code=400, detail=f"Failed to read CSV: {e}")
+
+    await sessions.aupdate(session_id, {"uploaded_csv": dest, "state": "competencies_validated"})
+    logger.info(f"Uploaded and validated CSV ({changes['rows']} rows)")
+
+    # re-embed only what changed, in the background
+    job = None
+    if changes["inserted"] or changes["updated"] or changes["deleted"]:
+        job = _submit_job("index_competencies", session_id,
+                          lambda job: asyncio.to_thread(index_competencies_for_session, session_id, changes))
+    return {
+        "status": "uploaded_validated",
+        "file": dest,
+        "rows": changes["rows"],
+        "changes": {k: (len(v) if isinstance(v, list) else v) for k, v in changes.items() if k != "rows"},
+        "index_job_id": job.id if job else None,
+    }
 
 
 # ---------------------------------------------------------
 # Generate Ideas
 # ---------------------------------------------------------
-@app.post("/sessions/{session_id}/generate_ideas")
-def generate_ideas_endpoint(session_id: str):
-    if session_id not in sessions:
-        raise HTTPException(status_code=404, detail="Session not found")
-
+async def _generate_ideas_stage(session_id: str, job=None) -> dict:
     logger.info("Generating ideas…")
 
-    ideas = sessions[session_id].get("generated_ideas")
+    session = await _aget_session(session_id)
+    ideas = session.get("generated_ideas")
     if not ideas:
-        # Resume into generate_ideas
-        try:
-            resumed = app_graph.invoke(
-                sessions[session_id],
-                interrupt_before=["generate_template"]
-            )
-        except TypeError:
-            resumed = app_graph.invoke(sessions[session_id])
-
-        if isinstance(resumed, dict):
-            sessions[session_id].update(resumed)
+        # Resume into generate_ideas from the checkpoint paused before it; the parallel post-idea
+        # branches (analogies, template, idea indexing) run too, pausing before select_ideas
+        if await ahas_checkpoint(session_id):
+            resumed = await _run_graph(None, session_id, ["select_ideas"], job, run="generate_ideas")
+        else:
+            resumed = await _run_graph(session, session_id, ["select_ideas"], job, run="generate_ideas")
+        session = await sessions.aupdate(session_id, resumed)
 
-        ideas = sessions[session_id].get("generated_ideas", [])
+        ideas = session.get("generated_ideas", [])
 
-    csv_path = generate_idea_map_csv(session_id, ideas, ARTIFACTS_DIR)
-    sessions[session_id]["idea_map_csv"] = csv_path
-    sessions[session_id]["state"] = "ideas_generated"
+    csv_path = await asyncio.to_thread(generate_idea_map_csv, session_id, ideas, ARTIFACTS_DIR)
+    await sessions.aupdate(session_id, {"idea_map_csv": csv_path, "state": "ideas_generated"})
 
     logger.info(f"Generated {len(ideas)} ideas")
     return {"message": "Generated ideas", "num_ideas": len(ideas), "idea_map": csv_path}
 
 
+@app.post("/sessions/{session_id}/generate_ideas")
+async def generate_ideas_endpoint(session_id: str, background: bool = False):
+    await _aget_session(session_id)
+
+    if background:
+        job = await _active_job(session_id, "generate_ideas") or _submit_job(
+            "generate_ideas", session_id, lambda job: _generate_ideas_stage(session_id, job)).to_dict()
+        return _job_accepted(job, session_id=session_id)
+
+    return await _generate_ideas_stage(session_id)
+
+
 @app.get("/sessions/{session_id}/download_idea_map")
 def download_idea_map(session_id: str):
-    if session_id not in sessions or "idea_map_csv" not in sessions[session_id]:
+    session = sessions.get(session_id)
+    if session is None or "idea_map_csv" not in session:
         raise HTTPException(status_code=404, detail="Idea map not found")
 
     return FileResponse(
-        sessions[session_id]["idea_map_csv"],
+        session["idea_map_csv"],
         media_type="text/csv",
-        filename=os.path.basename(sessions[session_id]["idea_map_csv"])
+        filename=os.path.basename(session["idea_map_csv"])
     )
 
 
@@ -300,14 +541,12 @@ def download_idea_map(session_id: str):
 # ---------------------------------------------------------
 @app.post("/sessions/{session_id}/generate_template")
 def generate_template_endpoint(session_id: str):
-    if session_id not in sessions:
-        raise HTTPException(status_code=404, detail="Session not found")
+    session = _get_session(session_id)
 
-    ideas = sessions[session_id].get("generated_ideas", [])
+    ideas = session.get("generated_ideas", [])
     path = generate_evaluation_template_csv(session_id, ideas, ARTIFACTS_DIR)
 
-    sessions[session_id]["evaluation_template"] = path
-    sessions[session_id]["state"] = "evaluation_template_generated"
+    sessions.update(session_id, {"evaluation_template": path, "state": "evaluation_template_generated"})
 
     logger.info("Evaluation template generated")
     return {
@@ -319,13 +558,14 @@ def generate_template_endpoint(session_id: str):
 
 @app.get("/sessions/{session_id}/download_template")
 def download_template(session_id: str):
-    if session_id not in sessions or "evaluation_template" not in sessions[session_id]:
+    session = sessions.get(session_id)
+    if session is None or "evaluation_template" not in session:
         raise HTTPException(status_code=404, detail="Template not found")
 
     return FileResponse(
-        sessions[session_id]["evaluation_template"],
+        session["evaluation_template"],
         media_type="text/csv",
-        filename=os.path.basename(sessions[session_id]["evaluation_template"])
+        filename=os.path.basename(session["evaluation_template"])
     )
 
 
@@ -334,8 +574,7 @@ def download_template(session_id: str):
 # ---------------------------------------------------------
 @app.post("/sessions/{session_id}/upload_evaluation")
 async def upload_evaluation(session_id: str, file: UploadFile = File(...)):
-    if session_id not in sessions:
-        raise HTTPException(status_code=404, detail="Session not found")
+    await _aget_session(session_id)
 
     dest = os.path.join(ARTIFACTS_DIR, f"{session_id}_evaluation_uploaded.csv")
     with open(dest, "wb") as f:
@@ -345,40 +584,40 @@ async def upload_evaluation(session_id: str, file: UploadFile = File(...)):
     if not ok:
         raise HTTPException(status_code=400, detail=msg)
 
-    sessions[session_id]["evaluation_csv"] = dest
-    sessions[session_id]["state"] = "evaluation_uploaded"
+    await sessions.aupdate(session_id, {"evaluation_csv": dest, "state": "evaluation_uploaded"})
 
     logger.info("Uploaded evaluation CSV")
     return {"status": "evaluation_uploaded", "file": dest}
 
 
 
-from fastapi import Body
-
 @app.post("/sessions/{session_id}/validate_scores")
 def validate_and_select(
     session_id: str,
     payload: dict = Body(...)
 ):
-    if session_id not in sessions:
-        raise HTTPException(status_code=404, detail="Session not found")
+    session = _get_session(session_id)
 
-    # Extract top_k safely from JSON
+    # Extract top_k and optional scoring weights safely from JSON
     top_k = int(payload.get("top_k", 3))
+    try:
+        weights = resolve_weights(payload.get("weights"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    eval_path = sessions[session_id].get("evaluation_csv")
+    eval_path = session.get("evaluation_csv")
     if not eval_path:
         raise HTTPException(status_code=400, detail="No evaluation CSV uploaded")
 
     logger.info(f"Selecting top {top_k} ideas…")
 
-    selected = score_and_select_top(session_id, eval_path, top_k=top_k)
+    selected = score_and_select_top(session_id, eval_path, top_k=top_k, weights=weights)
 
-    sessions[session_id]["selected_ideas"] = selected
-    sessions[session_id]["state"] = "ideas_selected"
+    sessions.update(session_id, {"selected_ideas": selected, "state": "ideas_selected"})
 
     return {
         "message": f"Scores validated; top {top_k} ideas selected",
+        "weights": weights,
         "selected": selected
     }
 
@@ -387,33 +626,58 @@ def validate_and_select(
 # ---------------------------------------------------------
 # Generate Action Plans
 # ---------------------------------------------------------
+def _action_plans_stage(session_id: str, selected: list, job=None) -> dict:
+    # the streaming writer produces the same file, lets the job report per-idea progress and feeds
+    # the session's progress stream (tokens coalesced by TokenBuffer)
+    path = None
+    tokens = TokenBuffer(progress_bus, session_id, stage="action_plans")
+
+    for ev in stream_action_plans(session_id, selected, ARTIFACTS_DIR):
+        if ev["event"] == "token":
+            tokens(ev["text"])
+            continue
+        tokens.flush()
+        if ev["event"] == "saved":
+            path = ev["path"]
+            continue
+        progress_bus.publish(session_id, ev["event"], {k: v for k, v in ev.items() if k != "event"})
+        if ev["event"] == "idea" and job is not None:
+            done = job.progress.get("ideas_started", 0) + 1
+            job.report(stage="action_plans", ideas_started=done, ideas_total=len(selected), message=ev["title"])
+    sessions.update(session_id, {"action_plan_file": path, "state": "action_plans_generated"})
+
+    logger.info("Generated action plans")
+    return {"message": "Action plans generated",
+            "download_endpoint": f"/sessions/{session_id}/download_action_plans"}
+
+
 @app.post("/sessions/{session_id}/generate_action_plans")
-def generate_action_plans_endpoint(session_id: str):
-    if session_id not in sessions:
-        raise HTTPException(status_code=404, detail="Session not found")
+async def generate_action_plans_endpoint(session_id: str, background: bool = False):
+    session = await _aget_session(session_id)
 
-    selected = sessions[session_id].get("selected_ideas")
+    selected = session.get("selected_ideas")
     if not selected:
         raise HTTPException(status_code=400, detail="No selected ideas; run validate_scores first")
 
-    path = generate_action_plans(session_id, selected, ARTIFACTS_DIR)
-    sessions[session_id]["action_plan_file"] = path
-    sessions[session_id]["state"] = "action_plans_generated"
+    if background:
+        job = await _active_job(session_id, "generate_action_plans") or _submit_job(
+            "generate_action_plans", session_id,
+            lambda job: asyncio.to_thread(_action_plans_stage, session_id, selected, job)).to_dict()
+        return _job_accepted(job, session_id=session_id)
 
-    logger.info("Generated action plans")
-    return {"message": "Action plans generated",
-            "download_endpoint": f"/sessions/{session_id}/download_action_plans"}
+    return await asyncio.to_thread(_action_plans_stage, session_id, selected)
 
 
 @app.get("/sessions/{session_id}/download_action_plans")
 def download_action_plans(session_id: str):
-    if session_id not in sessions or "action_plan_file" not in sessions[session_id]:
+    session = sessions.get(session_id)
+    if session is None or "action_plan_file" not in session:
         raise HTTPException(status_code=404, detail="Action plan not found")
 
     return FileResponse(
-        sessions[session_id]["action_plan_file"],
+        session["action_plan_file"],
         media_type="text/markdown",
-        filename=os.path.basename(sessions[session_id]["action_plan_file"])
+        filename=os.path.basename(session["action_plan_file"])
     )
 
 
@@ -422,16 +686,26 @@ def download_action_plans(session_id: str):
 # ---------------------------------------------------------
 @app.get("/sessions/{session_id}/debug")
 def get_debug(session_id: str):
-    if session_id not in sessions:
-        raise HTTPException(status_code=404, detail="Session not found")
-    return sessions[session_id]
+    return _get_session(session_id)
+
 
 
+SSE_HEARTBEAT = float(os.getenv("SSE_HEARTBEAT", "15"))
+
 
 @app.get("/sessions/{session_id}/stream")
-def stream_session(session_id: str):
+def stream_session(session_id: str, stage: Optional[str] = None,
+                   last_event_id: Optional[str] = Header(None)):
     """
-    SSE endpoint: streams the graph progress up to gap analysis.
+    SSE endpoint: streams real graph progress for the session — node_start / node_end (with
+    elapsed seconds and a preview of what the node wrote) / node_error, bracketed by
+    run_start / run_end. Events carry ids; reconnect with Last-Event-ID to resume after the last one
+    seen. The stream follows runs and background jobs in progress, sends heartbeat comments while
+    idle, and ends with [[STREAM_END]] once nothing is running.
+    With ?stage=ideas or ?stage=action_plans it follows that stage's background job (start it with
+    POST .../generate_ideas or .../generate_action_plans?background=true), including the model's
+    `token` events (and action-plan `idea` events), and finishes with `event: done` once the stage's result exists.
+    The GET never starts work itself, so reconnects and reloads only replay and resubscribe.
     """
 
     if session_id not in sessions:
@@ -440,25 +714,78 @@ def stream_session(session_id: str):
             media_type="text/event-stream"
         )
 
-    def event_stream():
-        yield "data: === Starting session {} ===\n\n".format(session_id)
-        time.sleep(0.3)
-
-        # Log search stage
-        yield "data: Running search...\n\n"
-        time.sleep(0.3)
-
-        # Already stored in session from /sessions call
-        comps = sessions[session_id].get("extracted_competencies", [])
-        yield f"data: Extracted {len(comps)} competencies\n\n"
-        time.sleep(0.3)
-
-        # Gap questions
-        gaps = sessions[session_id].get("gap_questions", [])
-        yield f"data: Generated {len(gaps)} gap questions\n\n"
-        time.sleep(0.3)
-
-        # Final signal for stream end
-        yield "data: [[STREAM_END]]\n\n"
-
-    return StreamingResponse(event_stream(), media_type="text/event-stream")
+    try:
+        after = int(last_event_id) if last_event_id else 0
+    except ValueError:
+        after = 0
+    if stage is not None and stage not in _STREAM_STAGES:
+        raise HTTPException(status_code=400, detail=f"Unknown stage: {stage}")
+    body = _stream_stage(session_id, stage, after) if stage else _stream_progress(session_id, after)
+    return StreamingResponse(body, media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# stage -> (job kind, session field holding its result, download endpoint)
+_STREAM_STAGES = {
+    "ideas": ("generate_ideas", "idea_map_csv", "download_idea_map"),
+    "action_plans": ("generate_action_plans", "action_plan_file", "download_action_plans"),
+}
+
+
+async def _session_busy(session_id: str, ended_jobs: set, remote: dict) -> bool:
+    """Whether a graph run or job is still going. Local state is checked on every wake; the shared
+    job store (jobs on other workers) at most once per SSE_HEARTBEAT, in a worker thread."""
+    def running(js):
+        return any(j["status"] in ("queued", "running") and j["job_id"] not in ended_jobs for j in js)
+
+    if progress_bus.active(session_id) or running(jobs.list(session_id, include_remote=False)):
+        return True
+    if time.monotonic() - remote.get("checked_at", 0.0) >= SSE_HEARTBEAT:
+        remote["busy"] = running(await jobs.alist(session_id))
+        remote["checked_at"] = time.monotonic()
+    return remote.get("busy", False)
+
+
+async def _progress_events(session_id: str, after: int):
+    if not after:
+        # fresh connection: current state first, then the buffered history
+        session = (await sessions.aget(session_id)) or {}
+        yield format_sse({
+            "state": session.get("state"),
+            "competencies": len(session.get("extracted_competencies") or []),
+            "gap_questions": len(session.get("gap_questions") or []),
+            "ideas": len(session.get("generated_ideas") or []),
+        }, event="snapshot")
+
+    ended_jobs, remote = set(), {}
+    while True:
+        events = await progress_bus.wait(session_id, after, timeout=SSE_HEARTBEAT)
+        for ev in events:
+            after = ev["id"]
+            if ev["event"] == "job_end":
+                ended_jobs.add(ev["data"].get("job_id"))
+            yield format_sse(ev["data"], event=ev["event"], event_id=ev["id"])
+        if not await _session_busy(session_id, ended_jobs, remote) and not progress_bus.history(session_id, after):
+            break
+        if not events:
+            yield ": heartbeat\n\n"
+
+
+async def _stream_progress(session_id: str, after: int):
+    async for chunk in _progress_events(session_id, after):
+        yield chunk
+    yield "data: [[STREAM_END]]\n\n"
+
+
+async def _stream_stage(session_id: str, stage: str, after: int):
+    kind, result_field, download = _STREAM_STAGES[stage]
+    if await _active_job(session_id, kind) or progress_bus.history(session_id, after):
+        async for chunk in _progress_events(session_id, after):
+            yield chunk
+    session = (await sessions.aget(session_id)) or {}
+    if session.get(result_field):
+        yield format_sse({"download_endpoint": f"/sessions/{session_id}/{download}"}, event="done")
+    else:
+        yield format_sse(f"No {stage} result yet; start it with POST /sessions/{session_id}/{kind}?background=true",
+                         event="error")
+    yield "data: [[STREAM_END]]\n\n"
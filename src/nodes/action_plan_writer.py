@@ -1,5 +1,5 @@
 # src/nodes/action_plan_writer.py
-from src.gemini_client import generate_text
+from src.gemini_client import generate_text, generate_text_stream
 import os
 import logging
 
@@ -10,17 +10,29 @@ def build_context_for_idea(session_id: str, idea):
     rationale = idea.get("strategic_rationale") or "No rationale provided."
     return f"Idea: {idea.get('title', 'Untitled Idea')}\nComponents: {comps}\nRationale: {rationale}\n"
 
+def _action_plan_prompt(session_id: str, idea):
+    context = build_context_for_idea(session_id, idea.get("idea_doc") or idea)
+    return (
+        "You are a senior corporate strategist. Produce a detailed action plan for the following idea. "
+        "Include: Executive Summary, Market Analysis, Required Competencies & Gaps, Partnering Strategy, "
+        "Resources & Timeline, Risk Assessment. Return the output in markdown.\n\n"
+        f"{context}"
+    )
+
+def _save_action_plans(session_id: str, full_md: str, artifacts_dir: str):
+    os.makedirs(artifacts_dir, exist_ok=True)
+    path = os.path.join(artifacts_dir, f"{session_id}_top3_action_plans.md")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(full_md)
+
+    logging.info(f"Action plans saved to: {path}")
+    return path
+
 def generate_action_plans(session_id: str, selected_ideas: list, artifacts_dir: str):
     full_md = "# Action Plans\n\n"
 
     for idea in selected_ideas:
-        context = build_context_for_idea(session_id, idea.get("idea_doc") or idea)
-        prompt = (
-            "You are a senior corporate strategist. Produce a detailed action plan for the following idea. "
-            "Include: Executive Summary, Market Analysis, Required Competencies & Gaps, Partnering Strategy, "
-            "Resources & Timeline, Risk Assessment. Return the output in markdown.\n\n"
-            f"{context}"
-        )
+        prompt = _action_plan_prompt(session_id, idea)
 
         try:
             resp = generate_text(prompt)
@@ -31,11 +43,34 @@ def generate_action_plans(session_id: str, selected_ideas: list, artifacts_dir:
         full_md += f"## {idea.get('title', 'Untitled Idea')}\n\n"
         full_md += resp + "\n\n---\n\n"
 
-    os.makedirs(artifacts_dir, exist_ok=True)
-    path = os.path.join(artifacts_dir, f"{session_id}_top3_action_plans.md")
-    with open(path, "w", encoding="utf-8") as f:
-        f.write(full_md)
+    return _save_action_plans(session_id, full_md, artifacts_dir)
 
-    logging.info(f"Action plans saved to: {path}")
-    return path
+def stream_action_plans(session_id: str, selected_ideas: list, artifacts_dir: str):
+    """
+    Streaming variant of generate_action_plans. Yields event dicts as text arrives:
+      {"event": "idea", "title": ...}, {"event": "token", "text": ...}, {"event": "saved", "path": ...}
+    The markdown file written at the end is identical to the non-streaming output.
+    """
+    full_md = "# Action Plans\n\n"
+
+    for idea in selected_ideas:
+        title = idea.get('title', 'Untitled Idea')
+        yield {"event": "idea", "title": title}
+        prompt = _action_plan_prompt(session_id, idea)
+
+        parts = []
+        try:
+            for chunk in generate_text_stream(prompt):
+                parts.append(chunk)
+                yield {"event": "token", "text": chunk}
+            resp = "".join(parts)
+        except Exception as e:
+            logging.warning(f"Gemini API call failed for idea '{title}': {e}")
+            resp = "".join(parts) or "_Action plan generation failed due to API error._"
+            yield {"event": "error", "title": title, "message": str(e)}
+
+        full_md += f"## {title}\n\n"
+        full_md += resp + "\n\n---\n\n"
 
+    path = _save_action_plans(session_id, full_md, artifacts_dir)
+    yield {"event": "saved", "path": path}
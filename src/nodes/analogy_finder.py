@@ -1,18 +1,80 @@
 # src/nodes/analogy_finder.py
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from src.nodes.search_agent import search_company
-from src.gemini_client import generate_json
+from src.gemini_client import generate_json, agenerate_json
+from src.schemas import ANALOGY_LIST_SCHEMA
+
+def _analogies_prompt(idea):
+    return (
+        "Given this idea description, produce 3 real-world analogous products or references (short list). "
+        "Return as JSON array of strings.\n\n"
+        f"IDEA:\nTitle: {idea.get('title')}\nRationale: {idea.get('strategic_rationale')}\n\nReturn only JSON array."
+    )
+
 
 def find_analogies_for_idea(idea):
     """
     Try to find 1-3 real-world analogs by searching web or asking Gemini.
     """
     # simple LLM approach
-    prompt = (
-        "Given this idea description, produce 3 real-world analogous products or references (short list). "
-        "Return as JSON array of strings.\n\n"
-        f"IDEA:\nTitle: {idea.get('title')}\nRationale: {idea.get('strategic_rationale')}\n\nReturn only JSON array."
-    )
-    parsed, raw = generate_json(prompt, debug=False)
+    parsed, raw = generate_json(_analogies_prompt(idea), debug=False, schema=ANALOGY_LIST_SCHEMA)
     if isinstance(parsed, list):
         return parsed
     return []
+
+
+async def afind_analogies_for_idea(idea):
+    parsed, raw = await agenerate_json(_analogies_prompt(idea), debug=False, schema=ANALOGY_LIST_SCHEMA)
+    if isinstance(parsed, list):
+        return parsed
+    return []
+
+
+def enrich_ideas_with_analogies(ideas: list, min_analogs: int = 3, max_workers: int = 4):
+    """
+    Fill example_analogs for ideas that came back with fewer than min_analogs, looking them up
+    concurrently. Returns (enriched_ideas, changed_ideas); inputs are not mutated.
+    """
+    todo = [i for i, idea in enumerate(ideas) if len(idea.get("example_analogs") or []) < min_analogs]
+    if not todo:
+        return list(ideas), []
+
+    def _lookup(idea):
+        try:
+            return find_analogies_for_idea(idea)
+        except Exception as e:
+            print(f"[WARN] Analogy lookup failed for '{idea.get('title')}':", e)
+            return []
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(todo)))) as pool:
+        found = list(pool.map(lambda i: _lookup(ideas[i]), todo))
+    return _merge_analogies(ideas, todo, found)
+
+
+async def aenrich_ideas_with_analogies(ideas: list, min_analogs: int = 3):
+    """Async variant of enrich_ideas_with_analogies; lookups are gathered on the event loop."""
+    todo = [i for i, idea in enumerate(ideas) if len(idea.get("example_analogs") or []) < min_analogs]
+    if not todo:
+        return list(ideas), []
+
+    async def _lookup(idea):
+        try:
+            return await afind_analogies_for_idea(idea)
+        except Exception as e:
+            print(f"[WARN] Analogy lookup failed for '{idea.get('title')}':", e)
+            return []
+
+    found = await asyncio.gather(*(_lookup(ideas[i]) for i in todo))
+    return _merge_analogies(ideas, todo, found)
+
+
+def _merge_analogies(ideas: list, todo: list, found: list):
+    enriched, changed = list(ideas), []
+    for i, analogs in zip(todo, found):
+        existing = list(ideas[i].get("example_analogs") or [])
+        merged = existing + [str(a) for a in analogs if str(a) not in existing]
+        if len(merged) > len(existing):
+            enriched[i] = {**ideas[i], "example_analogs": merged}
+            changed.append(enriched[i])
+    return enriched, changed
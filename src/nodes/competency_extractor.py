@@ -1,6 +1,13 @@
-import json, uuid
-from src.db.mongo import get_collection
-from src.gemini_client import generate_json
+import json
+import os
+import re
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import DeleteOne, ReplaceOne, UpdateOne
+from src.db.mongo import get_collection, content_id, bulk_upsert
+from src.gemini_client import generate_json, agenerate_json
+from src.schemas import COMPETENCY_LIST_SCHEMA, COMPETENCY_DELTA_SCHEMA
 
 # ------------------------------------------
 # Normalization Layer (Enforces 4 Categories)
@@ -43,13 +50,21 @@ def normalize_level(level: str):
 # ==========================================
 # Extractor: FROM SNIPPETS
 # ==========================================
-def extract_from_snippets(session_id: str, snippets_list: list):
-    snippets_text = "\n\n".join([
+# Above this many snippet characters extraction switches to map-reduce over shards
+EXTRACT_CHUNK_THRESHOLD = int(os.getenv("EXTRACT_CHUNK_THRESHOLD", "12000"))
+EXTRACT_SHARD_CHARS = int(os.getenv("EXTRACT_SHARD_CHARS", "6000"))
+EXTRACT_MAX_WORKERS = int(os.getenv("EXTRACT_MAX_WORKERS", "4"))
+
+
+def _snippets_text(snippets_list: list):
+    return "\n\n".join([
         f"URL: {s.get('url','')}\nSNIPPET: {s.get('snippet','')}"
         for s in snippets_list
     ])
 
-    prompt = (
+
+def _snippet_prompt(snippets_text: str):
+    return (
         "You are a structured extractor. Given these website snippets, return ONLY a JSON array of competencies.\n\n"
         "Each item MUST follow this schema strictly:\n"
         "{\n"
@@ -67,82 +82,214 @@ def extract_from_snippets(session_id: str, snippets_list: list):
         f"SNIPPETS:\n{snippets_text}\n\nReturn ONLY the JSON array."
     )
 
-    parsed, raw = generate_json(prompt, debug=False)
+
+def _competency_doc(session_id: str, c: dict):
+    level = normalize_level(
+        c.get("technology_level") or c.get("Technology Level")
+    )
+    category = c.get("category") or c.get("Category")
+    competency = c.get("competency") or c.get("Competency")
+    return {
+        "_id": content_id(session_id, category, competency),
+        "session_id": session_id,
+        "category": category,
+        "competency": competency,
+        "description": c.get("description") or c.get("Description"),
+        "technology_level": level,
+        "source_url": c.get("source_url") or c.get("Source URL") or ""
+    }
+
+
+def _heuristic_competencies(session_id: str, snippets_text: str):
+    # fallback lightweight heuristic
     results = []
+    text = snippets_text.lower()
+
+    if "electric" in text:
+        results.append({
+            "_id": content_id(session_id, "Product & Technology", "Electric Powertrains"),
+            "session_id": session_id,
+            "category": "Product & Technology",
+            "competency": "Electric Powertrains",
+            "description": "High-efficiency battery and motor systems",
+            "technology_level": "Advanced",
+            "source_url": ""
+        })
 
+    if "autonomous" in text:
+        results.append({
+            "_id": content_id(session_id, "Product & Technology", "Autonomous Driving"),
+            "session_id": session_id,
+            "category": "Product & Technology",
+            "competency": "Autonomous Driving",
+            "description": "AI-based self-driving technology",
+            "technology_level": "Cutting-edge",
+            "source_url": ""
+        })
+
+    if not results:
+        results.append({
+            "_id": content_id(session_id, "Product & Technology", "Core Products"),
+            "session_id": session_id,
+            "category": "Product & Technology",
+            "competency": "Core Products",
+            "description": f"Key products of {session_id}",
+            "technology_level": "Intermediate",
+            "source_url": ""
+        })
+    return results
+
+
+def _extract_shard(session_id: str, snippets_list: list, split: bool = True):
+    """Extract one shard; returns (docs, used_fallback). Never raises.
+    A shard that doesn't parse is retried once as two halves before using the heuristic."""
+    snippets_text = _snippets_text(snippets_list)
+    try:
+        parsed, raw = generate_json(_snippet_prompt(snippets_text), debug=False, schema=COMPETENCY_LIST_SCHEMA)
+    except Exception as e:
+        logging.warning("Competency extraction shard failed: %s", e)
+        parsed = None
     if isinstance(parsed, list):
-        for c in parsed:
-            level = normalize_level(
-                c.get("technology_level") or c.get("Technology Level")
-            )
-            doc = {
-                "_id": str(uuid.uuid4()),
-                "session_id": session_id,
-                "category": c.get("category") or c.get("Category"),
-                "competency": c.get("competency") or c.get("Competency"),
-                "description": c.get("description") or c.get("Description"),
-                "technology_level": level,
-                "source_url": c.get("source_url") or c.get("Source URL") or ""
-            }
-            get_collection("competencies").insert_one(doc)
-            results.append(doc)
+        return [_competency_doc(session_id, c) for c in parsed if isinstance(c, dict)], False
+    if split and len(snippets_list) > 1:
+        mid = len(snippets_list) // 2
+        left, left_fb = _extract_shard(session_id, snippets_list[:mid], split=False)
+        right, right_fb = _extract_shard(session_id, snippets_list[mid:], split=False)
+        return left + right, left_fb and right_fb
+    return _heuristic_competencies(session_id, snippets_text), True
+
+
+def _shard_snippets(snippets_list: list, max_chars: int):
+    """Greedily pack snippets (in order) into shards of at most max_chars snippet text."""
+    shards, current, size = [], [], 0
+    for s in snippets_list:
+        n = len(s.get("snippet", "") or "")
+        if current and size + n > max_chars:
+            shards.append(current)
+            current, size = [], 0
+        current.append(s)
+        size += n
+    if current:
+        shards.append(current)
+    return shards
+
+
+def _norm_name(name):
+    return re.sub(r"[^a-z0-9]+", " ", str(name or "").lower()).strip()
+
+
+def _desc_similarity(a, b):
+    ta = set(re.findall(r"\w+", str(a or "").lower()))
+    tb = set(re.findall(r"\w+", str(b or "").lower()))
+    if not ta or not tb:
+        return 0.0
+    return len(ta & tb) / len(ta | tb)
+
 
+def merge_competencies(docs: list, desc_threshold: float = 0.6):
+    """
+    Reduce step: drop competencies repeated across shards. Two docs are the same competency when
+    their normalized names match, or when they share a category and their descriptions overlap
+    by at least desc_threshold (word Jaccard). The first doc wins, enriched with a missing
+    source_url and the longer description.
+    """
+    merged, by_name = [], {}
+    for d in docs:
+        key = _norm_name(d.get("competency"))
+        match = by_name.get(key) if key else None
+        if match is None:
+            for m in merged:
+                if _norm_name(m.get("category")) == _norm_name(d.get("category")) and \
+                        _desc_similarity(m.get("description"), d.get("description")) >= desc_threshold:
+                    match = m
+                    break
+        if match is None:
+            merged.append(d)
+            if key:
+                by_name[key] = d
+            continue
+        if not match.get("source_url") and d.get("source_url"):
+            match["source_url"] = d["source_url"]
+        if len(str(d.get("description") or "")) > len(str(match.get("description") or "")):
+            match["description"] = d["description"]
+    return merged
+
+
+def extract_from_snippets_chunked(session_id: str, snippets_list: list, shard_chars: int = None):
+    """
+    Map-reduce extraction: shards are extracted concurrently (the Gemini governor still caps
+    in-flight calls), a shard whose output doesn't parse falls back to the heuristic on its
+    own text only, and results are merged with merge_competencies.
+    """
+    shards = _shard_snippets(snippets_list, shard_chars or EXTRACT_SHARD_CHARS)
+    with ThreadPoolExecutor(max_workers=max(1, min(EXTRACT_MAX_WORKERS, len(shards)))) as pool:
+        outputs = list(pool.map(lambda shard: _extract_shard(session_id, shard), shards))
+    results = _reduce_shards(outputs)
+    _persist(results)
+    return results
+
+
+def _is_placeholder(doc: dict) -> bool:
+    # the generic doc _heuristic_competencies emits when no keyword matched
+    return doc.get("competency") == "Core Products" and str(doc.get("description") or "").startswith("Key products of ")
+
+
+def _reduce_shards(outputs: list):
+    fallbacks = sum(1 for _, used_fallback in outputs if used_fallback)
+    docs = [d for shard_docs, _ in outputs for d in shard_docs]
+    # keep keyword hits from failed shards, but drop the generic placeholder whenever anything real
+    # was extracted — also when it came from the half of a split shard that fell back
+    real = [d for d in docs if not _is_placeholder(d)]
+    if real:
+        docs = real
+    results = merge_competencies(docs)
+    logging.info("Chunked extraction: %d shards (%d fell back), %d -> %d competencies",
+                 len(outputs), fallbacks, len(docs), len(results))
+    return results
+
+
+def _persist(docs: list):
+    # one unordered bulk upsert; content-hash _ids make graph re-runs idempotent
+    bulk_upsert("competencies", docs)
+
+
+def _unique_by_id(docs: list):
+    seen, out = set(), []
+    for d in docs:
+        if d["_id"] not in seen:
+            seen.add(d["_id"])
+            out.append(d)
+    return out
+
+
+def extract_from_snippets(session_id: str, snippets_list: list):
+    if sum(len(s.get("snippet", "") or "") for s in snippets_list) > EXTRACT_CHUNK_THRESHOLD:
+        return extract_from_snippets_chunked(session_id, snippets_list)
+
+    snippets_text = _snippets_text(snippets_list)
+    prompt = _snippet_prompt(snippets_text)
+
+    parsed, raw = generate_json(prompt, debug=False, schema=COMPETENCY_LIST_SCHEMA)
+
+    if isinstance(parsed, list):
+        results = _unique_by_id([_competency_doc(session_id, c) for c in parsed if isinstance(c, dict)])
     else:
-        # fallback lightweight heuristic
-        text = snippets_text.lower()
-
-        if "electric" in text:
-            results.append({
-                "_id": str(uuid.uuid4()),
-                "session_id": session_id,
-                "category": "Product & Technology",
-                "competency": "Electric Powertrains",
-                "description": "High-efficiency battery and motor systems",
-                "technology_level": "Advanced",
-                "source_url": ""
-            })
-
-        if "autonomous" in text:
-            results.append({
-                "_id": str(uuid.uuid4()),
-                "session_id": session_id,
-                "category": "Product & Technology",
-                "competency": "Autonomous Driving",
-                "description": "AI-based self-driving technology",
-                "technology_level": "Cutting-edge",
-                "source_url": ""
-            })
-
-        if not results:
-            results.append({
-                "_id": str(uuid.uuid4()),
-                "session_id": session_id,
-                "category": "Product & Technology",
-                "competency": "Core Products",
-                "description": f"Key products of {session_id}",
-                "technology_level": "Intermediate",
-                "source_url": ""
-            })
-
-        for doc in results:
-            get_collection("competencies").insert_one(doc)
+        results = _heuristic_competencies(session_id, snippets_text)
 
+    _persist(results)
     return results
 
 
 # ==========================================
 # Extractor: WITH CLARIFICATIONS
 # ==========================================
-def extract_with_clarifications(session_id: str, snippets_list: list, clarifications: list):
+def _clarification_prompt(snippets_list: list, clarifications: list):
     clar_text = "\n".join([
         f"Q: {q.get('question')} A: {q.get('answer')}"
         for q in clarifications
     ])
 
-    snippets_text = "\n\n".join([
-        f"URL: {s.get('url','')}\nSNIPPET: {s.get('snippet','')}"
-        for s in snippets_list
-    ])
+    snippets_text = _snippets_text(snippets_list)
 
     prompt = (
         "You are a structured extractor. Use the website snippets AND the human clarifications to produce a refined,\n"
@@ -160,26 +307,22 @@ def extract_with_clarifications(session_id: str, snippets_list: list, clarificat
         f"CLARIFICATIONS:\n{clar_text}\n\n"
         "Return ONLY JSON array."
     )
+    return prompt
+
+
+def extract_with_clarifications(session_id: str, snippets_list: list, clarifications: list):
+    prompt = _clarification_prompt(snippets_list, clarifications)
+    parsed, raw = generate_json(prompt, debug=False, schema=COMPETENCY_LIST_SCHEMA)
+    results = _clarified_competencies(session_id, parsed, clarifications)
+    _persist(results)
+    return results
+
 
-    parsed, raw = generate_json(prompt, debug=False)
+def _clarified_competencies(session_id: str, parsed, clarifications: list):
     results = []
 
     if isinstance(parsed, list):
-        for c in parsed:
-            level = normalize_level(
-                c.get("technology_level") or c.get("Technology Level")
-            )
-            doc = {
-                "_id": str(uuid.uuid4()),
-                "session_id": session_id,
-                "category": c.get("category") or c.get("Category"),
-                "competency": c.get("competency") or c.get("Competency"),
-                "description": c.get("description") or c.get("Description"),
-                "technology_level": level,
-                "source_url": c.get("source_url") or c.get("Source URL") or ""
-            }
-            get_collection("competencies").insert_one(doc)
-            results.append(doc)
+        results = _unique_by_id([_competency_doc(session_id, c) for c in parsed if isinstance(c, dict)])
 
     else:
         # Fallback: derive competencies from clarifications
@@ -187,7 +330,7 @@ def extract_with_clarifications(session_id: str, snippets_list: list, clarificat
             ans = a.get("answer", "")
             if any(k in ans.lower() for k in ["chip", "semiconductor", "silicon", "processor"]):
                 doc = {
-                    "_id": str(uuid.uuid4()),
+                    "_id": content_id(session_id, "Product & Technology", "Custom Silicon Design"),
                     "session_id": session_id,
                     "category": "Product & Technology",
                     "competency": "Custom Silicon Design",
@@ -195,8 +338,172 @@ def extract_with_clarifications(session_id: str, snippets_list: list, clarificat
                     "technology_level": "Advanced",
                     "source_url": ""
                 }
-                get_collection("competencies").insert_one(doc)
                 results.append(doc)
+        results = _unique_by_id(results)
+    return results
+
+
+# ==========================================
+# Refiner: DELTA (only the newly added answers)
+# ==========================================
+def answer_key(item: dict):
+    """Stable identity of one clarification, used to tell new answers from processed ones."""
+    return f"{str(item.get('question', '')).strip()}\u241f{str(item.get('answer', '')).strip()}"
+
+
+def refine_competencies_delta(session_id: str, current: list, new_answers: list):
+    """
+    Incremental refinement: send only the current competency list (with short refs) and the
+    newly added answers; the model returns add/update/remove operations which are applied to
+    `current`. Mongo is touched only for the changed documents.
+    Returns (refined_list, ops_summary) or (None, None) if the model output was unusable,
+    in which case callers should fall back to extract_with_clarifications.
+    """
+    refs, prompt = _delta_prompt(current, new_answers)
+    parsed, raw = generate_json(prompt, debug=False, schema=COMPETENCY_DELTA_SCHEMA)
+    return _apply_delta(session_id, refs, parsed)
+
+
+def _delta_prompt(current: list, new_answers: list):
+    refs = {f"c{i}": c for i, c in enumerate(current)}
+    comps_text = "\n".join(
+        f"{ref} | {c.get('category','')} | {c.get('competency','')} | {c.get('technology_level','')} | {c.get('description','')}"
+        for ref, c in refs.items()
+    )
+    clar_text = "\n".join(f"Q: {q.get('question')} A: {q.get('answer')}" for q in new_answers)
+
+    prompt = (
+        "You maintain a company's competency list. Below is the CURRENT list (ref | category | competency | "
+        "technology_level | description) and NEW human clarifications. Decide only what the new clarifications change.\n\n"
+        "Return a JSON object:\n"
+        "{\n"
+        '  "add": [{category, competency, description, technology_level, source_url}],\n'
+        '  "update": [{"ref": "c3", ...only the fields that change...}],\n'
+        '  "remove": ["c5", ...]\n'
+        "}\n\n"
+        "technology_level MUST be one of: Basic, Intermediate, Advanced, Cutting-edge.\n"
+        "Use empty arrays when nothing changes. Do NOT repeat unchanged competencies.\n\n"
+        f"CURRENT:\n{comps_text}\n\n"
+        f"NEW CLARIFICATIONS:\n{clar_text}\n\n"
+        "Return only JSON."
+    )
+    return refs, prompt
+
 
+def _apply_delta(session_id: str, refs: dict, parsed):
+    if not isinstance(parsed, dict):
+        return None, None
+
+    removed = {r for r in (parsed.get("remove") or []) if r in refs}
+    updated = {}
+    for u in parsed.get("update") or []:
+        if not isinstance(u, dict) or u.get("ref") not in refs or u.get("ref") in removed:
+            continue
+        changes = {}
+        for field in ("category", "competency", "description", "source_url"):
+            if u.get(field) not in (None, "") and u.get(field) != refs[u["ref"]].get(field):
+                changes[field] = u[field]
+        if u.get("technology_level"):
+            level = normalize_level(u["technology_level"])
+            if level != refs[u["ref"]].get("technology_level"):
+                changes["technology_level"] = level
+        if changes:
+            updated[u["ref"]] = changes
+    added = [_competency_doc(session_id, c) for c in (parsed.get("add") or []) if isinstance(c, dict)]
+
+    refined, deletes, writes = [], [], []
+    kept_ids = set()
+    for ref, c in refs.items():
+        if ref in removed:
+            if c.get("_id"):
+                deletes.append(DeleteOne({"_id": c["_id"]}))
+            continue
+        if ref in updated:
+            c = {**c, **updated[ref]}
+            old_id = c.get("_id")
+            new_id = content_id(session_id, c.get("category"), c.get("competency"))
+            if old_id and new_id != old_id:
+                # renamed/re-categorised: the content-hash _id follows the content, otherwise a
+                # later full upsert of the same competency would create a duplicate
+                c["_id"] = new_id
+                deletes.append(DeleteOne({"_id": old_id}))
+                writes.append(ReplaceOne({"_id": new_id}, c, upsert=True))
+            elif old_id:
+                writes.append(UpdateOne({"_id": old_id}, {"$set": updated[ref]}))
+        if c.get("_id") in kept_ids:
+            continue   # renamed onto a competency that's already in the list
+        if c.get("_id"):
+            kept_ids.add(c["_id"])
+        refined.append(c)
+    added = [d for d in _unique_by_id(added) if d["_id"] not in kept_ids]
+    writes.extend(ReplaceOne({"_id": d["_id"]}, d, upsert=True) for d in added)
+    # all changed documents in one round-trip; ordered so old ids are deleted before the
+    # (possibly colliding) rewritten documents land
+    if deletes or writes:
+        get_collection("competencies").bulk_write(deletes + writes, ordered=True)
+    refined.extend(added)
+
+    summary = {"added": len(added), "updated": len(updated), "removed": len(removed)}
+    logging.info("Delta refinement for %s: %s", session_id, summary)
+    return refined, summary
+
+
+# ==========================================
+# Async variants (used by the async graph nodes)
+# Gemini calls go through client.aio; Mongo writes run in worker threads.
+# ==========================================
+async def _aextract_shard(session_id: str, snippets_list: list, split: bool = True):
+    snippets_text = _snippets_text(snippets_list)
+    try:
+        parsed, raw = await agenerate_json(_snippet_prompt(snippets_text), debug=False, schema=COMPETENCY_LIST_SCHEMA)
+    except Exception as e:
+        logging.warning("Competency extraction shard failed: %s", e)
+        parsed = None
+    if isinstance(parsed, list):
+        return [_competency_doc(session_id, c) for c in parsed if isinstance(c, dict)], False
+    if split and len(snippets_list) > 1:
+        mid = len(snippets_list) // 2
+        (left, left_fb), (right, right_fb) = await asyncio.gather(
+            _aextract_shard(session_id, snippets_list[:mid], split=False),
+            _aextract_shard(session_id, snippets_list[mid:], split=False),
+        )
+        return left + right, left_fb and right_fb
+    return _heuristic_competencies(session_id, snippets_text), True
+
+
+async def aextract_from_snippets_chunked(session_id: str, snippets_list: list, shard_chars: int = None):
+    shards = _shard_snippets(snippets_list, shard_chars or EXTRACT_SHARD_CHARS)
+    outputs = await asyncio.gather(*(_aextract_shard(session_id, shard) for shard in shards))
+    results = _reduce_shards(list(outputs))
+    await asyncio.to_thread(_persist, results)
+    return results
+
+
+async def aextract_from_snippets(session_id: str, snippets_list: list):
+    if sum(len(s.get("snippet", "") or "") for s in snippets_list) > EXTRACT_CHUNK_THRESHOLD:
+        return await aextract_from_snippets_chunked(session_id, snippets_list)
+
+    snippets_text = _snippets_text(snippets_list)
+    parsed, raw = await agenerate_json(_snippet_prompt(snippets_text), debug=False, schema=COMPETENCY_LIST_SCHEMA)
+
+    if isinstance(parsed, list):
+        results = _unique_by_id([_competency_doc(session_id, c) for c in parsed if isinstance(c, dict)])
+    else:
+        results = _heuristic_competencies(session_id, snippets_text)
+
+    await asyncio.to_thread(_persist, results)
     return results
 
+
+async def aextract_with_clarifications(session_id: str, snippets_list: list, clarifications: list):
+    prompt = _clarification_prompt(snippets_list, clarifications)
+    parsed, raw = await agenerate_json(prompt, debug=False, schema=COMPETENCY_LIST_SCHEMA)
+    results = _clarified_competencies(session_id, parsed, clarifications)
+    await asyncio.to_thread(_persist, results)
+    return results
+
+
+async def arefine_competencies_delta(session_id: str, current: list, new_answers: list):
+    refs, prompt = _delta_prompt(current, new_answers)
+    parsed, raw = await agenerate_json(prompt, debug=False, schema=COMPETENCY_DELTA_SCHEMA)
+    return await asyncio.to_thread(_apply_delta, session_id, refs, parsed)
@@ -1,9 +1,15 @@
 # src/nodes/gap_analyzer.py
-from src.gemini_client import generate_json
+from src.gemini_client import generate_json, agenerate_json
+from src.schemas import GAP_QUESTIONS_SCHEMA
 import logging
 
 logging.basicConfig(level=logging.INFO)
 
+STARTER_QUESTIONS = [
+    "Please provide the company's main product lines and any specialized hardware or software capabilities.",
+    "When you are finished answering all clarifying questions, reply with the single word: COMPLETE"
+]
+
 def ask_gaps_for_competencies(extracted):
     """
     Uses LLM to craft clarifying questions to refine competencies.
@@ -12,11 +18,31 @@ def ask_gaps_for_competencies(extracted):
     """
     # If nothing was extracted, ask an open starter question
     if not extracted:
-        return [
-            "Please provide the company's main product lines and any specialized hardware or software capabilities.",
-            "When you are finished answering all clarifying questions, reply with the single word: COMPLETE"
-        ]
+        return list(STARTER_QUESTIONS)
+
+    try:
+        parsed, raw = generate_json(_gaps_prompt(extracted), debug=False, schema=GAP_QUESTIONS_SCHEMA)
+        # generate_json should return (parsed, raw) where parsed is already a Python structure
+    except Exception as e:
+        logging.warning("generate_json failed in ask_gaps_for_competencies: %s", e)
+        parsed = None
+        raw = None
+    return _questions_from_output(extracted, parsed, raw)
+
+async def aask_gaps_for_competencies(extracted):
+    """Async variant of ask_gaps_for_competencies."""
+    if not extracted:
+        return list(STARTER_QUESTIONS)
+
+    try:
+        parsed, raw = await agenerate_json(_gaps_prompt(extracted), debug=False, schema=GAP_QUESTIONS_SCHEMA)
+    except Exception as e:
+        logging.warning("agenerate_json failed in aask_gaps_for_competencies: %s", e)
+        parsed = None
+        raw = None
+    return _questions_from_output(extracted, parsed, raw)
 
+def _gaps_prompt(extracted):
     # Build a compact competency summary for the prompt (limit to first 20)
     comps_text = "\n".join([f"- {c.get('category','')} | {c.get('competency','')}: {c.get('description','')}" for c in extracted[:20]])
 
@@ -32,15 +58,9 @@ def ask_gaps_for_competencies(extracted):
         f"Discovered Competencies:\n{comps_text}\n\n"
         "Return only JSON."
     )
+    return prompt
 
-    try:
-        parsed, raw = generate_json(prompt, debug=False)
-        # generate_json should return (parsed, raw) where parsed is already a Python structure
-    except Exception as e:
-        logging.warning("generate_json failed in ask_gaps_for_competencies: %s", e)
-        parsed = None
-        raw = None
-
+def _questions_from_output(extracted, parsed, raw):
     questions = []
     complete = False
 
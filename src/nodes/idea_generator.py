@@ -1,10 +1,11 @@
 # src/nodes/idea_generator.py
-from src.gemini_client import generate_json
-import uuid
-from src.db.mongo import get_collection
+import asyncio
+from src.gemini_client import generate_json, agenerate_json, generate_text_stream, parse_json_text
+from src.schemas import IDEA_LIST_SCHEMA
+from src.db.mongo import get_collection, content_id, bulk_upsert
 from src.nodes.semantic_reasoner import index_competencies_for_session, retrieve_relevant_competencies
 
-def generate_ideas_from_csv(session_id: str, max_ideas=10):
+def _ideas_prompt(session_id: str, max_ideas=10):
     # index existing competencies
     index_competencies_for_session(session_id)
 
@@ -12,19 +13,27 @@ def generate_ideas_from_csv(session_id: str, max_ideas=10):
     comps = list(col.find({"session_id": session_id}))
     comps_text = "\n".join([f"{c['competency']} ({c['category']}): {c['description']}" for c in comps])
 
-    prompt = (
+    return (
         "You are a creative strategist. Given the following validated competencies, generate up to "
         f"{max_ideas} innovative ideas. Each idea must be an object with: title, components (list), "
         "application_area, strategic_rationale, example_analogs (list).\n\n"
         f"COMPETENCIES:\n{comps_text}\n\nReturn only a JSON array."
     )
-    parsed, raw = generate_json(prompt, debug=False, cleanup_attempt=True)
+
+def _store_ideas(session_id: str, parsed):
     ideas = []
     if isinstance(parsed, list):
-        idea_col = get_collection("ideas")
+        seen = set()
         for i in parsed:
+            if not isinstance(i, dict):
+                continue
+            # content-hash _id: regenerating the same idea upserts rather than duplicating
+            _id = content_id(session_id, i.get("title"))
+            if _id in seen:
+                continue
+            seen.add(_id)
             doc = {
-                "_id": str(uuid.uuid4()),
+                "_id": _id,
                 "session_id": session_id,
                 "title": i.get("title"),
                 "components": i.get("components"),
@@ -32,7 +41,46 @@ def generate_ideas_from_csv(session_id: str, max_ideas=10):
                 "strategic_rationale": i.get("strategic_rationale"),
                 "example_analogs": i.get("example_analogs", [])
             }
-            idea_col.insert_one(doc)
             ideas.append(doc)
+        bulk_upsert("ideas", ideas)
     # fallback: none
     return ideas
+
+def generate_ideas_from_csv(session_id: str, max_ideas=10, on_token=None):
+    # with on_token the completion is streamed (stream_ideas_from_csv) and each chunk passed to it
+    if on_token is not None:
+        ideas = []
+        for ev in stream_ideas_from_csv(session_id, max_ideas):
+            if ev["event"] == "token":
+                on_token(ev["text"])
+            else:
+                ideas = ev["ideas"]
+        return ideas
+    prompt = _ideas_prompt(session_id, max_ideas)
+    parsed, raw = generate_json(prompt, debug=False, cleanup_attempt=True, schema=IDEA_LIST_SCHEMA)
+    return _store_ideas(session_id, parsed)
+
+async def agenerate_ideas_from_csv(session_id: str, max_ideas=10, on_token=None):
+    if on_token is not None:
+        # the SDK's streaming call is synchronous; consume it in a worker thread
+        return await asyncio.to_thread(generate_ideas_from_csv, session_id, max_ideas, on_token)
+    # indexing and Mongo reads/writes stay blocking, so they run in worker threads
+    prompt = await asyncio.to_thread(_ideas_prompt, session_id, max_ideas)
+    parsed, raw = await agenerate_json(prompt, debug=False, cleanup_attempt=True, schema=IDEA_LIST_SCHEMA)
+    return await asyncio.to_thread(_store_ideas, session_id, parsed)
+
+def stream_ideas_from_csv(session_id: str, max_ideas=10):
+    """
+    Streaming variant of generate_ideas_from_csv. Yields {"event": "token", "text": ...} while the
+    JSON arrives, then {"event": "ideas", "ideas": [...]} once it is parsed and stored.
+    Falls back to the non-streaming generate_json (with cleanup) if the streamed text doesn't parse.
+    """
+    prompt = _ideas_prompt(session_id, max_ideas)
+    parts = []
+    for chunk in generate_text_stream(prompt, config={"response_mime_type": "application/json", "response_schema": IDEA_LIST_SCHEMA}):
+        parts.append(chunk)
+        yield {"event": "token", "text": chunk}
+    parsed = parse_json_text("".join(parts))
+    if not isinstance(parsed, list):
+        parsed, raw = generate_json(prompt, debug=False, cleanup_attempt=True, schema=IDEA_LIST_SCHEMA)
+    yield {"event": "ideas", "ideas": _store_ideas(session_id, parsed)}
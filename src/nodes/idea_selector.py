@@ -1,27 +1,71 @@
 # src/nodes/idea_selector.py
 import pandas as pd
-import os
+import logging
 from src.db.mongo import get_collection
 
-def score_and_select_top(session_id: str, eval_csv_path: str, top_k=3, weights=(3,2,1)):
-    df = pd.read_csv(eval_csv_path)
-    # normalize priority mapping
-    def prio_to_val(p):
-        if str(p).strip().upper().startswith("H"):
-            return 3
-        if str(p).strip().upper().startswith("M"):
-            return 2
-        return 1
-    df["priority_val"] = df["Priority (H/M/L)"].apply(prio_to_val)
-    # compute weighted score (example weights)
-    w1, w2, w3 = weights
-    df["score"] = df["Strategic Fit (1-5)"]*w1 + df["Market Attractiveness (1-5)"]*w2 + df["Technical Feasibility (1-5)"]*w3 + df["priority_val"]*2
-    top = df.sort_values("score", ascending=False).head(top_k)
-    # fetch idea docs from Mongo to return full info
-    idea_col = get_collection("ideas")
-    selected = []
-    for _, row in top.iterrows():
-        title = row["Idea"]
-        doc = idea_col.find_one({"session_id": session_id, "title": title}, {"_id":0})
-        selected.append({"title": title, "score": row["score"], "priority": row["Priority (H/M/L)"], "idea_doc": doc})
-    return selected
+SCORE_COLUMNS = ("Strategic Fit (1-5)", "Market Attractiveness (1-5)", "Technical Feasibility (1-5)")
+PRIORITY_COLUMN = "Priority (H/M/L)"
+PRIORITY_VALUES = {"H": 3, "M": 2}   # anything else counts as L = 1
+DEFAULT_WEIGHTS = {"strategic_fit": 3, "market_attractiveness": 2, "technical_feasibility": 1, "priority": 2}
+
+_idea_col = None
+
+
+def _ideas_collection():
+    # the (session_id, title) index backs the batched $in lookup below
+    global _idea_col
+    if _idea_col is None:
+        col = get_collection("ideas")
+        try:
+            col.create_index([("session_id", 1), ("title", 1)])
+        except Exception as e:
+            logging.warning("ideas (session_id, title) index creation failed: %s", e)
+        _idea_col = col
+    return _idea_col
+
+
+def resolve_weights(weights=None) -> dict:
+    """
+    Scoring weights as a dict. Accepts None (defaults), a dict with any of the DEFAULT_WEIGHTS keys,
+    or a 3/4-item sequence (strategic fit, market attractiveness, technical feasibility[, priority]).
+    Raises ValueError on anything else.
+    """
+    if weights is None:
+        return dict(DEFAULT_WEIGHTS)
+    if isinstance(weights, dict):
+        unknown = set(weights) - set(DEFAULT_WEIGHTS)
+        if unknown:
+            raise ValueError(f"Unknown weight(s): {sorted(unknown)}; expected {list(DEFAULT_WEIGHTS)}")
+        merged = {**DEFAULT_WEIGHTS, **weights}
+    elif isinstance(weights, (list, tuple)):
+        values = list(weights)
+        if len(values) not in (3, 4):
+            raise ValueError("weights must have 3 or 4 values")
+        merged = {**DEFAULT_WEIGHTS, **dict(zip(DEFAULT_WEIGHTS, values))}
+    else:
+        raise ValueError(f"weights must be an object or a list, got {type(weights).__name__}")
+    try:
+        return {k: float(v) for k, v in merged.items()}
+    except (TypeError, ValueError):
+        raise ValueError(f"weights must be numbers, got {merged}")
+
+
+def score_and_select_top(session_id: str, eval_csv_path: str, top_k=3, weights=None):
+    w = resolve_weights(weights)
+    df = pd.read_csv(eval_csv_path, usecols=["Idea", PRIORITY_COLUMN, *SCORE_COLUMNS])
+    # vectorized priority mapping and weighted score
+    prio = df[PRIORITY_COLUMN].astype(str).str.strip().str.upper().str[:1].map(PRIORITY_VALUES).fillna(1)
+    criteria = df[list(SCORE_COLUMNS)].to_numpy(dtype=float)
+    df["score"] = criteria @ [w["strategic_fit"], w["market_attractiveness"], w["technical_feasibility"]] \
+        + prio.to_numpy(dtype=float) * w["priority"]
+    top = df.nlargest(max(0, int(top_k)), "score")
+
+    # fetch all selected idea docs in one round-trip; the first doc per title wins, as find_one did
+    titles = top["Idea"].tolist()
+    docs = {}
+    for doc in _ideas_collection().find({"session_id": session_id, "title": {"$in": titles}}, {"_id": 0}):
+        docs.setdefault(doc.get("title"), doc)
+    return [
+        {"title": title, "score": score, "priority": priority, "idea_doc": docs.get(title)}
+        for title, score, priority in zip(titles, top["score"].tolist(), top[PRIORITY_COLUMN].tolist())
+    ]
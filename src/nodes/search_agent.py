@@ -3,10 +3,49 @@ import os
 import requests
 import json
 import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 
+from src.singleflight import SingleFlight
+from src import search_cache
+
 load_dotenv()
 TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
+TAVILY_URL = "https://api.tavily.com/search"
+TAVILY_POOL_SIZE = int(os.getenv("TAVILY_POOL_SIZE", "16"))
+# overall budget for a company's fan-out; slow queries past it are dropped, not waited on
+TAVILY_DEADLINE = float(os.getenv("TAVILY_DEADLINE", "20"))
+# "|"-separated query templates fanned out per company; {company} is substituted
+TAVILY_QUERIES = [q for q in os.getenv(
+    "TAVILY_QUERIES",
+    "{company}|{company} products and services|{company} patents|"
+    "{company} research and development|{company} partnerships and acquisitions"
+).split("|") if q.strip()]
+
+# concurrent sessions for the same company share one Tavily round-trip
+_tavily_flights = SingleFlight("tavily")
+
+# one keep-alive connection pool + worker pool for all Tavily traffic
+_http = None
+_http_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=TAVILY_POOL_SIZE, thread_name_prefix="tavily")
+
+
+def get_http_session():
+    global _http
+    if _http is None:
+        with _http_lock:
+            if _http is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=TAVILY_POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update({"Content-Type": "application/json"})
+                _http = session
+    return _http
 
 # small helper for safe JSON parsing
 def _safe_load_json(text):
@@ -16,72 +55,140 @@ def _safe_load_json(text):
         return None
 
 
-def tavily_search(company_name: str, max_results: int = 5, retries: int = 2, backoff: float = 1.0):
+def tavily_search(company_name: str, max_results: int = 5, retries: int = 2, backoff: float = 1.0,
+                  deadline: float = None):
     """
-    Call Tavily search endpoint (POST JSON). Returns a list of {url, snippet}.
-    Retries on transient errors. Raises RuntimeError if API key missing.
+    Call Tavily search endpoint (POST JSON). Returns a list of {url, snippet, score}.
+    `company_name` is used verbatim as the query. Retries on transient errors, but never
+    sleeps past `deadline` (a time.monotonic() value). Raises RuntimeError if API key missing.
+    Identical concurrent queries are coalesced into a single request.
     """
     if not TAVILY_API_KEY:
         raise RuntimeError("TAVILY_API_KEY not set")
+    key = json.dumps([company_name.strip().lower(), max_results])
+    snippets = _tavily_flights.do(key, lambda: _tavily_search(company_name, max_results, retries, backoff, deadline))
+    # each caller gets its own list so one session can't mutate another's snippets
+    return [dict(s) for s in snippets]
 
-    url = "https://api.tavily.com/search"
-    headers = {"Content-Type": "application/json"}
 
+def _tavily_search(company_name: str, max_results: int, retries: int, backoff: float, deadline: float = None):
     payload = {
         "api_key": TAVILY_API_KEY,
         "query": company_name,
         "max_results": max_results
     }
+    http = get_http_session()
 
     for attempt in range(retries + 1):
+        timeout = 15
+        if deadline is not None:
+            timeout = max(1.0, min(timeout, deadline - time.monotonic()))
         try:
-            resp = requests.post(url, headers=headers, json=payload, timeout=15)
+            resp = http.post(TAVILY_URL, json=payload, timeout=timeout)
             resp.raise_for_status()
             data = resp.json()
-            # debug raw
-            print("RAW Tavily Response:", resp.text)
             results = data.get("results") or data.get("items") or []
             snippets = []
             for item in results[:max_results]:
                 url_val = item.get("url") or item.get("link") or item.get("page_url") or ""
                 snippet_val = item.get("content") or item.get("snippet") or item.get("summary") or item.get("text") or ""
                 if snippet_val:
-                    snippets.append({"url": url_val, "snippet": snippet_val})
+                    snippets.append({"url": url_val, "snippet": snippet_val, "score": item.get("score") or 0.0})
             return snippets
         except requests.HTTPError as e:
             status = getattr(e.response, "status_code", None)
-            if status and (status >= 500 or status == 429) and attempt < retries:
+            if status and (status >= 500 or status == 429) and attempt < retries and _can_sleep(backoff * (attempt + 1), deadline):
                 time.sleep(backoff * (attempt + 1))
                 continue
             raise
         except Exception as e:
-            if attempt < retries:
+            if attempt < retries and _can_sleep(backoff * (attempt + 1), deadline):
                 time.sleep(backoff * (attempt + 1))
                 continue
             raise
 
 
-from src.gemini_client import generate_text
+def _can_sleep(seconds: float, deadline: float = None):
+    return deadline is None or time.monotonic() + seconds < deadline
 
 
-def search_company(company_name: str, max_results: int = 5):
+def tavily_multi_search(company_name: str, max_results: int = 5, queries: list = None, deadline: float = TAVILY_DEADLINE):
     """
-    Phase 1 search. Try Tavily first (recommended). If Tavily fails or returns nothing,
-    fallback to a Gemini-generated conservative summary (JSON array of {url, snippet}).
+    Fan out several Tavily queries for one company concurrently over the pooled session.
+    Results are merged by URL and ranked by best Tavily score, with a bonus for URLs that
+    several queries agree on. Queries still running after `deadline` seconds are dropped.
+    Returns up to max_results * 2 {url, snippet} items (raises only if every query failed).
     """
-    # 1) Try Tavily
-    if TAVILY_API_KEY:
+    templates = queries or TAVILY_QUERIES
+    query_list = list(dict.fromkeys(t.format(company=company_name).strip() for t in templates))
+    until = time.monotonic() + deadline
+    futures = {_executor.submit(tavily_search, q, max_results, 2, 1.0, until): q for q in query_list}
+    done, not_done = wait(futures, timeout=deadline)
+    for f in not_done:
+        f.cancel()
+    if not_done:
+        print(f"[WARN] Tavily deadline hit; dropped {len(not_done)} of {len(futures)} queries for '{company_name}'")
+
+    merged = {}
+    errors = []
+    for f in done:
         try:
-            snippets = tavily_search(company_name, max_results=max_results)
-            if snippets:
-                print(f"[INFO] Tavily returned {len(snippets)} snippets for '{company_name}'")
-                return snippets
-            else:
-                print(f"[WARN] Tavily returned no snippets for '{company_name}'")
+            hits = f.result()
         except Exception as e:
-            print("[WARN] Tavily search failed:", e)
+            errors.append(e)
+            continue
+        for h in hits:
+            key = h["url"] or h["snippet"][:200]
+            cur = merged.get(key)
+            if cur is None:
+                merged[key] = {"url": h["url"], "snippet": h["snippet"], "score": float(h.get("score") or 0.0), "hits": 1}
+            else:
+                cur["hits"] += 1
+                cur["score"] = max(cur["score"], float(h.get("score") or 0.0))
+                if len(h["snippet"]) > len(cur["snippet"]):
+                    cur["snippet"] = h["snippet"]
+    if not merged and errors and len(errors) == len(done) and not not_done:
+        raise errors[0]
+
+    ranked = sorted(merged.values(), key=lambda r: r["score"] + 0.1 * (r["hits"] - 1), reverse=True)
+    return [{"url": r["url"], "snippet": r["snippet"]} for r in ranked[:max_results * 2]]
+
 
-    # 2) Fallback: use Gemini to synthesize conservative snippets
+from src.gemini_client import generate_text
+
+# Hedged search: if Tavily hasn't produced usable snippets after this many seconds, start the
+# Gemini fallback alongside it and keep whichever finishes first. Negative = serial (old behaviour).
+SEARCH_HEDGE_DELAY = float(os.getenv("SEARCH_HEDGE_DELAY", "5"))
+# dedicated pool so a race never waits behind the Tavily fan-out workers it is racing
+_race_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="search-race")
+search_stats = {"tavily": 0, "gemini": 0, "placeholder": 0, "hedged": 0,
+                "cache_fresh": 0, "cache_stale": 0, "cache_miss": 0}
+_search_stats_lock = threading.Lock()
+_refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="search-refresh")
+_refresh_flights = SingleFlight("search_refresh")
+
+
+def _record_source(source: str, hedged: bool = False):
+    with _search_stats_lock:
+        search_stats[source] += 1
+        if hedged:
+            search_stats["hedged"] += 1
+
+
+def _tavily_snippets(company_name: str, max_results: int):
+    try:
+        snippets = tavily_multi_search(company_name, max_results=max_results)
+        if snippets:
+            print(f"[INFO] Tavily returned {len(snippets)} snippets for '{company_name}'")
+            return snippets
+        print(f"[WARN] Tavily returned no snippets for '{company_name}'")
+    except Exception as e:
+        print("[WARN] Tavily search failed:", e)
+    return []
+
+
+def _gemini_snippets(company_name: str, max_results: int):
+    """Use Gemini to synthesize conservative snippets (JSON array of {url, snippet})."""
     prompt = (
         "You are a conservative researcher. Simulate 4 concise, fact-oriented web snippets "
         f"about the public capabilities of the company '{company_name}'. For any claim that is not certain, "
@@ -104,6 +211,114 @@ def search_company(company_name: str, max_results: int = 5):
                 return normalized
     except Exception as e:
         print("[WARN] Gemini fallback failed to produce snippets:", e)
+    return []
+
+
+def _race_search(company_name: str, max_results: int, hedge_delay: float):
+    """Run Tavily; start the Gemini fallback after hedge_delay if Tavily is still going.
+    Returns (snippets, source, hedged). A Tavily result is preferred when both are ready."""
+    tavily_f = _race_executor.submit(_tavily_snippets, company_name, max_results)
+    done, _ = wait([tavily_f], timeout=hedge_delay)
+    if done and tavily_f.result():
+        return tavily_f.result(), "tavily", False
+
+    gemini_f = _race_executor.submit(_gemini_snippets, company_name, max_results)
+    pending = {tavily_f: "tavily", gemini_f: "gemini"}
+    while pending:
+        done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+        for f in sorted(done, key=lambda f: pending[f] != "tavily"):
+            source = pending.pop(f)
+            snippets = f.result()
+            if snippets:
+                # the loser's HTTP call can't be interrupted mid-flight; cancel it if it hasn't
+                # started, otherwise its result is simply discarded (caches still benefit)
+                for loser in pending:
+                    loser.cancel()
+                return snippets, source, True
+    return [], None, True
+
+
+def _search_live(company_name: str, max_results: int = 5):
+    snippets, source, hedged = [], None, False
+    if TAVILY_API_KEY and SEARCH_HEDGE_DELAY >= 0:
+        snippets, source, hedged = _race_search(company_name, max_results, SEARCH_HEDGE_DELAY)
+    else:
+        # 1) Try Tavily
+        if TAVILY_API_KEY:
+            snippets = _tavily_snippets(company_name, max_results)
+            source = "tavily"
+        # 2) Fallback: use Gemini to synthesize conservative snippets
+        if not snippets:
+            snippets = _gemini_snippets(company_name, max_results)
+            source = "gemini"
+
+    if snippets:
+        _record_source(source, hedged)
+        print(f"[INFO] Search for '{company_name}' served by {source}{' (hedged)' if hedged else ''}")
+        return snippets, source
 
     # 3) Final fallback: single minimal snippet prompting the user to confirm competencies
-    return [{"url": "", "snippet": f"{company_name} - no web API available; please confirm core competencies."}]
\ No newline at end of file
+    _record_source("placeholder", hedged)
+    return [{"url": "", "snippet": f"{company_name} - no web API available; please confirm core competencies."}], "placeholder"
+
+
+def refresh_company_search(company_name: str, max_results: int = 5):
+    """Run a live search and store it in the search cache (placeholders are never cached).
+    Concurrent refreshes of the same company collapse into one."""
+    def _refresh():
+        snippets, source = _search_live(company_name, max_results)
+        if source != "placeholder":
+            search_cache.put_entry(company_name, snippets, source)
+        return snippets, source
+    return _refresh_flights.do(search_cache.normalize_company_name(company_name), _refresh)
+
+
+def schedule_refresh(company_name: str, max_results: int = 5):
+    """Refresh a company's cached search in the background (stale-while-revalidate, prewarm)."""
+    def _run():
+        try:
+            refresh_company_search(company_name, max_results)
+        except Exception as e:
+            print(f"[WARN] Background search refresh failed for '{company_name}':", e)
+    return _refresh_executor.submit(_run)
+
+
+def search_company_with_source(company_name: str, max_results: int = 5, use_cache: bool = True):
+    """
+    search_company that also reports which source produced the snippets:
+    "tavily", "gemini" or "placeholder". Fresh cache entries are returned directly;
+    stale ones are returned immediately while a background refresh updates the cache.
+    """
+    if use_cache:
+        entry = search_cache.get_entry(company_name)
+        if entry is not None:
+            with _search_stats_lock:
+                search_stats["cache_" + entry["state"]] += 1
+            if entry["state"] == "stale":
+                schedule_refresh(company_name, max_results)
+            print(f"[INFO] Search for '{company_name}' served from cache ({entry['state']}, {entry.get('source')})")
+            return [dict(s) for s in entry["snippets"]], entry.get("source") or "cache"
+        with _search_stats_lock:
+            search_stats["cache_miss"] += 1
+    snippets, source = refresh_company_search(company_name, max_results)
+    return [dict(s) for s in snippets], source
+
+
+async def asearch_company_with_source(company_name: str, max_results: int = 5, use_cache: bool = True):
+    """
+    Async entry point for the graph. Tavily fan-out and the Gemini hedge already run on the
+    pooled HTTP session and thread pools, so the whole search runs in a worker thread
+    rather than blocking the event loop.
+    """
+    return await asyncio.to_thread(search_company_with_source, company_name, max_results, use_cache)
+
+
+def search_company(company_name: str, max_results: int = 5):
+    """
+    Phase 1 search. Try Tavily first (recommended). If Tavily fails, returns nothing, or is
+    still running after SEARCH_HEDGE_DELAY seconds, a Gemini-generated conservative summary
+    (JSON array of {url, snippet}) races it and the first usable result wins.
+    Results are cached per normalized company name (see src/search_cache.py).
+    """
+    snippets, _ = search_company_with_source(company_name, max_results)
+    return snippets
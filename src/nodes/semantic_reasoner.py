@@ -1,15 +1,49 @@
 # src/nodes/semantic_reasoner.py
-from src.vectorstore import add_competency_doc, query_similar
+from src.vectorstore import (
+    add_idea_docs,
+    query_similar,
+    upsert_competency_docs,
+    delete_competency_docs,
+    indexed_competency_hashes,
+)
 from src.db.mongo import get_collection
+from src.utils.competency_diff import row_hash
 
-def index_competencies_for_session(session_id: str):
+def _competency_item(session_id: str, r: dict):
+    text = f"{r.get('competency')} - {r.get('description')}"
+    return {"id": r["_id"], "text": text,
+            "metadata": {"session_id": session_id, "category": r.get("category"), "content_hash": row_hash(r)}}
+
+def index_competencies_for_session(session_id: str, changes: dict = None):
+    """
+    Embed the session's competencies; returns how many rows were (re-)embedded.
+    With a change set from a CSV re-upload only its inserted/updated rows are embedded and its
+    deleted rows dropped. Without one, rows whose indexed content_hash already matches are skipped
+    and indexed rows that no longer exist are removed.
+    """
     col = get_collection("competencies")
-    rows = list(col.find({"session_id": session_id}))
-    for r in rows:
-        text = f"{r.get('competency')} - {r.get('description')}"
-        add_competency_doc(r["_id"], text, {"session_id": session_id, "category": r.get("category")})
+    if changes is not None:
+        ids = list(changes.get("inserted", [])) + list(changes.get("updated", []))
+        rows = list(col.find({"_id": {"$in": ids}})) if ids else []
+        delete_competency_docs(changes.get("deleted", []))
+    else:
+        rows = list(col.find({"session_id": session_id}))
+        indexed = indexed_competency_hashes(session_id)
+        delete_competency_docs(list(set(indexed) - {r["_id"] for r in rows}))
+        rows = [r for r in rows if indexed.get(r["_id"]) != row_hash(r)]
+    upsert_competency_docs([_competency_item(session_id, r) for r in rows])
     return len(rows)
 
+def index_ideas_for_session(session_id: str, ideas: list):
+    items = []
+    for idea in ideas:
+        if not idea.get("_id"):
+            continue
+        text = f"{idea.get('title')} - {idea.get('application_area') or ''}: {idea.get('strategic_rationale') or ''}"
+        items.append({"id": idea["_id"], "text": text,
+                      "metadata": {"session_id": session_id, "application_area": idea.get("application_area") or ""}})
+    return add_idea_docs(items)
+
 def retrieve_relevant_competencies(session_id: str, text: str, n=5):
     resp = query_similar(text, n=n)
     return resp
@@ -2,8 +2,11 @@
 from src.db.mongo import get_collection
 from src.utils.csv_utils import generate_evaluation_template_csv
 
-def generate_evaluation_template(session_id: str, artifacts_dir: str):
-    idea_col = get_collection("ideas")
-    ideas = list(idea_col.find({"session_id": session_id}, {"_id": 0}))
+def generate_evaluation_template(session_id: str, artifacts_dir: str, ideas: list = None):
+    # pass the ideas in when running alongside writers of the ideas collection (the graph's
+    # post-idea branches); otherwise they are read from Mongo
+    if ideas is None:
+        idea_col = get_collection("ideas")
+        ideas = list(idea_col.find({"session_id": session_id}, {"_id": 0}))
     path = generate_evaluation_template_csv(session_id, ideas, artifacts_dir)
     return path
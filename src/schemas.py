@@ -15,3 +15,72 @@ class AnswerRequest(BaseModel):
 class UploadFileResponse(BaseModel):
     status: str
     file: str
+
+
+# ---------------------------------------------------------
+# Gemini response schemas (structured output for generate_json)
+# ---------------------------------------------------------
+COMPETENCY_LIST_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "category": {"type": "STRING"},
+            "competency": {"type": "STRING"},
+            "description": {"type": "STRING"},
+            "technology_level": {"type": "STRING", "enum": ["Basic", "Intermediate", "Advanced", "Cutting-edge"]},
+            "source_url": {"type": "STRING"},
+        },
+        "required": ["category", "competency", "description", "technology_level"],
+    },
+}
+
+COMPETENCY_DELTA_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "add": COMPETENCY_LIST_SCHEMA,
+        "update": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "ref": {"type": "STRING"},
+                    "category": {"type": "STRING"},
+                    "competency": {"type": "STRING"},
+                    "description": {"type": "STRING"},
+                    "technology_level": {"type": "STRING", "enum": ["Basic", "Intermediate", "Advanced", "Cutting-edge"]},
+                    "source_url": {"type": "STRING"},
+                },
+                "required": ["ref"],
+            },
+        },
+        "remove": {"type": "ARRAY", "items": {"type": "STRING"}},
+    },
+    "required": ["add", "update", "remove"],
+}
+
+GAP_QUESTIONS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "questions": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "complete": {"type": "BOOLEAN"},
+    },
+    "required": ["questions", "complete"],
+}
+
+IDEA_LIST_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "title": {"type": "STRING"},
+            "components": {"type": "ARRAY", "items": {"type": "STRING"}},
+            "application_area": {"type": "STRING"},
+            "strategic_rationale": {"type": "STRING"},
+            "example_analogs": {"type": "ARRAY", "items": {"type": "STRING"}},
+        },
+        "required": ["title", "components", "application_area", "strategic_rationale"],
+    },
+}
+
+ANALOGY_LIST_SCHEMA = {"type": "ARRAY", "items": {"type": "STRING"}}
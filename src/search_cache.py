@@ -0,0 +1,123 @@
+# src/search_cache.py
+"""
+Persistent cache of company search results (snippets + source), keyed by normalized company name.
+- Fresh for SEARCH_CACHE_TTL seconds; until SEARCH_CACHE_STALE_TTL it is served stale while
+  the caller refreshes it in the background (stale-while-revalidate).
+- Stored in Mongo (collection `search_cache`) or as JSON files on local disk (SEARCH_CACHE_BACKEND).
+  Entries past SEARCH_CACHE_STALE_TTL are removed: by a TTL index on `expires_at` in Mongo, on
+  read for disk files.
+"""
+
+from typing import Any, Dict, Optional
+from datetime import datetime, timedelta
+import os
+import re
+import json
+import time
+import logging
+
+SEARCH_CACHE_ENABLED = os.getenv("SEARCH_CACHE_ENABLED", "1") not in ("0", "false", "False")
+SEARCH_CACHE_BACKEND = os.getenv("SEARCH_CACHE_BACKEND", "mongo").lower()   # mongo | disk
+SEARCH_CACHE_DIR = os.getenv("SEARCH_CACHE_DIR", "./search_cache")
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", str(7 * 24 * 3600)))
+SEARCH_CACHE_STALE_TTL = float(os.getenv("SEARCH_CACHE_STALE_TTL", str(30 * 24 * 3600)))
+
+_SUFFIXES = {"inc", "incorporated", "corp", "corporation", "co", "company", "ltd", "limited",
+             "llc", "plc", "gmbh", "ag", "sa", "nv", "bv", "holdings", "group"}
+
+
+def normalize_company_name(name: str) -> str:
+    """'Apple, Inc.' / 'apple inc' / ' APPLE ' -> 'apple'."""
+    words = re.sub(r"[^\w\s&-]", " ", (name or "").lower()).split()
+    while len(words) > 1 and words[-1] in _SUFFIXES:
+        words.pop()
+    return " ".join(words)
+
+
+_mongo_col = None
+
+
+def _collection():
+    global _mongo_col
+    if _mongo_col is None:
+        from src.db.mongo import get_collection
+        col = get_collection("search_cache")
+        try:
+            # Mongo drops entries once they are too old to be served even stale
+            col.create_index("expires_at", expireAfterSeconds=0)
+            # entries written before expires_at existed: derive it from fetched_at (epoch seconds)
+            col.update_many({"expires_at": {"$exists": False}}, [{"$set": {"expires_at": {"$add": [
+                datetime(1970, 1, 1), {"$multiply": [{"$add": ["$fetched_at", SEARCH_CACHE_STALE_TTL]}, 1000]}]}}}])
+        except Exception as e:
+            logging.warning("search_cache TTL index creation failed: %s", e)
+        _mongo_col = col
+    return _mongo_col
+
+
+def _disk_path(key: str) -> str:
+    safe = re.sub(r"[^\w-]", "_", key)[:120] or "_"
+    return os.path.join(SEARCH_CACHE_DIR, f"{safe}.json")
+
+
+def get_entry(company_name: str) -> Optional[Dict[str, Any]]:
+    """Return {"snippets", "source", "fetched_at", "state"} where state is fresh|stale, or None."""
+    if not SEARCH_CACHE_ENABLED:
+        return None
+    key = normalize_company_name(company_name)
+    try:
+        if SEARCH_CACHE_BACKEND == "disk":
+            path = _disk_path(key)
+            if not os.path.exists(path):
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        else:
+            entry = _collection().find_one({"_id": key})
+    except Exception as e:
+        logging.warning("search cache read failed for '%s': %s", key, e)
+        return None
+    if not entry or not entry.get("snippets"):
+        return None
+    age = time.time() - float(entry.get("fetched_at", 0))
+    if age >= SEARCH_CACHE_STALE_TTL:
+        if SEARCH_CACHE_BACKEND == "disk":
+            invalidate(company_name)
+        return None
+    entry["state"] = "fresh" if age < SEARCH_CACHE_TTL else "stale"
+    return entry
+
+
+def put_entry(company_name: str, snippets: list, source: str):
+    if not SEARCH_CACHE_ENABLED or not snippets:
+        return
+    key = normalize_company_name(company_name)
+    entry = {"_id": key, "company_name": company_name, "snippets": snippets,
+             "source": source, "fetched_at": time.time()}
+    try:
+        if SEARCH_CACHE_BACKEND == "disk":
+            os.makedirs(SEARCH_CACHE_DIR, exist_ok=True)
+            path = _disk_path(key)
+            with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(f"{path}.tmp", path)
+        else:
+            expires_at = datetime.utcnow() + timedelta(seconds=SEARCH_CACHE_STALE_TTL)
+            _collection().replace_one({"_id": key}, {**entry, "expires_at": expires_at}, upsert=True)
+    except Exception as e:
+        logging.warning("search cache write failed for '%s': %s", key, e)
+
+
+def invalidate(company_name: str) -> bool:
+    """Drop the cached entry; returns True if one existed."""
+    key = normalize_company_name(company_name)
+    try:
+        if SEARCH_CACHE_BACKEND == "disk":
+            path = _disk_path(key)
+            if os.path.exists(path):
+                os.remove(path)
+                return True
+            return False
+        return _collection().delete_one({"_id": key}).deleted_count > 0
+    except Exception as e:
+        logging.warning("search cache invalidate failed for '%s': %s", key, e)
+        return False
@@ -0,0 +1,121 @@
+# src/session_logs.py
+"""
+Per-session log capture for the log endpoints.
+- Requests and jobs bind their session id to a context variable (bind_session); every log
+  record emitted in that context is tagged with it.
+- Records go through a QueueHandler, so logging calls never block on formatting; a
+  QueueListener thread appends them to fixed-size ring buffers: one per session
+  (SESSION_LOG_LINES lines, at most SESSION_LOG_MAX_SESSIONS sessions, LRU) and one
+  process-wide buffer for the `workflow` logger.
+- Each line gets a per-buffer sequence number; readers ask for lines after the last one they
+  saw, so a poll costs the same however long the server has been running.
+"""
+
+from typing import Any, Dict, Optional
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from itertools import islice
+from logging.handlers import QueueHandler, QueueListener
+import os
+import queue
+import atexit
+import logging
+import threading
+
+SESSION_LOG_LINES = int(os.getenv("SESSION_LOG_LINES", "1000"))
+SESSION_LOG_MAX_SESSIONS = int(os.getenv("SESSION_LOG_MAX_SESSIONS", "500"))
+SESSION_LOG_LEVEL = os.getenv("SESSION_LOG_LEVEL", "INFO").upper()
+GLOBAL_BUFFER = "*"
+
+current_session: ContextVar[Optional[str]] = ContextVar("current_session", default=None)
+
+
+def bind_session(session_id: Optional[str]):
+    """Tag log records from the current request/task (and threads it starts via to_thread) with session_id."""
+    return current_session.set(session_id)
+
+
+class _SessionTagger(logging.Filter):
+    # runs in the emitting thread, where the context variable is visible
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.session_id = current_session.get()
+        return True
+
+
+class RingBufferHandler(logging.Handler):
+    def __init__(self, capacity: int = SESSION_LOG_LINES, max_sessions: int = SESSION_LOG_MAX_SESSIONS,
+                 global_logger: str = "workflow"):
+        super().__init__()
+        self.capacity = max(1, capacity)
+        self.max_sessions = max(1, max_sessions)
+        self.global_logger = global_logger
+        self._buffers: "OrderedDict[str, deque]" = OrderedDict()
+        self._next_seq: Dict[str, int] = {}
+        self._buf_lock = threading.Lock()
+
+    def _append(self, key: str, entry: Dict[str, Any]):
+        # call with self._buf_lock held
+        buf = self._buffers.get(key)
+        if buf is None:
+            buf = self._buffers[key] = deque(maxlen=self.capacity)
+            self._next_seq.setdefault(key, 1)
+            while len(self._buffers) > self.max_sessions + 1:   # +1 for the global buffer
+                evicted = next(k for k in self._buffers if k != GLOBAL_BUFFER)
+                self._buffers.pop(evicted)
+                self._next_seq.pop(evicted, None)
+        self._buffers.move_to_end(key)
+        seq = self._next_seq[key]
+        self._next_seq[key] = seq + 1
+        buf.append({**entry, "seq": seq})
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            entry = {"ts": record.created, "level": record.levelname, "logger": record.name,
+                     "message": self.format(record)}
+            session_id = getattr(record, "session_id", None)
+            with self._buf_lock:
+                if session_id:
+                    self._append(session_id, entry)
+                if record.name == self.global_logger or record.name.startswith(self.global_logger + "."):
+                    self._append(GLOBAL_BUFFER, entry)
+        except Exception:
+            self.handleError(record)
+
+    def read(self, key: str, after: int = 0, limit: int = 500) -> Dict[str, Any]:
+        """Lines with seq > after (at most `limit`), the seq to poll from next, and whether lines were missed."""
+        with self._buf_lock:
+            buf = self._buffers.get(key)
+            if not buf:
+                return {"lines": [], "next": after, "truncated": False}
+            first = buf[0]["seq"]
+            # seqs within a buffer are contiguous, so the start offset is computed; the walk is bounded by capacity
+            start = max(0, after + 1 - first)
+            lines = list(islice(buf, start, start + max(1, limit)))
+            last = buf[-1]["seq"]
+        return {
+            "lines": lines,
+            # with nothing new this is the newest seq, which also resyncs a client holding a seq from before a restart
+            "next": lines[-1]["seq"] if lines else last,
+            "truncated": after + 1 < first,
+        }
+
+
+_listener: Optional[QueueListener] = None
+ring_handler = RingBufferHandler()
+
+
+def install(level: str = SESSION_LOG_LEVEL) -> RingBufferHandler:
+    """Attach the queue handler to the root logger and start the listener (idempotent)."""
+    global _listener
+    if _listener is not None:
+        return ring_handler
+    log_queue: "queue.Queue" = queue.Queue(-1)
+    qh = QueueHandler(log_queue)
+    qh.setLevel(level)
+    qh.addFilter(_SessionTagger())
+    ring_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    _listener = QueueListener(log_queue, ring_handler, respect_handler_level=False)
+    _listener.start()
+    atexit.register(_listener.stop)
+    logging.getLogger().addHandler(qh)
+    return ring_handler
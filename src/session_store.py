@@ -0,0 +1,197 @@
+# src/session_store.py
+"""
+Session repository shared by every API worker.
+- Sessions live in Mongo (collection `sessions`, SESSION_STORE=mongo) or only in this process
+  (SESSION_STORE=memory, single-worker development; keeps at most SESSION_CACHE_SIZE sessions).
+- A bounded in-process LRU (SESSION_CACHE_SIZE) fronts Mongo; writes go to Mongo first and then
+  to the cache (write-through). Cached entries are re-read after SESSION_CACHE_FRESHNESS seconds
+  so other workers' writes become visible.
+- Every document carries a `version`; updates only apply if the version is unchanged
+  (optimistic concurrency). update() retries field-level sets on a fresh copy; callers that
+  need strict read-modify-write pass expected_version and get SessionConflict instead.
+- Sessions expire SESSION_TTL seconds after their last write (Mongo TTL index on expires_at).
+- Async callers use aget/acreate/aupdate, which keep Mongo I/O off the event loop.
+"""
+
+from typing import Any, Dict, Optional
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import os
+import copy
+import time
+import asyncio
+import logging
+import threading
+
+SESSION_STORE = os.getenv("SESSION_STORE", "mongo").lower()   # mongo | memory
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "256"))
+SESSION_CACHE_FRESHNESS = float(os.getenv("SESSION_CACHE_FRESHNESS", "5"))
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(7 * 24 * 3600)))
+_META_FIELDS = ("_id", "version", "expires_at", "updated_at")
+
+
+class SessionConflict(RuntimeError):
+    """Raised when a session changed since the version the caller read."""
+
+
+class SessionStore:
+    def __init__(self, backend: str = SESSION_STORE, cache_size: int = SESSION_CACHE_SIZE, ttl: float = SESSION_TTL):
+        self.backend = backend
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self._lru: "OrderedDict[str, tuple]" = OrderedDict()   # id -> (cached_at, doc)
+        self._lock = threading.RLock()
+        self._mongo_col = None
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "conflicts": 0}
+
+    # ---- cache ----
+    def _cache_get(self, session_id: str, allow_stale: bool = False):
+        with self._lock:
+            entry = self._lru.get(session_id)
+            if entry is None:
+                return None
+            cached_at, doc = entry
+            if doc["expires_at"] < datetime.utcnow():
+                del self._lru[session_id]
+                return None
+            if not allow_stale and self.backend == "mongo" and time.time() - cached_at > SESSION_CACHE_FRESHNESS:
+                return None
+            self._lru.move_to_end(session_id)
+            return doc
+
+    def _cache_put(self, doc: Dict[str, Any]):
+        with self._lock:
+            current = self._lru.get(doc["_id"])
+            if current is not None and current[1]["version"] > doc["version"]:
+                return
+            self._lru[doc["_id"]] = (time.time(), doc)
+            self._lru.move_to_end(doc["_id"])
+            while len(self._lru) > self.cache_size:
+                self._lru.popitem(last=False)
+
+    def _cache_drop(self, session_id: str):
+        with self._lock:
+            self._lru.pop(session_id, None)
+
+    # ---- mongo ----
+    def _collection(self):
+        if self._mongo_col is None:
+            from src.db.mongo import get_collection
+            col = get_collection("sessions")
+            try:
+                col.create_index("expires_at", expireAfterSeconds=0)
+            except Exception as e:
+                logging.warning("sessions TTL index creation failed: %s", e)
+            self._mongo_col = col
+        return self._mongo_col
+
+    def _load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        if self.backend != "mongo":
+            return self._cache_get(session_id, allow_stale=True)
+        doc = self._collection().find_one({"_id": session_id, "expires_at": {"$gt": datetime.utcnow()}})
+        if doc is None:
+            self._cache_drop(session_id)
+            return None
+        self._cache_put(doc)
+        return doc
+
+    # ---- public API ----
+    def _doc(self, session_id: str) -> Optional[Dict[str, Any]]:
+        doc = self._cache_get(session_id)
+        with self._lock:
+            self.stats["hits" if doc is not None else "misses"] += 1
+        return doc if doc is not None else self._load(session_id)
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """The session's fields plus its `version`, or None. The returned dict is a private copy."""
+        doc = self._doc(session_id)
+        if doc is None:
+            return None
+        return {k: copy.deepcopy(v) for k, v in doc.items() if k not in ("_id", "expires_at", "updated_at")}
+
+    def __contains__(self, session_id: str) -> bool:
+        return self._doc(session_id) is not None
+
+    def create(self, session_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        now = datetime.utcnow()
+        doc = {**data, "_id": session_id, "version": 1, "updated_at": now,
+               "expires_at": now + timedelta(seconds=self.ttl)}
+        if self.backend == "mongo":
+            self._collection().insert_one(doc)
+        self._cache_put(doc)
+        with self._lock:
+            self.stats["writes"] += 1
+        return self.get(session_id)
+
+    def update(self, session_id: str, changes: Dict[str, Any], expected_version: Optional[int] = None,
+               retries: int = 3) -> Dict[str, Any]:
+        """
+        Set the given fields and bump the version; returns the updated session.
+        Raises KeyError for an unknown/expired session and SessionConflict if expected_version
+        is stale (or, without it, if the session keeps changing underneath after `retries`).
+        """
+        changes = {k: v for k, v in changes.items() if k not in _META_FIELDS}
+        for _ in range(max(1, retries)):
+            current = self._doc(session_id) if expected_version is None else self._load(session_id)
+            if current is None:
+                raise KeyError(session_id)
+            version = current["version"] if expected_version is None else expected_version
+            if current["version"] != version:
+                with self._lock:
+                    self.stats["conflicts"] += 1
+                raise SessionConflict(f"session {session_id} is at version {current['version']}, not {version}")
+            now = datetime.utcnow()
+            meta = {"version": version + 1, "updated_at": now, "expires_at": now + timedelta(seconds=self.ttl)}
+            if self.backend == "mongo":
+                res = self._collection().update_one({"_id": session_id, "version": version}, {"$set": {**changes, **meta}})
+                if res.matched_count == 0:
+                    # someone else wrote first: re-read and, unless pinned to a version, try again
+                    with self._lock:
+                        self.stats["conflicts"] += 1
+                    self._cache_drop(session_id)
+                    if expected_version is not None:
+                        raise SessionConflict(f"session {session_id} changed since version {version}")
+                    continue
+                self._cache_put({**current, **copy.deepcopy(changes), **meta})
+            else:
+                with self._lock:
+                    if self._lru.get(session_id, (0, {}))[1].get("version") != version:
+                        self.stats["conflicts"] += 1
+                        if expected_version is not None:
+                            raise SessionConflict(f"session {session_id} changed since version {version}")
+                        continue
+                    self._cache_put({**current, **copy.deepcopy(changes), **meta})
+            with self._lock:
+                self.stats["writes"] += 1
+            return self.get(session_id)
+        raise SessionConflict(f"session {session_id} kept changing; gave up after {retries} attempts")
+
+    def delete(self, session_id: str) -> bool:
+        self._cache_drop(session_id)
+        if self.backend == "mongo":
+            return self._collection().delete_one({"_id": session_id}).deleted_count > 0
+        return True
+
+    # ---- async API: Mongo round-trips run in a worker thread, never on the event loop ----
+    async def aget(self, session_id: str) -> Optional[Dict[str, Any]]:
+        if self.backend != "mongo" or self._cache_get(session_id) is not None:
+            return self.get(session_id)   # served from memory, no I/O
+        return await asyncio.to_thread(self.get, session_id)
+
+    async def acreate(self, session_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        if self.backend != "mongo":
+            return self.create(session_id, data)
+        return await asyncio.to_thread(self.create, session_id, data)
+
+    async def aupdate(self, session_id: str, changes: Dict[str, Any], expected_version: Optional[int] = None,
+                      retries: int = 3) -> Dict[str, Any]:
+        if self.backend != "mongo":
+            return self.update(session_id, changes, expected_version, retries)
+        return await asyncio.to_thread(self.update, session_id, changes, expected_version, retries)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats, "cached": len(self._lru), "backend": self.backend}
+
+
+sessions = SessionStore()
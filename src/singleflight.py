@@ -0,0 +1,121 @@
+# src/singleflight.py
+"""
+Single-flight request coalescing.
+Concurrent calls with the same key share one upstream call: the first caller (the leader)
+runs it, everyone else waits and receives the same result or exception.
+Only ordinary exceptions are shared: if the leader is cancelled (CancelledError, KeyboardInterrupt)
+the key is released and the waiters retry, one of them becoming the new leader.
+Sync (threads) and async (asyncio tasks, any loop) callers can wait on the same flight.
+"""
+
+from typing import Any, Awaitable, Callable, Dict
+import asyncio
+import threading
+
+
+class _Flight:
+    __slots__ = ("event", "result", "error", "abandoned", "waiters", "async_waiters")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.abandoned = False   # leader was cancelled; waiters must retry
+        self.waiters = 0
+        self.async_waiters = []   # (loop, future) pairs
+
+
+class SingleFlight:
+    def __init__(self, name: str = ""):
+        self.name = name
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+        self.stats = {"leaders": 0, "coalesced": 0, "abandoned": 0}
+
+    def _join(self, key: str):
+        """Return (flight, is_leader)."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.waiters += 1
+                self.stats["coalesced"] += 1
+                return flight, False
+            flight = _Flight()
+            self._flights[key] = flight
+            self.stats["leaders"] += 1
+            return flight, True
+
+    def _finish(self, key: str, flight: _Flight, result=None, error=None, abandoned=False):
+        with self._lock:
+            self._flights.pop(key, None)
+            flight.result = result
+            flight.error = error
+            flight.abandoned = abandoned
+            if abandoned:
+                self.stats["abandoned"] += 1
+            flight.event.set()
+            async_waiters, flight.async_waiters = flight.async_waiters, []
+        for loop, fut in async_waiters:
+            loop.call_soon_threadsafe(_wake, fut)
+
+    @staticmethod
+    def _outcome(flight: _Flight):
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        while True:
+            flight, leader = self._join(key)
+            if leader:
+                break
+            flight.event.wait()
+            if not flight.abandoned:
+                return self._outcome(flight)
+        try:
+            result = fn()
+        except Exception as e:
+            self._finish(key, flight, error=e)
+            raise
+        except BaseException:
+            self._finish(key, flight, abandoned=True)
+            raise
+        self._finish(key, flight, result=result)
+        return result
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        while True:
+            flight, leader = self._join(key)
+            if leader:
+                break
+            loop = asyncio.get_running_loop()
+            fut = loop.create_future()
+            with self._lock:
+                done = flight.event.is_set()
+                if not done:
+                    flight.async_waiters.append((loop, fut))
+            if not done:
+                await fut
+            if not flight.abandoned:
+                return self._outcome(flight)
+        try:
+            result = await fn()
+        except Exception as e:
+            self._finish(key, flight, error=e)
+            raise
+        except BaseException:
+            # a cancelled leader must not cancel everyone else sharing the key
+            self._finish(key, flight, abandoned=True)
+            raise
+        self._finish(key, flight, result=result)
+        return result
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
+
+
+def _wake(fut):
+    # waiters read the outcome from the flight; the future is only a wake-up signal
+    if not fut.done():
+        fut.set_result(None)
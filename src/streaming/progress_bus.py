@@ -0,0 +1,144 @@
+# src/streaming/progress_bus.py
+"""
+Per-session progress events for the SSE stream.
+- Graph runs publish node start/finish/error events; each session keeps the last PROGRESS_BUFFER
+  events with increasing integer ids, so a reconnecting client can resume after Last-Event-ID.
+- Publishing is thread-safe; async readers wait for new events without polling.
+- Sessions are kept in an LRU capped at PROGRESS_MAX_SESSIONS.
+- Streamed model tokens go through TokenBuffer, which coalesces them into one `token` event per
+  TOKEN_FLUSH_SECONDS so a fast stream doesn't push everything else out of the replay buffer.
+- The bus is per process: with several API workers, route /sessions/{id}/stream to the worker
+  running that session's jobs (sticky routing on the session id). A stream served elsewhere still
+  sees job status through the shared job store and ends with it, but carries no progress events.
+"""
+
+from typing import Any, Dict, List, Optional
+from collections import OrderedDict, deque
+import os
+import time
+import asyncio
+import threading
+
+PROGRESS_BUFFER = int(os.getenv("PROGRESS_BUFFER", "200"))
+PROGRESS_MAX_SESSIONS = int(os.getenv("PROGRESS_MAX_SESSIONS", "1000"))
+TOKEN_FLUSH_SECONDS = float(os.getenv("TOKEN_FLUSH_SECONDS", "0.25"))
+
+
+class _Channel:
+    __slots__ = ("events", "next_id", "active_runs", "waiters")
+
+    def __init__(self):
+        self.events = deque(maxlen=PROGRESS_BUFFER)
+        self.next_id = 1
+        self.active_runs = 0
+        self.waiters = []   # (loop, future) pairs
+
+
+class ProgressBus:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._channels: "OrderedDict[str, _Channel]" = OrderedDict()
+
+    def _channel(self, session_id: str) -> _Channel:
+        # call with self._lock held
+        ch = self._channels.get(session_id)
+        if ch is None:
+            ch = self._channels[session_id] = _Channel()
+            while len(self._channels) > PROGRESS_MAX_SESSIONS:
+                self._channels.popitem(last=False)
+        self._channels.move_to_end(session_id)
+        return ch
+
+    def publish(self, session_id: str, event: str, data: Optional[Dict[str, Any]] = None) -> int:
+        with self._lock:
+            ch = self._channel(session_id)
+            ev = {"id": ch.next_id, "event": event, "data": {**(data or {}), "ts": time.time()}}
+            ch.next_id += 1
+            ch.events.append(ev)
+            waiters, ch.waiters = ch.waiters, []
+        for loop, fut in waiters:
+            loop.call_soon_threadsafe(_wake, fut)
+        return ev["id"]
+
+    def begin_run(self, session_id: str, run: str):
+        with self._lock:
+            self._channel(session_id).active_runs += 1
+        self.publish(session_id, "run_start", {"run": run})
+
+    def end_run(self, session_id: str, run: str, status: str, **extra):
+        with self._lock:
+            ch = self._channel(session_id)
+            ch.active_runs = max(0, ch.active_runs - 1)
+        self.publish(session_id, "run_end", {"run": run, "status": status, **extra})
+
+    def active(self, session_id: str) -> bool:
+        with self._lock:
+            ch = self._channels.get(session_id)
+            return bool(ch and ch.active_runs)
+
+    def history(self, session_id: str, after_id: int = 0) -> List[Dict[str, Any]]:
+        with self._lock:
+            ch = self._channels.get(session_id)
+            return [e for e in ch.events if e["id"] > after_id] if ch else []
+
+    async def wait(self, session_id: str, after_id: int, timeout: float) -> List[Dict[str, Any]]:
+        """Events newer than after_id; waits up to timeout seconds for one to arrive."""
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        with self._lock:
+            ch = self._channel(session_id)
+            pending = [e for e in ch.events if e["id"] > after_id]
+            if not pending:
+                ch.waiters.append((loop, fut))
+        if pending:
+            return pending
+        try:
+            await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                ch.waiters = [w for w in ch.waiters if w[1] is not fut]
+            return []
+        return self.history(session_id, after_id)
+
+
+class TokenBuffer:
+    """Callable token sink for one stream: tokens(text) buffers, flush() publishes what's left."""
+
+    def __init__(self, bus: "ProgressBus", session_id: str, interval: float = TOKEN_FLUSH_SECONDS, **fields):
+        self.bus = bus
+        self.session_id = session_id
+        self.interval = interval
+        self.fields = fields   # extra data on every token event, e.g. stage="ideas"
+        self._parts: List[str] = []
+        self._flushed_at = time.monotonic()
+
+    def __call__(self, text: str):
+        self._parts.append(text)
+        if time.monotonic() - self._flushed_at >= self.interval:
+            self.flush()
+
+    def flush(self):
+        self._flushed_at = time.monotonic()
+        if self._parts:
+            self.bus.publish(self.session_id, "token", {**self.fields, "text": "".join(self._parts)})
+            self._parts = []
+
+
+def _wake(fut):
+    if not fut.done():
+        fut.set_result(None)
+
+
+def summarize_value(value, max_items: int = 5):
+    """Compact preview of a state value for progress events (counts for lists, short strings)."""
+    if isinstance(value, list):
+        preview = [v for v in value[:max_items] if isinstance(v, str)]
+        return {"count": len(value), **({"preview": preview} if preview else {})}
+    if isinstance(value, str):
+        return value if len(value) <= 200 else value[:200] + "…"
+    if isinstance(value, dict):
+        return {k: v for k, v in value.items() if isinstance(v, (int, float, str, bool))}
+    return value
+
+
+progress_bus = ProgressBus()
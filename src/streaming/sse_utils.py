@@ -2,12 +2,15 @@
 import requests
 from typing import Iterator
 
-def sse_client(url: str, timeout: int = None) -> Iterator[str]:
+def sse_client(url: str, timeout: int = None, last_event_id=None) -> Iterator[str]:
     """
     Minimal SSE client generator using requests.
-    Yields decoded lines. Stops when the special token [[STREAM_END]] appears.
+    Yields decoded lines (comment lines such as heartbeats are skipped).
+    Stops when the special token [[STREAM_END]] appears.
+    Pass last_event_id to resume a stream after the last event id seen.
     """
-    with requests.get(url, stream=True, timeout=timeout) as resp:
+    headers = {"Last-Event-ID": str(last_event_id)} if last_event_id is not None else None
+    with requests.get(url, stream=True, timeout=timeout, headers=headers) as resp:
         resp.raise_for_status()
         for raw in resp.iter_lines():
             if not raw:
@@ -16,6 +19,26 @@ def sse_client(url: str, timeout: int = None) -> Iterator[str]:
                 line = raw.decode("utf-8")
             except Exception:
                 line = raw.decode(errors="replace")
+            if line.startswith(":"):
+                continue
             yield line
             if "[[STREAM_END]]" in line:
                 break
+
+
+def format_sse(data, event: str = None, event_id=None) -> str:
+    """
+    Encode one server-sent event. Non-string data is JSON-encoded so chunks containing
+    newlines stay on a single `data:` line.
+    """
+    import json
+    if not isinstance(data, str):
+        data = json.dumps(data, ensure_ascii=False)
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    for part in data.split("\n"):
+        lines.append(f"data: {part}")
+    return "\n".join(lines) + "\n\n"
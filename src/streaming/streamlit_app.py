@@ -23,6 +23,7 @@ import streamlit as st
 import requests
 import json
 import io
+import time
 from typing import List, Dict
 
 from src.streaming.sse_utils import sse_client 
@@ -47,6 +48,26 @@ def api_get(path: str, stream=False):
     url = f"{FASTAPI_URL}{path}"
     return requests.get(url, stream=stream, timeout=600)
 
+def run_job(path: str, json_payload=None, poll_interval: float = 1.0):
+    """
+    Start a long stage as a background job (?background=true) and poll it, showing progress.
+    Returns the /jobs/{id}/result response, whose body on success is the stage's usual response.
+    """
+    r = api_post(f"{path}?background=true", json_payload=json_payload, timeout=30)
+    if r.status_code != 202:
+        return r
+    job_id = r.json()["job_id"]
+    status_box = st.empty()
+    while True:
+        job = api_get(f"/jobs/{job_id}").json()
+        progress = job.get("progress") or {}
+        status_box.info(f"Job {job['status']}: {progress.get('message') or progress.get('stage') or '…'}")
+        if job["status"] in ("succeeded", "failed", "cancelled"):
+            break
+        time.sleep(poll_interval)
+    status_box.empty()
+    return api_get(f"/jobs/{job_id}/result")
+
 def download_file_bytes(url: str) -> bytes:
     resp = requests.get(url, stream=True)
     resp.raise_for_status()
@@ -96,44 +117,55 @@ if page == "Workflow (start & stream)":
     start = st.button("Start Session and Stream")
 
     if start and company:
-        # start session
+        # start session as a background job, follow its live progress, then collect the result
         with st.spinner("Requesting session and starting stream..."):
             try:
-                r = api_post("/sessions", json_payload={"company_name": company})
+                r = api_post("/sessions?background=true", json_payload={"company_name": company}, timeout=30)
             except Exception as e:
                 st.error(f"Start session failed: {e}")
                 r = None
 
-            if r is None or r.status_code != 200:
+            if r is None or r.status_code != 202:
                 st.error(f"Start session failed: {getattr(r,'status_code', '')} {getattr(r,'text', '')}")
             else:
-                data = r.json()
-                sid = data["session_id"]
+                job = r.json()
+                sid = job["session_id"]
                 st.session_state.session_id = sid
-                # store returned fields if any
-                st.session_state.extracted_competencies = data.get("discovered_competencies", [])
-                st.session_state.gap_questions = data.get("gap_questions", [])
-                # reset gap round for fresh clarifications
-                st.session_state.gap_round = 0
-
                 st.success(f"Session created: {sid}")
 
-                # SSE stream
+                # SSE stream of node progress; resumes from the last event id if the connection drops
                 stream_box = st.empty()
                 log_lines = []
+                last_id = None
                 stream_url = f"{FASTAPI_URL}/sessions/{sid}/stream"
-                try:
-                    for raw in sse_client(stream_url, timeout=600):
-                        if raw.startswith("data: "):
-                            msg = raw.replace("data: ", "")
-                        else:
-                            msg = raw
-                        log_lines.append(msg)
-                        stream_box.text("\n".join(log_lines[-200:]))
-                        if "[[STREAM_END]]" in raw:
-                            break
-                except Exception as e:
-                    st.error(f"Stream error: {e}")
+                for attempt in range(3):
+                    try:
+                        for raw in sse_client(stream_url, timeout=600, last_event_id=last_id):
+                            if raw.startswith("id: "):
+                                last_id = raw[4:]
+                                continue
+                            msg = raw.replace("data: ", "") if raw.startswith("data: ") else raw
+                            log_lines.append(msg)
+                            stream_box.text("\n".join(log_lines[-200:]))
+                            if "[[STREAM_END]]" in raw:
+                                break
+                        break
+                    except Exception as e:
+                        st.warning(f"Stream interrupted ({e}); reconnecting…")
+
+                res = api_get(f"/jobs/{job['job_id']}/result")
+                while res.status_code == 202:
+                    time.sleep(1)
+                    res = api_get(f"/jobs/{job['job_id']}/result")
+                if res.status_code != 200:
+                    st.error(f"Session run failed: {res.status_code} {res.text}")
+                else:
+                    data = res.json()
+                    # store returned fields if any
+                    st.session_state.extracted_competencies = data.get("discovered_competencies", [])
+                    st.session_state.gap_questions = data.get("gap_questions", [])
+                    # reset gap round for fresh clarifications
+                    st.session_state.gap_round = 0
 
                 st.write("### Extracted competencies (preview)")
                 st.dataframe(st.session_state.extracted_competencies[:20])
@@ -260,7 +292,7 @@ elif page == "Ideas & Templates":
     st.subheader("Generate idea map from competencies")
     if st.button("Generate ideas"):
         try:
-            r = api_post(f"/sessions/{sid}/generate_ideas")
+            r = run_job(f"/sessions/{sid}/generate_ideas")
         except Exception as e:
             st.error(f"Generate ideas failed: {e}")
             r = None
@@ -369,15 +401,47 @@ elif page == "Action Plans":
         st.session_state.session_id = sid
 
     if st.button("Generate action plans"):
-        try:
-            r = api_post(f"/sessions/{sid}/generate_action_plans")
-        except Exception as e:
-            st.error(f"Generate action plans failed: {e}")
-            r = None
-
-        if r is None or r.status_code != 200:
-            st.error(f"Generate action plans failed: {getattr(r,'status_code','')} {getattr(r,'text','')}")
+        # start the background job, then follow its tokens (SSE) as Gemini writes each plan;
+        # the stream only subscribes, so reconnecting resumes instead of regenerating
+        plan_box = st.empty()
+        plan_md = ""
+        ok = False
+        event = None
+        last_id = None
+        r = api_post(f"/sessions/{sid}/generate_action_plans?background=true", timeout=30)
+        if r.status_code != 202:
+            st.error(f"Generate action plans failed: {r.status_code} {r.text}")
         else:
+            for attempt in range(3):
+                try:
+                    for raw in sse_client(f"{FASTAPI_URL}/sessions/{sid}/stream?stage=action_plans", timeout=600,
+                                          last_event_id=last_id):
+                        if raw.startswith("id: "):
+                            last_id = raw[4:]
+                            continue
+                        if raw.startswith("event: "):
+                            event = raw[len("event: "):]
+                            continue
+                        if not raw.startswith("data: ") or "[[STREAM_END]]" in raw:
+                            continue
+                        try:
+                            payload = json.loads(raw[len("data: "):])
+                        except Exception:
+                            payload = raw[len("data: "):]
+                        if event == "idea":
+                            plan_md += f"\n\n## {payload.get('title', '')}\n\n"
+                        elif event == "token":
+                            plan_md += payload.get("text", "")
+                        elif event == "done":
+                            ok = True
+                        elif event == "error":
+                            st.warning(f"Stream error: {payload}")
+                        plan_box.markdown(plan_md)
+                    break
+                except Exception as e:
+                    st.warning(f"Stream interrupted ({e}); reconnecting…")
+
+        if ok:
             dl = api_get(f"/sessions/{sid}/download_action_plans")
             if dl.status_code == 200:
                 st.session_state.action_plan_file = dl.content
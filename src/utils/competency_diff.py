@@ -0,0 +1,61 @@
+# src/utils/competency_diff.py
+"""
+Row-level diff of an uploaded competency CSV against the competencies already stored.
+- A row's identity is its content key: content_id(session_id, category, competency), the same
+  _id extraction gives it, so re-uploading an exported CSV matches the stored documents.
+- A row counts as updated when any stored field differs (exact comparison, via a hash).
+- Stored rows whose key is missing from the upload are deleted.
+"""
+
+from typing import Dict, Iterable
+import json
+import hashlib
+
+from src.db.mongo import content_id
+
+ROW_FIELDS = ("category", "competency", "description", "technology_level", "source_url")
+
+
+def row_key(session_id: str, doc: dict) -> str:
+    return content_id(session_id, doc.get("category"), doc.get("competency"))
+
+
+def row_hash(doc: dict) -> str:
+    payload = json.dumps([str(doc.get(f) or "") for f in ROW_FIELDS], ensure_ascii=False)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=12).hexdigest()
+
+
+class CompetencyDiff:
+    def __init__(self, session_id: str, existing: Dict[str, str]):
+        """existing maps stored _id -> row_hash."""
+        self.session_id = session_id
+        self.existing = existing
+        self.seen = set()
+        self.upserts = []   # full docs for inserted and updated rows
+        self.inserted, self.updated = [], []
+        self.unchanged = 0
+        self.duplicates = 0
+
+    def add(self, records: Iterable[dict]):
+        for rec in records:
+            key = row_key(self.session_id, rec)
+            if key in self.seen:
+                # the same competency twice in one file: the first row wins
+                self.duplicates += 1
+                continue
+            self.seen.add(key)
+            stored = self.existing.get(key)
+            if stored == row_hash(rec):
+                self.unchanged += 1
+                continue
+            self.upserts.append({**rec, "_id": key, "session_id": self.session_id})
+            (self.inserted if stored is None else self.updated).append(key)
+
+    def change_set(self) -> dict:
+        return {
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "deleted": [k for k in self.existing if k not in self.seen],
+            "unchanged": self.unchanged,
+            "duplicates": self.duplicates,
+        }
@@ -1,8 +1,17 @@
 # src/utils/csv_utils.py
 import pandas as pd
 import os
+import csv
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except Exception:
+    pa = pa_csv = None
 
 REQUIRED_COLS = ["Category", "Competency", "Description", "Technology Level"]
+ALLOWED_TECH_LEVELS = ["Basic", "Intermediate", "Advanced", "Cutting-edge"]
+CSV_CHUNK_ROWS = int(os.getenv("CSV_CHUNK_ROWS", "5000"))
 
 def validate_csv_file(filepath: str):
     try:
@@ -15,12 +24,70 @@ def validate_csv_file(filepath: str):
     if df[REQUIRED_COLS].isnull().any().any():
         return False, "Some required fields are empty"
     # Technology Level check
-    allowed = {"Basic", "Intermediate", "Advanced", "Cutting-edge"}
+    allowed = set(ALLOWED_TECH_LEVELS)
     bad_levels = set(df["Technology Level"].unique()) - allowed
     if bad_levels:
         return False, f"Invalid technology levels found: {bad_levels}"
     return True, "CSV validated"
 
+class CSVValidationError(ValueError):
+    """A competency CSV failed validation; the message says which check and where."""
+
+
+def iter_csv_chunks(filepath: str, chunk_rows: int = CSV_CHUNK_ROWS):
+    """
+    Read a CSV once, as DataFrames of roughly chunk_rows rows. Uses pyarrow's streaming reader
+    when pyarrow is installed (pandas' pyarrow engine can't read in chunks), else pandas chunks.
+    The header is checked against REQUIRED_COLS up front, so a header-only file (which yields no
+    chunks) can't skip the per-chunk checks; raises CSVValidationError.
+    """
+    with open(filepath, newline="", encoding="utf-8-sig") as f:
+        header = next(csv.reader(f), [])
+    missing = [c for c in REQUIRED_COLS if c not in header]
+    if missing:
+        raise CSVValidationError(f"Missing required column: {missing[0]}")
+    if pa_csv is not None:
+        # every column as string, like the pandas path: no per-block type inference (a later block
+        # could contradict it) and identical values for the content hashes either way
+        convert = pa_csv.ConvertOptions(column_types={c: pa.string() for c in header}, strings_can_be_null=True)
+        # ~200 bytes per competency row; the block size sets how many rows each batch holds
+        reader = pa_csv.open_csv(filepath, read_options=pa_csv.ReadOptions(block_size=max(1 << 16, chunk_rows * 200)),
+                                 convert_options=convert)
+        for batch in reader:
+            yield batch.to_pandas()
+        return
+    yield from pd.read_csv(filepath, chunksize=chunk_rows, dtype=str)
+
+
+def check_competency_chunk(df: pd.DataFrame, first_row: int = 0):
+    """Vectorized REQUIRED_COLS / empty-field / Technology Level checks for one chunk; raises CSVValidationError."""
+    missing = [c for c in REQUIRED_COLS if c not in df.columns]
+    if missing:
+        raise CSVValidationError(f"Missing required column: {missing[0]}")
+    required = df[REQUIRED_COLS]
+    empty = required.isna() | required.astype(str).apply(lambda col: col.str.strip() == "")
+    if empty.to_numpy().any():
+        row = int(empty.any(axis=1).to_numpy().argmax())
+        raise CSVValidationError(f"Some required fields are empty (first at data row {first_row + row + 1})")
+    bad = ~df["Technology Level"].isin(ALLOWED_TECH_LEVELS)
+    if bad.any():
+        raise CSVValidationError(f"Invalid technology levels found: {set(df.loc[bad, 'Technology Level'].unique())}")
+
+
+def competency_records(df: pd.DataFrame, session_id: str):
+    """Column-wise conversion of a validated chunk into competency documents (without _id)."""
+    source = df["Source URL"].fillna("").astype(str) if "Source URL" in df.columns else pd.Series("", index=df.index)
+    out = pd.DataFrame({
+        "session_id": session_id,
+        "category": df["Category"].astype(str),
+        "competency": df["Competency"].astype(str),
+        "description": df["Description"].astype(str),
+        "technology_level": df["Technology Level"].astype(str),
+        "source_url": source,
+    })
+    return out.to_dict("records")
+
+
 def generate_competency_csv(session_id: str, competencies: list, artifacts_dir: str):
     rows = []
     for c in competencies:
@@ -0,0 +1,96 @@
+# src/utils/snippet_dedup.py
+"""
+Near-duplicate snippet elimination before competency extraction.
+Word 3-gram shingles -> MinHash signatures; a snippet whose estimated Jaccard similarity with an
+already-kept snippet reaches the threshold is dropped. Kept snippets are then cut to a per-session
+character budget. Input order is preserved, so higher-ranked search results win.
+"""
+
+import os
+import re
+import zlib
+
+SNIPPET_DEDUP_THRESHOLD = float(os.getenv("SNIPPET_DEDUP_THRESHOLD", "0.6"))
+SNIPPET_CHAR_BUDGET = int(os.getenv("SNIPPET_CHAR_BUDGET", "16000"))
+_NUM_PERM = 64
+_SHINGLE = 3
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+# fixed (a, b) pairs so signatures are stable across processes
+_PERMS = [((i * 0x9E3779B1 + 0x7F4A7C15) % _PRIME | 1, (i * 0x85EBCA77 + 0xC2B2AE3D) % _PRIME) for i in range(1, _NUM_PERM + 1)]
+_word_re = re.compile(r"\w+")
+
+
+def estimate_tokens(chars: int) -> int:
+    # ~4 characters per token for English prose
+    return (chars + 3) // 4
+
+
+def _shingles(text: str):
+    words = _word_re.findall(text.lower())
+    if len(words) < _SHINGLE:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + _SHINGLE]) for i in range(len(words) - _SHINGLE + 1)}
+
+
+def minhash_signature(text: str):
+    hashes = [zlib.crc32(s.encode("utf-8")) for s in _shingles(text)]
+    if not hashes:
+        return None
+    return [min((a * h + b) % _PRIME for h in hashes) & _MAX_HASH for a, b in _PERMS]
+
+
+def estimate_similarity(sig_a, sig_b) -> float:
+    if sig_a is None or sig_b is None:
+        return 0.0
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / _NUM_PERM
+
+
+def dedupe_snippets(snippets: list, threshold: float = None, char_budget: int = None):
+    """
+    Return (kept_snippets, report). report counts duplicates removed, snippets dropped by the
+    budget, characters before/after and the estimated input tokens saved.
+    """
+    threshold = SNIPPET_DEDUP_THRESHOLD if threshold is None else threshold
+    char_budget = SNIPPET_CHAR_BUDGET if char_budget is None else char_budget
+
+    chars_before = sum(len(s.get("snippet", "") or "") for s in snippets)
+    unique, sigs, duplicates = [], [], 0
+    for s in snippets:
+        text = (s.get("snippet") or "").strip()
+        if not text:
+            duplicates += 1
+            continue
+        sig = minhash_signature(text)
+        if any(estimate_similarity(sig, kept) >= threshold for kept in sigs):
+            duplicates += 1
+            continue
+        unique.append(s)
+        sigs.append(sig)
+
+    kept, used, budget_dropped = [], 0, 0
+    for s in unique:
+        text = s.get("snippet", "")
+        remaining = char_budget - used
+        if remaining <= 0:
+            budget_dropped += 1
+            continue
+        if len(text) > remaining:
+            # truncate the snippet that crosses the budget unless only a sliver would fit
+            if remaining < 200:
+                budget_dropped += 1
+                continue
+            s = {**s, "snippet": text[:remaining - 2].rsplit(" ", 1)[0] + " …"}
+        kept.append(s)
+        used += len(s["snippet"])
+
+    report = {
+        "input_snippets": len(snippets),
+        "kept_snippets": len(kept),
+        "duplicates_removed": duplicates,
+        "budget_dropped": budget_dropped,
+        "chars_before": chars_before,
+        "chars_after": used,
+        "tokens_saved_est": estimate_tokens(max(0, chars_before - used)),
+    }
+    return kept, report
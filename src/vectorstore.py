@@ -27,8 +27,12 @@ _collection_name = os.getenv("CHROMA_COLLECTION", "competencies")
 _client = None
 _collection = None
 
+_ideas_collection_name = os.getenv("CHROMA_IDEAS_COLLECTION", "ideas")
+_ideas_collection = None
+
 # In-memory fallback store
 _memory_store: Dict[str, Dict[str, Any]] = {}
+_memory_ideas: Dict[str, Dict[str, Any]] = {}
 
 
 def _init_chroma_client():
@@ -73,6 +77,74 @@ def add_competency_doc(doc_id: str, text: str, metadata: Optional[dict] = None):
     return True
 
 
+def upsert_competency_docs(items: List[Dict[str, Any]]):
+    """Batch upsert of competencies ({id, text, metadata}); re-embeds in place when a row changed."""
+    if not items:
+        return 0
+    if _init_chroma_client():
+        try:
+            _collection.upsert(
+                ids=[i["id"] for i in items],
+                documents=[i["text"] for i in items],
+                metadatas=[i.get("metadata") or {} for i in items],
+            )
+            return len(items)
+        except Exception as e:
+            logging.warning("Chroma competency upsert failed, falling back to memory store: %s", e)
+    for i in items:
+        _memory_store[i["id"]] = {"text": i["text"], "metadata": i.get("metadata") or {}}
+    return len(items)
+
+
+def delete_competency_docs(ids: List[str]):
+    if not ids:
+        return 0
+    if _init_chroma_client():
+        try:
+            _collection.delete(ids=list(ids))
+        except Exception as e:
+            logging.warning("Chroma competency delete failed: %s", e)
+    for doc_id in ids:
+        _memory_store.pop(doc_id, None)
+    return len(ids)
+
+
+def indexed_competency_hashes(session_id: str) -> Dict[str, str]:
+    """id -> content_hash of the competencies already indexed for a session ("" if indexed without one)."""
+    if _init_chroma_client():
+        try:
+            resp = _collection.get(where={"session_id": session_id}, include=["metadatas"])
+            return {i: (m or {}).get("content_hash", "") for i, m in zip(resp.get("ids", []), resp.get("metadatas") or [])}
+        except Exception as e:
+            logging.warning("Chroma get failed, treating session as unindexed: %s", e)
+    return {i: v["metadata"].get("content_hash", "") for i, v in _memory_store.items()
+            if v.get("metadata", {}).get("session_id") == session_id}
+
+
+def add_idea_docs(items: List[Dict[str, Any]]):
+    """Index ideas ({id, text, metadata}) in their own collection (CHROMA_IDEAS_COLLECTION) so they
+    never show up in competency retrieval. Falls back to memory like add_competency_doc."""
+    global _ideas_collection
+    if not items:
+        return 0
+    if _init_chroma_client():
+        try:
+            if _ideas_collection is None:
+                _ideas_collection = _client.get_or_create_collection(name=_ideas_collection_name)
+            # upsert so re-running idea generation re-indexes in place
+            _ideas_collection.upsert(
+                ids=[i["id"] for i in items],
+                documents=[i["text"] for i in items],
+                metadatas=[i.get("metadata") or {} for i in items],
+            )
+            return len(items)
+        except Exception as e:
+            logging.warning("Chroma idea upsert failed, falling back to memory store: %s", e)
+    for i in items:
+        _memory_ideas[i["id"]] = {"text": i["text"], "metadata": i.get("metadata") or {}}
+    return len(items)
+
+
 def query_similar(text: str, n_results: int = 5) -> List[Dict[str, Any]]:
     """Return a list of matches with at least ids and distances (if available) and metadatas.
     If Chroma available, return chroma response; otherwise do a simple substring scoring on memory store.
@@ -1,27 +1,63 @@
 # src/workflow.py
 import os
-from typing_extensions import TypedDict
+import json
+import hashlib
+import asyncio
+import logging
+import time
+from typing_extensions import TypedDict, Annotated
 
 # LangGraph StateGraph primitives (installed version 0.3.12)
 from langgraph.graph import StateGraph, START, END
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langchain_core.runnables import RunnableLambda
 
-from src.nodes.search_agent import search_company
-from src.nodes.competency_extractor import extract_from_snippets, extract_with_clarifications
-from src.nodes.gap_analyzer import ask_gaps_for_competencies
-from src.nodes.idea_generator import generate_ideas_from_csv
+from src.nodes.search_agent import search_company_with_source, asearch_company_with_source
+from src.nodes.competency_extractor import (
+    extract_from_snippets,
+    extract_with_clarifications,
+    refine_competencies_delta,
+    aextract_from_snippets,
+    aextract_with_clarifications,
+    arefine_competencies_delta,
+    answer_key,
+)
+from src.nodes.gap_analyzer import ask_gaps_for_competencies, aask_gaps_for_competencies
+from src.utils.snippet_dedup import dedupe_snippets
+from src.search_cache import normalize_company_name
+from src.nodes.idea_generator import generate_ideas_from_csv, agenerate_ideas_from_csv
 from src.nodes.template_generator import generate_evaluation_template
 from src.nodes.idea_selector import score_and_select_top
 from src.nodes.action_plan_writer import generate_action_plans
+from src.nodes.analogy_finder import enrich_ideas_with_analogies, aenrich_ideas_with_analogies
+from src.nodes.semantic_reasoner import index_ideas_for_session
+from src.db.mongo import bulk_upsert
+from src.streaming.progress_bus import progress_bus, TokenBuffer
+
+# "delta" sends only new answers + the current list; "full" re-extracts from all snippets each round
+REFINE_MODE = os.getenv("REFINE_MODE", "delta").lower()
+
+def _merge_dicts(left: dict, right: dict) -> dict:
+    return {**(left or {}), **(right or {})}
 
 # Define the shape of your graph state (optional fields allowed)
 class SessionState(TypedDict, total=False):
     company_name: str
     session_id: str
     snippets: list
+    search_source: str
+    search_fingerprint: str
+    dedupe_fingerprint: str
+    extract_fingerprint: str
+    snippet_dedup_report: dict
     extracted_competencies: list
     gap_questions: list
     answers: list
+    processed_answers: list
     generated_ideas: list
+    indexed_ideas: int
+    # written by several parallel branches in the same step, so merged by a reducer
+    branch_timings: Annotated[dict, _merge_dicts]
     evaluation_template_path: str
     selected_ideas: list
     action_plan_file: str
@@ -31,33 +67,107 @@ class SessionState(TypedDict, total=False):
 builder = StateGraph(SessionState)
 
 # --- Nodes ---
+def _fingerprint(value) -> str:
+    return hashlib.blake2b(json.dumps(value, sort_keys=True, default=str).encode("utf-8"), digest_size=12).hexdigest()
+
+def search_fingerprint(company_name: str) -> str:
+    return _fingerprint(normalize_company_name(company_name or ""))
+
+def snippets_fingerprint(snippets: list) -> str:
+    return _fingerprint([[s.get("url", ""), s.get("snippet", "")] for s in snippets or []])
+
 def node_search(state: SessionState) -> dict:
     # perform the web search / snippet retrieval
-    snippets = search_company(state["company_name"])
-    return {"snippets": snippets}
+    snippets, source = search_company_with_source(state["company_name"])
+    return {"snippets": snippets, "search_source": source,
+            "search_fingerprint": search_fingerprint(state["company_name"])}
+
+def node_dedupe_snippets(state: SessionState) -> dict:
+    # drop near-duplicate snippets and enforce the per-session character budget before extraction
+    if state.get("dedupe_fingerprint") and state["dedupe_fingerprint"] == snippets_fingerprint(state.get("snippets")):
+        return {}   # already deduped; keep the original report
+    snippets, report = dedupe_snippets(state.get("snippets", []))
+    logging.getLogger("workflow").info(
+        f"Snippet dedupe: kept {report['kept_snippets']}/{report['input_snippets']}, "
+        f"~{report['tokens_saved_est']} input tokens saved"
+    )
+    return {"snippets": snippets, "snippet_dedup_report": report, "dedupe_fingerprint": snippets_fingerprint(snippets)}
 
 def node_extract(state: SessionState) -> dict:
     comps = extract_from_snippets(state["session_id"], state.get("snippets", []))
-    return {"extracted_competencies": comps}
+    return {"extracted_competencies": comps, "extract_fingerprint": snippets_fingerprint(state.get("snippets", []))}
+
+# --- Routers: skip stages whose inputs haven't changed since they last ran ---
+def route_from_start(state: SessionState) -> str:
+    if state.get("snippets") and state.get("search_fingerprint") == search_fingerprint(state.get("company_name")):
+        logging.getLogger("workflow").info("Skipping search: snippets present for this company")
+        return "dedupe_snippets"
+    return "search"
+
+def route_after_dedupe(state: SessionState) -> str:
+    # also protects refined competencies from being overwritten by a fresh extraction
+    if state.get("extracted_competencies") and state.get("extract_fingerprint") == snippets_fingerprint(state.get("snippets")):
+        logging.getLogger("workflow").info("Skipping extraction: snippets unchanged")
+        return "ask_gaps"
+    return "extract"
+
+def _new_answers(state: SessionState):
+    # answers not processed in an earlier round; returns (all_answers, processed_keys, new_answers)
+    answers = state.get("answers") or []
+    processed = set(state.get("processed_answers") or [])
+    new_answers = [a for a in answers if answer_key(a) not in processed and str(a.get("answer", "")).strip()]
+    return answers, processed, new_answers
 
 def node_refine(state: SessionState) -> dict:
-    # if answers/clarifications provided, refine extraction
-    if state.get("answers"):
-        refined = extract_with_clarifications(state["session_id"], state.get("snippets", []), state.get("answers", []))
-        # update state in-place so later nodes see refined list
-        state["extracted_competencies"] = refined
-    questions = ask_gaps_for_competencies(state.get("extracted_competencies", []))
-    return {"gap_questions": questions}
+    # if answers/clarifications provided, refine extraction — only answers not processed in an earlier round
+    update = {}
+    answers, processed, new_answers = _new_answers(state)
+    competencies = state.get("extracted_competencies", [])
+    if new_answers:
+        refined = None
+        if competencies and REFINE_MODE == "delta":
+            # send only the current list + new answers and apply add/update/remove ops
+            refined, _ = refine_competencies_delta(state["session_id"], competencies, new_answers)
+        if refined is None:
+            refined = extract_with_clarifications(state["session_id"], state.get("snippets", []), answers)
+        competencies = refined
+        update["extracted_competencies"] = refined
+        update["processed_answers"] = sorted(processed | {answer_key(a) for a in answers})
+    questions = ask_gaps_for_competencies(competencies)
+    update["gap_questions"] = questions
+    return update
 
 def node_generate_ideas(state: SessionState) -> dict:
-    # generate/store ideas (unique key name to avoid collisions)
-    ideas = generate_ideas_from_csv(state["session_id"], max_ideas=10)
+    # generate/store ideas (unique key name to avoid collisions); tokens go to the session's
+    # progress stream (/sessions/{id}/stream?stage=ideas)
+    tokens = TokenBuffer(progress_bus, state["session_id"], stage="ideas")
+    ideas = generate_ideas_from_csv(state["session_id"], max_ideas=10, on_token=tokens)
+    tokens.flush()
     return {"generated_ideas": ideas}
 
+# --- Post-idea branches: independent, so they run in parallel and join before select_ideas ---
+def node_enrich_analogies(state: SessionState) -> dict:
+    start = time.perf_counter()
+    ideas, changed = enrich_ideas_with_analogies(state.get("generated_ideas", []))
+    bulk_upsert("ideas", changed)
+    return {"generated_ideas": ideas, "branch_timings": {"enrich_analogies": round(time.perf_counter() - start, 3)}}
+
 def node_generate_template(state: SessionState) -> dict:
-    # produce evaluation template CSV (writes to current working dir by default)
-    path = generate_evaluation_template(state["session_id"], os.getcwd())
-    return {"evaluation_template_path": path}
+    # produce evaluation template CSV (writes to current working dir by default); built from the
+    # ideas in state, since enrich_analogies is upserting the ideas collection concurrently
+    start = time.perf_counter()
+    path = generate_evaluation_template(state["session_id"], os.getcwd(), state.get("generated_ideas", []))
+    return {"evaluation_template_path": path, "branch_timings": {"generate_template": round(time.perf_counter() - start, 3)}}
+
+def node_index_ideas(state: SessionState) -> dict:
+    start = time.perf_counter()
+    count = index_ideas_for_session(state["session_id"], state.get("generated_ideas", []))
+    return {"indexed_ideas": count, "branch_timings": {"index_ideas": round(time.perf_counter() - start, 3)}}
+
+def node_join_post_ideas(state: SessionState) -> dict:
+    timings = state.get("branch_timings") or {}
+    logging.getLogger("workflow").info(f"Post-idea branches finished: {timings}")
+    return {}
 
 def node_select_ideas(state: SessionState) -> dict:
     # select top ideas from an evaluation CSV path stored in state["evaluation_csv"]
@@ -68,25 +178,186 @@ def node_generate_action_plans(state: SessionState) -> dict:
     path = generate_action_plans(state["session_id"], state.get("selected_ideas", []), os.getcwd())
     return {"action_plan_file": path}
 
+# --- Async nodes: used by app_graph.ainvoke/astream. Gemini calls are awaited on the event loop;
+# blocking work (Mongo, Chroma, pandas, file I/O) runs in worker threads ---
+async def anode_search(state: SessionState) -> dict:
+    snippets, source = await asearch_company_with_source(state["company_name"])
+    return {"snippets": snippets, "search_source": source,
+            "search_fingerprint": search_fingerprint(state["company_name"])}
+
+async def anode_dedupe_snippets(state: SessionState) -> dict:
+    return await asyncio.to_thread(node_dedupe_snippets, state)
+
+async def anode_extract(state: SessionState) -> dict:
+    comps = await aextract_from_snippets(state["session_id"], state.get("snippets", []))
+    return {"extracted_competencies": comps, "extract_fingerprint": snippets_fingerprint(state.get("snippets", []))}
+
+async def anode_refine(state: SessionState) -> dict:
+    update = {}
+    answers, processed, new_answers = _new_answers(state)
+    competencies = state.get("extracted_competencies", [])
+    if new_answers:
+        refined = None
+        if competencies and REFINE_MODE == "delta":
+            refined, _ = await arefine_competencies_delta(state["session_id"], competencies, new_answers)
+        if refined is None:
+            refined = await aextract_with_clarifications(state["session_id"], state.get("snippets", []), answers)
+        competencies = refined
+        update["extracted_competencies"] = refined
+        update["processed_answers"] = sorted(processed | {answer_key(a) for a in answers})
+    update["gap_questions"] = await aask_gaps_for_competencies(competencies)
+    return update
+
+async def anode_generate_ideas(state: SessionState) -> dict:
+    tokens = TokenBuffer(progress_bus, state["session_id"], stage="ideas")
+    ideas = await agenerate_ideas_from_csv(state["session_id"], max_ideas=10, on_token=tokens)
+    tokens.flush()
+    return {"generated_ideas": ideas}
+
+async def anode_enrich_analogies(state: SessionState) -> dict:
+    start = time.perf_counter()
+    ideas, changed = await aenrich_ideas_with_analogies(state.get("generated_ideas", []))
+    await asyncio.to_thread(bulk_upsert, "ideas", changed)
+    return {"generated_ideas": ideas, "branch_timings": {"enrich_analogies": round(time.perf_counter() - start, 3)}}
+
+async def anode_generate_template(state: SessionState) -> dict:
+    return await asyncio.to_thread(node_generate_template, state)
+
+async def anode_index_ideas(state: SessionState) -> dict:
+    return await asyncio.to_thread(node_index_ideas, state)
+
+async def anode_select_ideas(state: SessionState) -> dict:
+    return await asyncio.to_thread(node_select_ideas, state)
+
+async def anode_generate_action_plans(state: SessionState) -> dict:
+    return await asyncio.to_thread(node_generate_action_plans, state)
+
+def _node(func, afunc=None):
+    # one node, two implementations: invoke() runs func, ainvoke()/astream() run afunc
+    return RunnableLambda(func, afunc=afunc) if afunc else func
+
 # --- Add nodes (ensure node keys are unique and won't collide with state keys) ---
-builder.add_node("search", node_search)
-builder.add_node("extract", node_extract)
-builder.add_node("ask_gaps", node_refine)
-builder.add_node("generate_ideas", node_generate_ideas)
-builder.add_node("generate_template", node_generate_template)
-builder.add_node("select_ideas", node_select_ideas)
-builder.add_node("generate_action_plans", node_generate_action_plans)
-
-# --- Define edges (linear flow) ---
-builder.add_edge(START, "search")
-builder.add_edge("search", "extract")
+builder.add_node("search", _node(node_search, anode_search))
+builder.add_node("dedupe_snippets", _node(node_dedupe_snippets, anode_dedupe_snippets))
+builder.add_node("extract", _node(node_extract, anode_extract))
+builder.add_node("ask_gaps", _node(node_refine, anode_refine))
+builder.add_node("generate_ideas", _node(node_generate_ideas, anode_generate_ideas))
+builder.add_node("enrich_analogies", _node(node_enrich_analogies, anode_enrich_analogies))
+builder.add_node("generate_template", _node(node_generate_template, anode_generate_template))
+builder.add_node("index_ideas", _node(node_index_ideas, anode_index_ideas))
+builder.add_node("join_post_ideas", node_join_post_ideas)
+builder.add_node("select_ideas", _node(node_select_ideas, anode_select_ideas))
+builder.add_node("generate_action_plans", _node(node_generate_action_plans, anode_generate_action_plans))
+
+# --- Define edges (linear flow; search/extract are skipped when their inputs are unchanged) ---
+builder.add_conditional_edges(START, route_from_start, ["search", "dedupe_snippets"])
+builder.add_edge("search", "dedupe_snippets")
+builder.add_conditional_edges("dedupe_snippets", route_after_dedupe, ["extract", "ask_gaps"])
 builder.add_edge("extract", "ask_gaps")
 # stop here by default (human-in-the-loop). Later we resume into generate_ideas
 builder.add_edge("ask_gaps", "generate_ideas")
-builder.add_edge("generate_ideas", "generate_template")
-builder.add_edge("generate_template", "select_ideas")
+# fan out after idea generation; the join waits for all three branches
+POST_IDEA_BRANCHES = ["enrich_analogies", "generate_template", "index_ideas"]
+for branch in POST_IDEA_BRANCHES:
+    builder.add_edge("generate_ideas", branch)
+builder.add_edge(POST_IDEA_BRANCHES, "join_post_ideas")
+builder.add_edge("join_post_ideas", "select_ideas")
 builder.add_edge("select_ideas", "generate_action_plans")
 builder.add_edge("generate_action_plans", END)
 
+# --- Checkpointer: persist graph state per session so resumes continue from the interrupted node ---
+WORKFLOW_CHECKPOINTER = os.getenv("WORKFLOW_CHECKPOINTER", "sqlite").lower()   # sqlite | mongo | memory
+WORKFLOW_CHECKPOINT_DB = os.getenv("WORKFLOW_CHECKPOINT_DB", "./checkpoints.sqlite")
+
+
+class ThreadedCheckpointSaver(BaseCheckpointSaver):
+    """
+    Gives a sync-only checkpointer (SqliteSaver, MongoDBSaver) the async interface ainvoke/astream
+    need by running each sync call in a worker thread, so one saver serves both graph modes.
+    """
+
+    def __init__(self, saver: BaseCheckpointSaver):
+        super().__init__(serde=saver.serde)
+        self.saver = saver
+
+    @property
+    def config_specs(self):
+        return self.saver.config_specs
+
+    def get_tuple(self, config):
+        return self.saver.get_tuple(config)
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        return self.saver.list(config, filter=filter, before=before, limit=limit)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        return self.saver.put(config, checkpoint, metadata, new_versions)
+
+    def put_writes(self, config, writes, task_id, task_path: str = ""):
+        return self.saver.put_writes(config, writes, task_id, task_path)
+
+    def get_next_version(self, current, channel):
+        return self.saver.get_next_version(current, channel)
+
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.saver.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        items = await asyncio.to_thread(
+            lambda: list(self.saver.list(config, filter=filter, before=before, limit=limit))
+        )
+        for item in items:
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await asyncio.to_thread(self.saver.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path: str = ""):
+        return await asyncio.to_thread(self.saver.put_writes, config, writes, task_id, task_path)
+
+
+def _build_checkpointer():
+    """Return a LangGraph checkpointer; falls back to in-memory if the backend package is missing."""
+    try:
+        if WORKFLOW_CHECKPOINTER == "sqlite":
+            import sqlite3
+            from langgraph.checkpoint.sqlite import SqliteSaver
+            conn = sqlite3.connect(WORKFLOW_CHECKPOINT_DB, check_same_thread=False)
+            return ThreadedCheckpointSaver(SqliteSaver(conn))
+        if WORKFLOW_CHECKPOINTER == "mongo":
+            from langgraph.checkpoint.mongodb import MongoDBSaver
+            from src.db.mongo import client
+            return ThreadedCheckpointSaver(MongoDBSaver(client, db_name="ai_innovation"))
+    except Exception as e:
+        logging.warning("Checkpointer '%s' unavailable, using in-memory checkpoints: %s", WORKFLOW_CHECKPOINTER, e)
+    from langgraph.checkpoint.memory import MemorySaver
+    return MemorySaver()
+
+
+checkpointer = _build_checkpointer()
+
+
+def thread_config(session_id: str) -> dict:
+    # one LangGraph thread per session
+    return {"configurable": {"thread_id": session_id}}
+
+
+def has_checkpoint(session_id: str) -> bool:
+    """True if the graph has saved state for this session (i.e. it can resume instead of restarting)."""
+    try:
+        snapshot = app_graph.get_state(thread_config(session_id))
+        return bool(snapshot and snapshot.values)
+    except Exception:
+        return False
+
+
+async def ahas_checkpoint(session_id: str) -> bool:
+    try:
+        snapshot = await app_graph.aget_state(thread_config(session_id))
+        return bool(snapshot and snapshot.values)
+    except Exception:
+        return False
+
+
 # Compile the graph into a runnable object
-app_graph = builder.compile()
+app_graph = builder.compile(checkpointer=checkpointer)